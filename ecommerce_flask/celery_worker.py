@@ -6,5 +6,6 @@ from ecom import create_app
 from ecom.extensions import celery
 
 load_dotenv(".env")
-app = create_app()
+# only what tasks need, no API / swagger / admin / socket.io
+app = create_app(role="celery")
 app.app_context().push()
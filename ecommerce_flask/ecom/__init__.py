@@ -4,36 +4,24 @@ from os import getenv
 import pymysql
 
 from ecom.auth.models import User
-from flask import Flask, Blueprint, jsonify, redirect
-from flask_restx import Api as RestX_Api
-from ecom.auth.v1 import auth_api_v1
-from ecom.commands import ecom_cli
-
-from ecom import extensions
-
-api_blueprint = Blueprint("api", __name__, url_prefix="/api")
-
-authorizations = {
-    "JWT Token Authentication": {
-        "type": "apiKey",
-        "in": "header",
-        "name": "Authorization",
-        "key": "Bearer xxxx",
-    }
-}
-
-
-# initialize restx
-rest_api = RestX_Api(
-    api_blueprint,
-    title="ECOM",
-    version="1.0",
-    description="Swagger UI / API specs for ECOM application",
-    authorizations=authorizations,
-)
-
-
-rest_api.add_namespace(auth_api_v1, path="/v1/auth")
+from flask import Flask, jsonify, redirect
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# mailer / sweeper / catalog feed / cart persist / reservations / order tasks
+# define celery tasks, imported so every role registers them
+from ecom import extensions, mailer, metrics
+from ecom.auth import audit, hashing, identity_cache, sweeper
+from ecom.cart import persist as cart_persist
+from ecom.catalog import feed as catalog_feed
+from ecom.catalog import index as catalog_index
+from ecom.catalog import search as catalog_search
+from ecom.inventory import reservations
+from ecom.orders import tasks as order_tasks
+
+ROLE_WEB = "web"
+ROLE_CELERY = "celery"
+ROLE_CLI = "cli"
+ROLES = (ROLE_WEB, ROLE_CELERY, ROLE_CLI)
 
 # mysql driver required for sqlalchemy
 pymysql.install_as_MySQLdb()
@@ -44,19 +32,39 @@ logging.basicConfig(
 )
 
 
-def create_app():
-    """Create the flask app and intialize all the extensions"""
+def create_app(role: str = None):
+    """Create the flask app and intialize all the extensions
+
+    Args:
+        role (str, optional): process role, one of ROLES. Only "web" registers the
+            RestX API / swagger spec, admin, socket.io and metrics, "celery" only
+            what tasks need. Defaults to None (`APP_ROLE` of the config).
+    """
 
     # flask app
     app = Flask(__name__)
 
-    # register blueprint with application
-    app.register_blueprint(api_blueprint)
-
     # load env specific configs
     app.config.from_object(get_config_object_path())
+    if role is not None:
+        app.config["APP_ROLE"] = role
+    role = app.config["APP_ROLE"]
+    if role not in ROLES:
+        raise ValueError(f"Unknown app role {role}, expected one of {ROLES}")
 
-    # initialize all extensions
+    if app.config["PROXY_FIX_X_FOR"]:
+        # request.remote_addr is then the address the trusted proxies saw,
+        # entries a client wrote into X-Forwarded-For itself are ignored
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+
+    if role == ROLE_WEB:
+        # imported here, celery workers never load restx / swagger / the routes
+        from ecom.api import api_blueprint
+
+        # register blueprint with application
+        app.register_blueprint(api_blueprint)
+
+    # initialize all extensions (optional ones per role, see ROLE_EXTENSIONS)
     extensions.init_extensions(app)
 
     extensions.init_celery(app)
@@ -64,25 +72,41 @@ def create_app():
     # praetorian (JWT token) intialize
     extensions.guard.init_app(app, User)
 
-    app.cli.add_command(ecom_cli)
-
-    # 404 route handler
-    @app.errorhandler(404)
-    def route_not_present(err):
-        return (
-            jsonify(
-                {
-                    "success": False,
-                    "error": {"errorCode": err.code, "message": err.description},
-                }
-            ),
-            404,
-        )
-
-    # redirect the root to /api for easy access of swagger docs for devs
-    @app.route("/")
-    def redirect_to_swagger_spec():
-        return redirect("/api")
+    if role == ROLE_WEB:
+        # request latency / SQL / cache instrumentation on /api/metrics
+        metrics.init_metrics(app)
+        metrics.register_gauges("identity_cache", identity_cache.stats)
+        metrics.register_gauges("password_hash_pool", hashing.stats)
+        metrics.register_gauges("db_pool", extensions.db.pool_stats)
+        metrics.register_gauges("audit", audit.stats)
+        metrics.register_gauges("otp_purge", sweeper.stats)
+        metrics.register_gauges("catalog_index", catalog_index.stats)
+        metrics.register_gauges("catalog_search", catalog_search.stats)
+        metrics.register_gauges("cart", cart_persist.stats)
+        metrics.register_gauges("inventory", reservations.stats)
+
+        # 404 route handler
+        @app.errorhandler(404)
+        def route_not_present(err):
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": {"errorCode": err.code, "message": err.description},
+                    }
+                ),
+                404,
+            )
+
+        # redirect the root to /api for easy access of swagger docs for devs
+        @app.route("/")
+        def redirect_to_swagger_spec():
+            return redirect("/api")
+
+    if role != ROLE_CELERY:
+        from ecom.commands import ecom_cli
+
+        app.cli.add_command(ecom_cli)
 
     @app.shell_context_processor
     def shell_context():  # pylint: disable=unused-variable # pragma: no cover
@@ -0,0 +1,41 @@
+from flask import Blueprint
+from flask_restx import Api as RestX_Api
+
+from ecom.auth.v1 import auth_api_v1
+from ecom.cart.v1 import cart_api_v1
+from ecom.catalog.v1 import catalog_api_v1, search_api_v1
+from ecom.inventory.v1 import inventory_api_v1
+from ecom.orders.v1 import orders_api_v1
+from ecom.utils import json_encoder
+
+api_blueprint = Blueprint("api", __name__, url_prefix="/api")
+
+authorizations = {
+    "JWT Token Authentication": {
+        "type": "apiKey",
+        "in": "header",
+        "name": "Authorization",
+        "key": "Bearer xxxx",
+    }
+}
+
+
+# initialize restx
+rest_api = RestX_Api(
+    api_blueprint,
+    title="ECOM",
+    version="1.0",
+    description="Swagger UI / API specs for ECOM application",
+    authorizations=authorizations,
+)
+
+
+# faster encoder, handles datetime / Decimal / UUID / rows, see JSON_BACKEND
+rest_api.representation("application/json")(json_encoder.output_json)
+
+rest_api.add_namespace(auth_api_v1, path="/v1/auth")
+rest_api.add_namespace(catalog_api_v1, path="/v1/catalog")
+rest_api.add_namespace(search_api_v1, path="/v1/search")
+rest_api.add_namespace(cart_api_v1, path="/v1/cart")
+rest_api.add_namespace(inventory_api_v1, path="/v1/inventory")
+rest_api.add_namespace(orders_api_v1, path="/v1/orders")
@@ -0,0 +1,183 @@
+"""Audit trail of logins, token refreshes and password changes.
+
+`record` only appends to an in-process ring buffer, the request never waits
+on the database. A background thread per worker process drains the buffer
+every `AUDIT_FLUSH_INTERVAL` seconds, or as soon as a full batch is waiting,
+with one bulk INSERT per `AUDIT_BATCH_SIZE` events and one UPDATE of
+`users.last_login_at` per batch of logins.
+
+The buffer holds at most `AUDIT_BUFFER_SIZE` events. When it is full (the
+database is slow or down) events are dropped, the oldest ones by default or
+the incoming ones with `AUDIT_DROP_POLICY = "newest"`, and counted in
+`stats()["dropped"]`.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app as app
+from flask import has_request_context, request
+from sqlalchemy import bindparam, insert, or_, update
+
+from ecom.extensions import db
+
+LOGIN = "login"
+LOGIN_FAILED = "login_failed"
+TOKEN_REFRESH = "token_refresh"
+PASSWORD_CHANGE = "password_change"
+PASSWORD_RESET = "password_reset"
+
+_buffer = deque()
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher_pid = None
+_flusher_app = None
+_stats = {"recorded": 0, "flushed": 0, "dropped": 0, "failed_flushes": 0}
+
+
+def stats() -> dict:
+    """Counters of this worker process, `buffered` is the current backlog."""
+    with _lock:
+        return {**_stats, "buffered": len(_buffer)}
+
+
+def record(event_type, user_id=None, **details):
+    """Buffer an audit event, it is written to the DB by the flusher thread.
+
+    Args:
+        event_type (str): one of the event constants of this module
+        user_id (int, optional): user the event belongs to. Defaults to None.
+        details: extra JSON serializable values stored with the event
+    """
+    if not app.config["AUDIT_ENABLED"]:
+        return
+    _ensure_flusher()
+    event = {
+        "event_type": event_type,
+        "user_id": user_id,
+        "ip_address": None,
+        "user_agent": None,
+        "details": details or None,
+        "created_at": datetime.utcnow(),
+    }
+    if has_request_context():
+        # resolved by ProxyFix from the trusted hops only, see PROXY_FIX_X_FOR
+        event["ip_address"] = request.remote_addr
+        event["user_agent"] = (request.user_agent.string or "")[:255]
+
+    with _lock:
+        _stats["recorded"] += 1
+        if len(_buffer) >= app.config["AUDIT_BUFFER_SIZE"]:
+            _stats["dropped"] += 1
+            if app.config["AUDIT_DROP_POLICY"] == "newest":
+                return
+            _buffer.popleft()
+        _buffer.append(event)
+        backlog = len(_buffer)
+    # a full batch is waiting, don't let it grow until the next interval
+    if backlog >= app.config["AUDIT_BATCH_SIZE"]:
+        _wakeup.set()
+
+
+def flush():
+    """Write all buffered events, returns the number of events written."""
+    from ecom.auth.models import AuditEvent, User
+
+    batch_size = app.config["AUDIT_BATCH_SIZE"]
+    written = 0
+    while True:
+        with _lock:
+            batch = [_buffer.popleft() for _ in range(min(batch_size, len(_buffer)))]
+        if not batch:
+            return written
+        try:
+            db.session.execute(insert(AuditEvent.__table__), batch)
+            logins = _last_logins(batch)
+            if logins:
+                users = User.__table__
+                # core update, last login must not bump version_id of the user
+                db.session.execute(
+                    update(users)
+                    .where(users.c.user_id == bindparam("b_user_id"))
+                    .where(
+                        or_(
+                            users.c.last_login_at.is_(None),
+                            users.c.last_login_at < bindparam("b_last_login_at"),
+                        )
+                    )
+                    .values(last_login_at=bindparam("b_last_login_at")),
+                    logins,
+                )
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            _requeue(batch)
+            with _lock:
+                _stats["failed_flushes"] += 1
+            logging.error("Not able to write audit events. Exception : %s" % (exc))
+            return written
+        written += len(batch)
+        with _lock:
+            _stats["flushed"] += len(batch)
+
+
+def _last_logins(batch):
+    last_logins = {}
+    for event in batch:
+        if event["event_type"] == LOGIN and event["user_id"] is not None:
+            last_logins[event["user_id"]] = event["created_at"]
+    return [
+        {"b_user_id": user_id, "b_last_login_at": created_at}
+        for user_id, created_at in last_logins.items()
+    ]
+
+
+def _requeue(batch):
+    """Put a failed batch back in front, within the buffer bound."""
+    with _lock:
+        room = max(app.config["AUDIT_BUFFER_SIZE"] - len(_buffer), 0)
+        if len(batch) > room:
+            _stats["dropped"] += len(batch) - room
+            batch = batch[len(batch) - room :]
+        _buffer.extendleft(reversed(batch))
+
+
+def _ensure_flusher():
+    """Start the flusher thread once per process (workers are forked)."""
+    global _flusher_pid, _flusher_app
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        _flusher_app = app._get_current_object()
+        # events inherited from the parent process are flushed by the parent
+        _buffer.clear()
+    threading.Thread(target=_flush_loop, name="audit-flusher", daemon=True).start()
+
+
+def _flush_loop():
+    interval = _flusher_app.config["AUDIT_FLUSH_INTERVAL"]
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        failed_flushes = _stats["failed_flushes"]
+        with _flusher_app.app_context():
+            flush()
+        if _stats["failed_flushes"] != failed_flushes:
+            # DB is failing, don't retry on every wakeup
+            time.sleep(interval)
+
+
+@atexit.register
+def _flush_at_exit():
+    if _flusher_app is None or _flusher_pid != os.getpid():
+        return
+    with _flusher_app.app_context():
+        flush()
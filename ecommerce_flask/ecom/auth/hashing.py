@@ -0,0 +1,195 @@
+"""Password hashing and verification on a bounded worker pool.
+
+The password KDF is CPU bound and holds the GIL, so running it on the request
+thread pins the whole worker during login storms. Hashing is sent to a per
+process `ProcessPoolExecutor` (or run inline when the pool is disabled); at most
+`PASSWORD_HASH_POOL_MAX_PENDING` operations may be running or queued, anything
+above that is shed right away with a 503 instead of piling up.
+"""
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import current_app as app
+from flask_praetorian.exceptions import AuthenticationError, MissingUserError
+from passlib.context import CryptContext
+from werkzeug.exceptions import ServiceUnavailable
+
+from ecom.extensions import guard
+
+_pwd_ctx = None
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+class HashingPoolBusy(ServiceUnavailable):
+    description = "Too many password operations in progress, please retry later"
+
+
+def _init_worker(ctx_config):
+    global _pwd_ctx
+    _pwd_ctx = CryptContext.from_string(ctx_config)
+
+
+def _hash(plain_password):
+    return _pwd_ctx.hash(plain_password)
+
+
+def _verify(plain_password, hashed_password):
+    return _pwd_ctx.verify(plain_password, hashed_password)
+
+
+class HashingPool:
+    """Runs password operations with a cap on running + queued operations.
+
+    Args:
+        ctx_config (str): serialized passlib CryptContext of the guard
+        workers (int): number of hashing processes, 0 to hash inline
+        max_pending (int): max operations running or waiting for a worker
+        timeout (float): seconds to wait for a result before shedding
+    """
+
+    def __init__(self, ctx_config, workers, max_pending, timeout):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(ctx_config,)
+            )
+        else:
+            _init_worker(ctx_config)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingPoolBusy()
+        if self._executor is None:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # the slot is held until the worker is really done, even after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.rejected += 1
+            raise HashingPoolBusy()
+
+    @property
+    def pending(self) -> int:
+        return self.max_pending - self._slots._value
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_pool() -> HashingPool:
+    """Returns the hashing pool of the current process, creating it on first use."""
+    global _pool, _pool_pid
+    if _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            workers = (
+                app.config["PASSWORD_HASH_POOL_WORKERS"]
+                if app.config["PASSWORD_HASH_POOL_ENABLED"]
+                else 0
+            )
+            _pool = HashingPool(
+                guard.pwd_ctx.to_string(),
+                workers=workers,
+                max_pending=app.config["PASSWORD_HASH_POOL_MAX_PENDING"],
+                timeout=app.config["PASSWORD_HASH_POOL_TIMEOUT"],
+            )
+            _pool_pid = os.getpid()
+            logging.info("Password hashing pool started with %s workers", workers)
+    return _pool
+
+
+def stats() -> dict:
+    """Returns the pending / rejected counters of the hashing pool of this process."""
+    if _pool is None or _pool_pid != os.getpid():
+        return {}
+    return {"pending": _pool.pending, "rejected": _pool.rejected}
+
+
+@contextmanager
+def bulk_hasher(workers: int = None):
+    """Process pool for hashing many passwords at once (imports, CLI).
+
+    Not bounded like the request pool, it is meant for offline jobs.
+
+    Args:
+        workers (int, optional): hashing processes. Defaults to cpu count.
+
+    Yields:
+        callable: takes a list of plain passwords, returns the list of hashes
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(guard.pwd_ctx.to_string(),),
+    ) as executor:
+
+        def hash_many(passwords):
+            chunksize = max(1, len(passwords) // (workers * 4))
+            return list(executor.map(_hash, passwords, chunksize=chunksize))
+
+        yield hash_many
+
+
+def hash_password(plain_password):
+    """Hash a password with the scheme configured on the guard.
+
+    Raises:
+        HashingPoolBusy: when the pool is saturated
+    """
+    return get_pool().run(_hash, plain_password)
+
+
+def verify_password(plain_password, hashed_password):
+    """Verify a password against a hash.
+
+    Raises:
+        HashingPoolBusy: when the pool is saturated
+    """
+    return get_pool().run(_verify, plain_password, hashed_password)
+
+
+def authenticate(username, password):
+    """Same as `guard.authenticate` with the password check done on the pool.
+
+    Args:
+        username (str): email of the user
+        password (str): plain text password
+
+    Returns:
+        User: authenticated user
+    """
+    user = guard.user_class.lookup(username)
+    MissingUserError.require_condition(
+        user is not None,
+        "Could not find the requested user",
+    )
+    AuthenticationError.require_condition(
+        verify_password(password, user.password),
+        "The password is incorrect",
+    )
+    return user
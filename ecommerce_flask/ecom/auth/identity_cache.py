@@ -0,0 +1,342 @@
+"""Two tier read-through cache for the identity lookups done by flask-praetorian.
+
+`User.identify`, `User.lookup` and `User.lookup_active` run on every
+authenticated request. Users are kept as plain column snapshots in a bounded
+in-process LRU (first tier) and in the redis `cache` (second tier), keyed by
+user_id and by email. Roles are only kept in-process, the table is tiny.
+
+Keys touched by a commit are dropped from both tiers in `after_commit` and the
+drop is broadcast over redis pub/sub so other workers clear their first tier.
+Before that the new `version_id` of each changed user is written as a fence, a
+read-through that loaded an older row checks it after its SET and drops the
+entry again, so a concurrent invalidation is never undone by a stale row.
+
+Credential columns are never cached, `User.password` reads the hash from the
+database for the rare login of a cached user.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import current_app as app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import cache, get_redis_client
+from ecom.utils.local_cache import LocalTTLCache
+
+INVALIDATION_CHANNEL = "identity_cache_invalidations"
+CLEAR_ALL = "*"
+_PENDING_KEY = "identity_cache_pending"
+_FENCES_KEY = "identity_cache_fences"
+# columns left out of snapshots, restored users have them unloaded
+EXCLUDED_COLUMNS = frozenset(["passwords"])
+
+# only ever raises the fence, writers may commit out of order
+FENCE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+else
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+_local = LocalTTLCache(maxsize=10000)
+_counters = {"redis_hits": 0, "redis_misses": 0, "invalidations": 0}
+_listener_pid = None
+_listener_lock = threading.Lock()
+_scripts = {}
+
+
+def _user_key(user_id):
+    return f"identity_user_{user_id}"
+
+
+def _email_key(email):
+    return f"identity_email_{email}"
+
+
+def _role_key(role_id):
+    return f"identity_role_{role_id}"
+
+
+def _fence_key(user_id):
+    return f"identity_fence_{user_id}" + CACHE_CLEAR_SAFE_SUFFIX
+
+
+def stats() -> dict:
+    """Returns hit/miss counters of both tiers for this worker."""
+    return {"local": _local.stats(), **_counters}
+
+
+def identify(user_id, load):
+    """Get a user by id from the cache, calling `load` on a miss.
+
+    Args:
+        user_id (int): id of the user
+        load (callable): returns the user from DB or None
+
+    Returns:
+        User: detached user from the cache or the loaded user
+    """
+    if not app.config["IDENTITY_CACHE_ENABLED"]:
+        return load()
+    data = _get(_user_key(user_id))
+    if data is not None:
+        return _restore_user(data)
+    user = load()
+    if user is not None:
+        _store_user(user)
+    return user
+
+
+def lookup(email, load):
+    """Get a user by email from the cache, calling `load` on a miss.
+
+    Args:
+        email (str): email of the user
+        load (callable): returns the user from DB or None
+
+    Returns:
+        User: detached user from the cache or the loaded user
+    """
+    if not app.config["IDENTITY_CACHE_ENABLED"]:
+        return load()
+    data = _get(_email_key(email))
+    if data is not None:
+        return _restore_user(data)
+    user = load()
+    # only cache exact matches, invalidation is done with the stored email
+    if user is not None and user.email == email:
+        _store_user(user)
+    return user
+
+
+def invalidate(keys):
+    """Drop keys from both tiers and tell other workers to drop them as well."""
+    keys = list(keys)
+    _counters["invalidations"] += len(keys)
+    for key in keys:
+        _local.delete(key)
+    try:
+        cache.delete_many(*keys)
+    except Exception:
+        logging.error("Not able to delete identity keys from cache - %s", keys)
+    _broadcast(keys)
+
+
+def invalidate_user(user_id, *emails):
+    invalidate([_user_key(user_id)] + [_email_key(email) for email in emails])
+
+
+def invalidate_users(users):
+    """Same as `invalidate_user` for many (user_id, email) pairs at once."""
+    keys = []
+    for user_id, email in users:
+        keys += [_user_key(user_id), _email_key(email)]
+    invalidate(keys)
+
+
+def _get(key):
+    _ensure_listener()
+    data = _local.get(key)
+    if data is not None:
+        return data
+    data = cache.get(key)
+    if data is None:
+        _counters["redis_misses"] += 1
+        return None
+    _counters["redis_hits"] += 1
+    _local.set(key, data, ttl=app.config["IDENTITY_CACHE_LOCAL_TTL"])
+    return data
+
+
+def _store_user(user):
+    data = _snapshot(user)
+    keys = [_user_key(user.user_id), _email_key(user.email)]
+    for key in keys:
+        _local.set(key, data, ttl=app.config["IDENTITY_CACHE_LOCAL_TTL"])
+        cache.set(key, data, timeout=app.config["IDENTITY_CACHE_TIMEOUT"])
+    # checked after the SET: a fence written before it is seen here, one
+    # written after it is followed by the writer's own invalidation
+    if fence(user.user_id) > user.version_id:
+        for key in keys:
+            _local.delete(key)
+        try:
+            cache.delete_many(*keys)
+        except Exception:
+            logging.error("Not able to delete identity keys from cache - %s", keys)
+
+
+def fence(user_id) -> int:
+    """Newest committed version_id of the user seen by an invalidation, 0 if none."""
+    client = get_redis_client()
+    if client is None:
+        return 0
+    try:
+        return int(client.get(_fence_key(user_id)) or 0)
+    except Exception as exc:
+        logging.error("Not able to read identity fence. Exception : %s" % (exc))
+        return 0
+
+
+def write_fences(fences):
+    """Raise the fences of users changed by a commit, user_id -> new version_id."""
+    client = get_redis_client()
+    if client is None or not fences:
+        return
+    script = _scripts.get(id(client))
+    if script is None:
+        script = _scripts[id(client)] = client.register_script(FENCE_SCRIPT)
+    timeout = app.config["IDENTITY_CACHE_TIMEOUT"]
+    try:
+        pipe = client.pipeline(transaction=False)
+        for user_id, version in fences.items():
+            script(keys=[_fence_key(user_id)], args=[version, timeout], client=pipe)
+        pipe.execute()
+    except Exception as exc:
+        logging.error("Not able to write identity fences. Exception : %s" % (exc))
+
+
+def _snapshot(obj):
+    mapper = inspect(obj).mapper
+    return {
+        attr.key: getattr(obj, attr.key)
+        for attr in mapper.column_attrs
+        if attr.key not in EXCLUDED_COLUMNS
+    }
+
+
+def _restore(model, data):
+    obj = model(**data)
+    # behaves like an object loaded by an already closed session
+    make_transient_to_detached(obj)
+    return obj
+
+
+def _restore_user(data):
+    from ecom.auth.models import User
+
+    user = _restore(User, data)
+    set_committed_value(user, "role", _get_role(data["role_id"]))
+    return user
+
+
+def _get_role(role_id):
+    from ecom.auth.models import Role
+
+    if role_id is None:
+        return None
+    key = _role_key(role_id)
+    data = _local.get(key)
+    if data is None:
+        role = Role.query.get(role_id)
+        if role is None:
+            return None
+        data = _snapshot(role)
+        _local.set(key, data, ttl=app.config["IDENTITY_CACHE_LOCAL_TTL"])
+    return _restore(Role, data)
+
+
+def _broadcast(keys):
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+    except Exception:
+        logging.error("Not able to broadcast identity cache invalidation - %s", keys)
+
+
+def _ensure_listener():
+    """Start the pub/sub listener once per process (workers are forked)."""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        _local.maxsize = app.config["IDENTITY_CACHE_LOCAL_MAXSIZE"]
+        # entries inherited from the parent process missed its invalidations
+        _local.clear()
+        client = get_redis_client()
+        if client is not None:
+            threading.Thread(
+                target=_listen, args=(client,), name="identity-cache", daemon=True
+            ).start()
+
+
+def _listen(client):
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                keys = json.loads(message["data"])
+                if CLEAR_ALL in keys:
+                    _local.clear()
+                    continue
+                for key in keys:
+                    _local.delete(key)
+        except Exception as exc:
+            logging.error("Identity cache listener failed. Exception : %s" % (exc))
+            # invalidations may have been missed while disconnected
+            _local.clear()
+            time.sleep(1)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    from ecom.auth.models import Role, User
+
+    pending = session.info.setdefault(_PENDING_KEY, set())
+    fences = session.info.setdefault(_FENCES_KEY, {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            pending.add(_user_key(obj.user_id))
+            # deletes don't bump version_id, rows loaded before stay stale
+            version = obj.version_id + (1 if obj in session.deleted else 0)
+            fences[obj.user_id] = max(version, fences.get(obj.user_id, 0))
+            # old and new email when the email got changed
+            for email in inspect(obj).attrs.email.history.sum():
+                pending.add(_email_key(email))
+        elif isinstance(obj, Role):
+            pending.add(_role_key(obj.role_id))
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _collect_bulk_changes(update_context):
+    from ecom.auth.models import Role, User
+
+    mapper = getattr(update_context, "mapper", None)
+    if mapper is None or mapper.class_ in (Role, User):
+        # affected ids are unknown, redis entries expire with IDENTITY_CACHE_TIMEOUT
+        update_context.session.info.setdefault(_PENDING_KEY, set()).add(CLEAR_ALL)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    keys = session.info.pop(_PENDING_KEY, None)
+    fences = session.info.pop(_FENCES_KEY, None)
+    if not keys:
+        return
+    write_fences(fences)
+    if CLEAR_ALL in keys:
+        logging.warning("Bulk change of users/roles, clearing local identity caches")
+        _local.clear()
+    invalidate(keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_FENCES_KEY, None)
@@ -1,7 +1,8 @@
 from ecom.utils import UserAlreadyExists, UserDoesNotExist
-from ecom.extensions import admin, db, guard, mm
+from ecom.auth import hashing, identity_cache
+from ecom.auth.token_versions import forget_user_version
+from ecom.extensions import db, guard, mm
 from flask import current_app as app
-from flask_admin.contrib.sqla import ModelView
 from enum import unique
 import logging
 from datetime import datetime
@@ -17,6 +18,7 @@ from sqlalchemy import (
     JSON,
     NVARCHAR,
     TEXT,
+    BigInteger,
     Boolean,
     Column,
     Date,
@@ -29,6 +31,7 @@ from sqlalchemy import (
     Table,
     Text,
     func,
+    inspect,
     text,
 )
 
@@ -37,8 +40,6 @@ from sqlalchemy.dialects.mssql import BIT, DATETIME2
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.sql.schema import UniqueConstraint
-from wtforms import PasswordField
-from wtforms.fields.simple import TextAreaField
 
 
 class Role(db.Model):
@@ -81,15 +82,28 @@ class User(db.Model):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
     is_active = Column(INTEGER, nullable=False, server_default=text("1"))
-    passwords = Column(Text, nullable=False)
+    # passlib hashes are ~130 characters, bounded so it can stay in row / index
+    passwords = Column(String(255), nullable=False)
     role_id = Column(
         INTEGER,
         ForeignKey(Role.role_id, name="users_ibfk_1", ondelete="SET NULL"),
         nullable=True,
     )
     password_changed_at = Column(DateTime, server_default=text("NULL"))
+    # written in bulk by the audit flusher, see ecom.auth.audit
+    last_login_at = Column(DateTime, nullable=True)
+    # bumped by sqlalchemy on every update, embedded in JWT tokens as `ver` claim
+    version_id = Column(INTEGER, nullable=False, server_default=text("1"))
     role = relationship("Role", backref="users", lazy=True)
 
+    __mapper_args__ = {"version_id_col": version_id}
+    __table_args__ = (
+        # keyset pagination on created_at, see ecom.utils.pagination
+        Index("ix_users_created_at_user_id", "created_at", "user_id"),
+        # lookup_active, email equality and is_active served by one index
+        Index("ix_users_email_is_active", "email", "is_active"),
+    )
+
     def __repr__(self):
         return "<User %r>" % str(self.username)
 
@@ -108,11 +122,13 @@ class User(db.Model):
 
     @classmethod
     def lookup(cls, email):
-        return cls.query.filter_by(email=email).first()
+        return identity_cache.lookup(
+            email, lambda: cls.query.filter_by(email=email).first()
+        )
 
     @classmethod
     def identify(cls, id):
-        return cls.query.get(id)
+        return identity_cache.identify(id, lambda: cls.query.get(id))
 
     @property
     def rolenames(self):
@@ -123,7 +139,8 @@ class User(db.Model):
 
     @classmethod
     def lookup_active(cls, email):
-        return cls.query.filter_by(email=email, is_active=1).first()
+        user = cls.lookup(email)
+        return user if user is not None and user.is_active else None
 
     # def is_valid(self):
     # to be used while soft delete of user
@@ -132,11 +149,18 @@ class User(db.Model):
     # CUSTOM properties and methods for convinience
     @property
     def password(self):
+        if "passwords" in inspect(self).unloaded:
+            # users restored by the identity cache carry no credentials
+            return (
+                db.session.query(User.passwords)
+                .filter_by(user_id=self.user_id)
+                .scalar()
+            )
         return self.passwords
 
     @password.setter
     def password(self, plain_password):
-        self.passwords = guard.hash_password(plain_password)
+        self.passwords = hashing.hash_password(plain_password)
 
     @property
     def username(self):
@@ -218,6 +242,8 @@ class User(db.Model):
 
         db.session.add(user)
         db.session.commit()
+        # version_id got bumped, claims of already issued tokens are stale now
+        forget_user_version(user.user_id)
         return user
 
 
@@ -225,11 +251,33 @@ class OTP(db.Model):
     __tablename__ = "otp"
     
     id = Column(Integer, primary_key=True)
-    email = Column(String(120), nullable=False, unique=True)
+    # same length as users.email
+    email = Column(String(255), nullable=False, unique=True)
     otp = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # expiry sweeps range scan on created_at
+    __table_args__ = (Index("ix_otp_created_at", "created_at"),)
+
     def __init__(self, email, otp):
         self.email = email
         self.otp = otp
 
+
+class AuditEvent(db.Model):
+    __tablename__ = "audit_events"
+
+    # sqlite only autoincrements INTEGER primary keys
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    event_type = Column(String(50), nullable=False)
+    # no foreign key, events outlive their users and inserts stay cheap
+    user_id = Column(INTEGER, nullable=True)
+    ip_address = Column(String(45))
+    user_agent = Column(String(255))
+    details = Column(JSON)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_audit_events_user_id_created_at", "user_id", "created_at"),
+        Index("ix_audit_events_created_at", "created_at"),
+    )
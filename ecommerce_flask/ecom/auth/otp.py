@@ -0,0 +1,148 @@
+"""One time codes stored in redis with native expiry.
+
+Every code lives in a redis hash `otp_<email>` holding the code and the number
+of failed attempts, with a TTL taken from `AUTH_CODE_EXPIRY_INTERVAL` of the
+channel. Verification is a single Lua script: compare, consume on success,
+count failures and lock the code after `OTP_MAX_ATTEMPTS`. When redis is not
+available the `otp` SQL table is used instead (no attempt counting there).
+"""
+
+import logging
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app as app
+from redis.exceptions import RedisError
+
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import db, get_redis_client
+
+OTP_VERIFIED = "verified"
+OTP_INVALID = "invalid"
+OTP_EXPIRED = "expired"
+OTP_LOCKED = "locked"
+
+# KEYS[1] otp hash, ARGV[1] submitted code, ARGV[2] max attempts
+VERIFY_SCRIPT = """
+local stored = redis.call('HGET', KEYS[1], 'code')
+if not stored then
+    return -1
+end
+local attempts = tonumber(redis.call('HGET', KEYS[1], 'attempts') or '0')
+if attempts >= tonumber(ARGV[2]) then
+    return -2
+end
+if stored == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+return 0
+"""
+_SCRIPT_RESULTS = {1: OTP_VERIFIED, 0: OTP_INVALID, -1: OTP_EXPIRED, -2: OTP_LOCKED}
+
+_verify_scripts = {}
+
+
+def _key(email):
+    return f"otp_{email}{CACHE_CLEAR_SAFE_SUFFIX}"
+
+
+def _expiry_seconds(channel):
+    return app.config["AUTH_CODE_EXPIRY_INTERVAL"][channel]
+
+
+def _verify_script(client):
+    # registered once per client, runs with EVALSHA afterwards
+    script = _verify_scripts.get(id(client))
+    if script is None:
+        script = _verify_scripts[id(client)] = client.register_script(VERIFY_SCRIPT)
+    return script
+
+
+def issue_otp(email, channel="mail"):
+    """Create a new code for the email, replacing any previous one.
+
+    Args:
+        email (str): email the code is issued for
+        channel (str, optional): key of AUTH_CODE_EXPIRY_INTERVAL. Defaults to "mail".
+
+    Returns:
+        int: six digit code
+    """
+    code = 100000 + secrets.randbelow(900000)
+    client = get_redis_client()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.delete(_key(email))
+            pipe.hset(_key(email), mapping={"code": code, "attempts": 0})
+            pipe.expire(_key(email), _expiry_seconds(channel))
+            pipe.execute()
+            return code
+        except RedisError as exc:
+            logging.error(
+                "Not able to store OTP in redis, using DB. Exception : %s" % (exc)
+            )
+    _issue_sql(email, code)
+    return code
+
+
+def verify_otp(email, code, channel="mail"):
+    """Check a submitted code and consume it when it matches.
+
+    Args:
+        email (str): email the code was issued for
+        code (Union[int, str]): submitted code
+        channel (str, optional): key of AUTH_CODE_EXPIRY_INTERVAL. Defaults to "mail".
+
+    Returns:
+        str: one of OTP_VERIFIED, OTP_INVALID, OTP_EXPIRED, OTP_LOCKED
+    """
+    client = get_redis_client()
+    if client is not None:
+        try:
+            result = _verify_script(client)(
+                keys=[_key(email)],
+                args=[str(code).strip(), app.config["OTP_MAX_ATTEMPTS"]],
+            )
+            return _SCRIPT_RESULTS[int(result)]
+        except RedisError as exc:
+            logging.error(
+                "Not able to verify OTP in redis, using DB. Exception : %s" % (exc)
+            )
+    return _verify_sql(email, code, channel)
+
+
+def _issue_sql(email, code):
+    from ecom.auth.models import OTP
+
+    record = OTP.query.filter_by(email=email).first()
+    if record is None:
+        record = OTP(email, code)
+    else:
+        record.otp = code
+    record.created_at = datetime.utcnow()
+    db.session.add(record)
+    db.session.commit()
+
+
+def _verify_sql(email, code, channel):
+    from ecom.auth.models import OTP
+
+    try:
+        code = int(str(code).strip())
+    except ValueError:
+        return OTP_INVALID
+    cutoff = datetime.utcnow() - timedelta(seconds=_expiry_seconds(channel))
+    # compare and consume in one statement, concurrent verifications can't both win
+    consumed = OTP.query.filter(
+        OTP.email == email, OTP.otp == code, OTP.created_at >= cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    if consumed:
+        return OTP_VERIFIED
+    record = OTP.query.filter_by(email=email).first()
+    if record is None or record.created_at < cutoff:
+        return OTP_EXPIRED
+    return OTP_INVALID
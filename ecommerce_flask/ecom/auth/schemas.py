@@ -0,0 +1,26 @@
+from marshmallow import fields
+
+from ecom.auth.models import OTP, Role, User
+from ecom.extensions import mm
+
+
+class RoleSchema(mm.SQLAlchemyAutoSchema):
+    class Meta:
+        model = Role
+
+
+class UserSchema(mm.SQLAlchemyAutoSchema):
+    class Meta:
+        model = User
+        include_fk = True
+        # password hash and optimistic lock counter never leave the API
+        exclude = ("passwords", "version_id")
+
+    role_name = fields.String(attribute="role.role_name", dump_only=True)
+
+
+class OTPSchema(mm.SQLAlchemyAutoSchema):
+    class Meta:
+        model = OTP
+        # the code itself is only ever sent by mail
+        exclude = ("otp",)
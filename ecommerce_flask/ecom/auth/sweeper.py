@@ -0,0 +1,138 @@
+"""Periodic purge of expired rows of the `otp` table.
+
+Codes are kept in redis with a TTL, rows only land in the `otp` table when
+redis is not reachable (see ecom.auth.otp) and were never removed. The beat
+task below deletes expired rows in primary key chunks of
+`OTP_PURGE_BATCH_SIZE`, one short transaction per chunk with a pause of
+`OTP_PURGE_THROTTLE_SECONDS` in between, so InnoDB never holds row / gap
+locks on a large range. The numbers of the last run are kept in redis and
+exported as `ecom_otp_purge_*` gauges by every web worker.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app as app
+from sqlalchemy import delete, or_, select
+
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import celery, db, get_redis_client
+
+OTP_PURGE_LOCK_KEY = "otp_purge_lock" + CACHE_CLEAR_SAFE_SUFFIX
+OTP_PURGE_STATS_KEY = "otp_purge_stats" + CACHE_CLEAR_SAFE_SUFFIX
+
+# numbers of runs in this process, used when redis is not available
+_local_stats = {}
+
+
+def stats() -> dict:
+    """Rows purged by the last run and in total, as seen by any worker."""
+    client = get_redis_client()
+    if client is None:
+        return dict(_local_stats)
+    try:
+        return {
+            key.decode() if isinstance(key, bytes) else key: float(value)
+            for key, value in client.hgetall(OTP_PURGE_STATS_KEY).items()
+        }
+    except Exception as exc:
+        logging.error("Not able to read OTP purge stats. Exception : %s" % (exc))
+        return dict(_local_stats)
+
+
+def _record_run(purged, seconds):
+    _local_stats["last_run_purged"] = purged
+    _local_stats["last_run_seconds"] = seconds
+    _local_stats["total_purged"] = _local_stats.get("total_purged", 0) + purged
+    client = get_redis_client()
+    if client is None:
+        return
+    pipe = client.pipeline(transaction=True)
+    pipe.hset(
+        OTP_PURGE_STATS_KEY,
+        mapping={
+            "last_run_purged": purged,
+            "last_run_seconds": round(seconds, 3),
+            "last_run_at": int(time.time()),
+        },
+    )
+    pipe.hincrby(OTP_PURGE_STATS_KEY, "total_purged", purged)
+    pipe.execute()
+
+
+def purge_expired_otps(batch_size=None, throttle=None):
+    """Delete expired OTP rows in primary key chunks.
+
+    Args:
+        batch_size (int, optional): rows per delete. Defaults to OTP_PURGE_BATCH_SIZE.
+        throttle (float, optional): seconds between chunks. Defaults to OTP_PURGE_THROTTLE_SECONDS.
+
+    Returns:
+        int: number of deleted rows
+    """
+    from ecom.auth.models import OTP
+
+    batch_size = batch_size or app.config["OTP_PURGE_BATCH_SIZE"]
+    if throttle is None:
+        throttle = app.config["OTP_PURGE_THROTTLE_SECONDS"]
+    # a row is expired for every channel once the longest expiry has passed
+    cutoff = datetime.utcnow() - timedelta(
+        seconds=max(app.config["AUTH_CODE_EXPIRY_INTERVAL"].values())
+    )
+    expired = or_(OTP.created_at < cutoff, OTP.created_at.is_(None))
+    table = OTP.__table__
+
+    started_at = time.monotonic()
+    purged = 0
+    last_id = 0
+    while True:
+        ids = (
+            db.session.execute(
+                select(OTP.id)
+                .where(OTP.id > last_id, expired)
+                .order_by(OTP.id)
+                .limit(batch_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            break
+        # by primary key, locks exactly the selected rows; expiry is checked
+        # again in case a code was reissued on the row meanwhile
+        result = db.session.execute(
+            delete(table).where(
+                table.c.id.in_(ids),
+                or_(table.c.created_at < cutoff, table.c.created_at.is_(None)),
+            )
+        )
+        db.session.commit()
+        purged += result.rowcount
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+        if throttle:
+            time.sleep(throttle)
+
+    seconds = time.monotonic() - started_at
+    _record_run(purged, seconds)
+    logging.info("Purged %s expired OTPs in %.2fs", purged, seconds)
+    return purged
+
+
+@celery.task(name="ecom.auth.sweeper.purge_expired_otps")
+def purge_expired_otps_task():
+    """Beat task, skipped while a previous run still holds the lock."""
+    client = get_redis_client()
+    lock_timeout = max(app.config["OTP_PURGE_INTERVAL"], 60)
+    if client is not None and not client.set(
+        OTP_PURGE_LOCK_KEY, 1, nx=True, ex=lock_timeout
+    ):
+        logging.info("OTP purge already running, skipped")
+        return 0
+    try:
+        return purge_expired_otps()
+    finally:
+        if client is not None:
+            client.delete(OTP_PURGE_LOCK_KEY)
@@ -0,0 +1,107 @@
+"""Per user token versions used by the stateless `roles_accepted` path.
+
+Every access token carries the user's `version_id` in the `ver` claim and the
+active flag in the `act` claim. A token is trusted without touching the DB only
+while its `ver` claim matches the version published here (in-process first,
+redis second). Any write to the user row bumps `version_id`, so role changes and
+deactivations make the token fall back to the DB check.
+
+A version read from the DB is published only if no newer one was committed
+meanwhile, checked against the fences of `identity_cache`, so a concurrent
+change always wins. Nothing is published with JWT_STATELESS_ROLES off.
+"""
+
+import logging
+
+from flask import current_app as app
+
+from ecom.auth import identity_cache
+from ecom.extensions import cache, guard
+from ecom.utils.local_cache import LocalTTLCache
+
+VERSION_CLAIM = "ver"
+ACTIVE_CLAIM = "act"
+
+_local_versions = LocalTTLCache(maxsize=10000)
+
+
+def _cache_key(user_id):
+    return f"user_version_{user_id}"
+
+
+def encode_user_token(user):
+    """Encode a JWT access token for the user with active flag and version as claims.
+
+    Args:
+        user (User): authenticated user
+
+    Returns:
+        str: JWT access token
+    """
+    publish_user_version(user)
+    custom_claims = {ACTIVE_CLAIM: bool(user.is_active), VERSION_CLAIM: user.version_id}
+    return guard.encode_jwt_token(user, **custom_claims)
+
+
+def publish_user_version(user):
+    """Record the current version of the user in-process and in redis."""
+    if not app.config["JWT_STATELESS_ROLES"]:
+        return
+    _local_versions.set(
+        user.user_id, user.version_id, ttl=app.config["JWT_VERSION_LOCAL_TTL"]
+    )
+    cache.set(
+        _cache_key(user.user_id),
+        user.version_id,
+        timeout=app.config["JWT_VERSION_CACHE_TIMEOUT"],
+    )
+    # checked after the SET: a change committed before it shows in the fence,
+    # one committed after it is followed by its own forget_user_version
+    if identity_cache.fence(user.user_id) > user.version_id:
+        forget_user_version(user.user_id)
+
+
+def forget_user_version(user_id):
+    """Drop the known version of the user, forcing the next check to hit the DB."""
+    _local_versions.delete(user_id)
+    try:
+        cache.delete(_cache_key(user_id))
+    except Exception:
+        logging.error("Not able to delete user version from cache - %s", user_id)
+
+
+def forget_user_versions(user_ids):
+    """Same as `forget_user_version` for many users with a single cache call."""
+    for user_id in user_ids:
+        _local_versions.delete(user_id)
+    try:
+        cache.delete_many(*[_cache_key(user_id) for user_id in user_ids])
+    except Exception:
+        logging.error("Not able to delete user versions from cache")
+
+
+def get_user_version(user_id):
+    """Returns the last published version of the user or None if unknown."""
+    version = _local_versions.get(user_id)
+    if version is None:
+        version = cache.get(_cache_key(user_id))
+        if version is not None:
+            _local_versions.set(
+                user_id, version, ttl=app.config["JWT_VERSION_LOCAL_TTL"]
+            )
+    return version
+
+
+def is_token_current(jwt_data: dict) -> bool:
+    """Check whether the claims of a decoded token still describe the user.
+
+    Args:
+        jwt_data (dict): decoded JWT token
+
+    Returns:
+        bool: True if the `ver` claim matches the published user version
+    """
+    token_version = jwt_data.get(VERSION_CLAIM)
+    if token_version is None:
+        return False
+    return get_user_version(jwt_data.get("id")) == token_version
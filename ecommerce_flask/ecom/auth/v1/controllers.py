@@ -5,21 +5,32 @@ from datetime import datetime, timedelta
 
 from flask import current_app as app
 from flask import request, url_for
-from flask_praetorian.exceptions import AuthenticationError, PraetorianError
+from flask_praetorian.exceptions import (
+    AuthenticationError,
+    MissingUserError,
+    PraetorianError,
+)
 from ecom.extensions import guard
 from itsdangerous import TimedSerializer as Serializer, BadSignature, SignatureExpired
-from flask_mail import Message
 import random
 import datetime
-from ecom.auth.models import User, OTP
-from ecom.extensions import db, mail
+from ecom.auth import audit, hashing, identity_cache
+from ecom.auth.models import Role, User, OTP
+from ecom.auth.schemas import RoleSchema, UserSchema
+from ecom.auth.token_versions import encode_user_token
+from ecom.extensions import db
+from ecom.mailer import queue_mail
 
 from ecom.utils import (
     AuthExeption,
     PasswordSameException,
     Response,
+    check_for_password,
     generate_password,
 )
+from ecom.utils import pagination
+from ecom.utils.serialization import dump, dump_many, parse_fields
+from sqlalchemy.orm import joinedload
 
 
 def get_serializer():
@@ -40,9 +51,11 @@ def verify_token(token):
 
 def send_reset_email(email, token):
     reset_url = url_for('api.reset_password', token=token, _external=True)
-    msg = Message('Password Reset Request', recipients=[email])
-    msg.body = f'Please use the following link to reset your password: {reset_url}'
-    mail.send(msg)
+    queue_mail(
+        'Password Reset Request',
+        recipients=[email],
+        body=f'Please use the following link to reset your password: {reset_url}',
+    )
 
 
 
@@ -65,23 +78,36 @@ def reset_password(token):
     new_password = request.json.get('new_password')
     if not new_password:
         return Response.failure(400, 'New password is required')
+    try:
+        check_for_password(new_password)
+    except ValueError as exc:
+        return Response.failure(400, str(exc))
 
     user = User.query.filter_by(email=email).first()
     if not user:
         return Response.failure(404, 'User not found')
 
     User.update_user(user.user_id, password=new_password)
+    audit.record(audit.PASSWORD_RESET, user.user_id)
 
     return Response.success(200, 'Password updated successfully')
 
 
 def get_access_token(username, password):
     try:
-        user = guard.authenticate(username, password)
-        access_token = guard.encode_jwt_token(user)
+        user = hashing.authenticate(username, password)
+        access_token = encode_user_token(user)
+        audit.record(audit.LOGIN, user.user_id)
         return {"access_token": access_token}
     except AuthExeption as ae:
+        audit.record(audit.LOGIN_FAILED, username=username, reason=ae.msg)
         return Response.failure(ae.err_code, ae.msg, ae.payload)
+    except (MissingUserError, AuthenticationError) as exc:
+        audit.record(audit.LOGIN_FAILED, username=username, reason=exc.message)
+        # same answer for an unknown user and a wrong password
+        return Response.failure(401, "Invalid username or password")
+    except hashing.HashingPoolBusy as busy:
+        return Response.failure(503, payload=busy.description)
     except Exception as exc:
         logging.error(str(exc))
         return Response.failure(500, payload=str(exc))
@@ -94,29 +120,102 @@ def get_refresh_token_from_old_access_token():
         [token]: JWT refresh token
     """
     token = guard.read_token_from_header()
-    token_response = {"access_token": guard.refresh_jwt_token(token)}
+    access_token = guard.refresh_jwt_token(token)
+    audit.record(audit.TOKEN_REFRESH, guard.extract_jwt_token(access_token)["id"])
+    token_response = {"access_token": access_token}
     return token_response
 
 
-def get_user_info():
+def get_user_info(fields=None):
     """Get user information from DB.
 
     Extract user id from jwt token to get user information.
 
+    Args:
+        fields (str, optional): comma separated fields to return. Defaults to None (all).
+
     Returns:
         dict: user information
     """
     token = guard.read_token_from_header()
     user_id = guard.extract_jwt_token(token)["id"]
     user = User.identify(user_id)
-    if user:
-        return Response.success(user)
-    return Response.failure(400, "Unable to identify the user")
+    if not user:
+        return Response.failure(400, "Unable to identify the user")
+    try:
+        return Response.success(dump(UserSchema, user, only=parse_fields(fields)))
+    except ValueError as exc:
+        return Response.failure(400, payload=str(exc))
+
+
+# sort name -> keyset columns, both backed by an index
+USER_SORTS = {
+    "user_id": [User.user_id],
+    "created_at": [User.created_at, User.user_id],
+}
+
+
+def list_users(limit=None, cursor=None, sort="user_id", order="asc", fields=None):
+    """Get a page of users with keyset pagination.
+
+    Args:
+        limit (int, optional): page size. Defaults to PAGINATION_DEFAULT_LIMIT.
+        cursor (str, optional): next/prev cursor of a previous page. Defaults to None.
+        sort (str, optional): one of USER_SORTS. Defaults to "user_id".
+        order (str, optional): "asc" or "desc". Defaults to "asc".
+        fields (str, optional): comma separated fields to return. Defaults to None (all).
+
+    Returns:
+        dict: users with pagination and links
+    """
+    if sort not in USER_SORTS:
+        return Response.failure(400, payload=f"sort must be one of {list(USER_SORTS)}")
+    query = User.query.options(joinedload(User.role))
+    if sort == "created_at":
+        query = query.filter(User.created_at.isnot(None))
+    try:
+        users, page, links = pagination.paginate(
+            query,
+            sort,
+            USER_SORTS[sort],
+            limit=limit,
+            cursor=cursor,
+            descending=order == "desc",
+        )
+        data = dump_many(UserSchema, users, only=parse_fields(fields))
+    except ValueError as exc:
+        return Response.failure(400, payload=str(exc))
+    return Response.success(data, pagination=page, links=links)
+
+
+def list_roles(limit=None, cursor=None, fields=None):
+    """Get a page of roles with keyset pagination on role_id.
+
+    Returns:
+        dict: roles with pagination and links
+    """
+    try:
+        roles, page, links = pagination.paginate(
+            Role.query, "role_id", [Role.role_id], limit=limit, cursor=cursor
+        )
+        data = dump_many(RoleSchema, roles, only=parse_fields(fields))
+    except ValueError as exc:
+        return Response.failure(400, payload=str(exc))
+    return Response.success(data, pagination=page, links=links)
+
+
+def get_identity_cache_stats():
+    """Get hit/miss counters of the identity cache of the serving worker.
+
+    Returns:
+        dict: counters of the in-process and redis tiers
+    """
+    return Response.success(identity_cache.stats())
 
 
 def verify_old_password_and_update_password(username, old_password, new_password):
     try:
-        user = guard.authenticate(username, old_password)
+        user = hashing.authenticate(username, old_password)
         if user.password_changed_at is not None:
             password_changed_days = datetime.datetime.utcnow() - user.password_changed_at
             required_days = app.config["PASSWORD_CHANGE_REQUIRED_DAYS"]
@@ -131,10 +230,17 @@ def verify_old_password_and_update_password(username, old_password, new_password
                 )
     except AuthExeption as ae:
         return Response.failure(ae.err_code, ae.msg, ae.payload)
+    except (MissingUserError, AuthenticationError) as exc:
+        audit.record(audit.LOGIN_FAILED, username=username, reason=exc.message)
+        # same answer for an unknown user and a wrong password
+        return Response.failure(401, "Invalid username or password")
+    except hashing.HashingPoolBusy as busy:
+        return Response.failure(503, payload=busy.description)
     except Exception as exc:
         logging.error(str(exc))
         return Response.failure(500, payload=str(exc))
     
     User.update_user(user.user_id, password=new_password)
+    audit.record(audit.PASSWORD_CHANGE, user.user_id)
     return Response.success("Password Updated Successfully")
 
@@ -1,28 +1,44 @@
 import functools
+from flask import current_app as app
 from flask_praetorian.exceptions import MissingRoleError, InvalidTokenHeader
 from ecom.auth.models import User
+from ecom.auth.token_versions import ACTIVE_CLAIM, is_token_current, publish_user_version
 from ecom.extensions import guard
 
 
+def _roles_from_claims(jwt_data):
+    if not jwt_data.get(ACTIVE_CLAIM):
+        raise InvalidTokenHeader(f"User is not active")
+    return [role for role in jwt_data.get("rls", "").split(",") if role]
+
+
+def _roles_from_db(user_id):
+    user_obj = User.query.get(user_id)
+    if not user_obj:
+        raise InvalidTokenHeader(f"User does not exist")
+    if not user_obj.is_active:
+        raise InvalidTokenHeader(f"User is not active")
+    # token claims can be trusted again until the next change of the user row
+    publish_user_version(user_obj)
+    return [user_obj.role.role_name] if user_obj.role else []
+
+
 def roles_accepted(accepted_roles: list):
+    accepted_role = [role.lower() for role in accepted_roles]
+
     def custom_auth_decorator(f):
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
             token = guard.read_token_from_header()
             jwt_data = guard.extract_jwt_token(token)
-            # roles_in_jwt = jwt_data.get("rls", None)
             user_id = jwt_data.get("id", None)
-            user_obj = User.query.get(user_id)
-            if not user_obj:
-                raise InvalidTokenHeader(f"User does not exist")
-            if not user_obj.is_active:
-                raise InvalidTokenHeader(f"User is not active")
-            if not user_obj.approved_at:
-                raise InvalidTokenHeader(f"User not approved")
-            roles_in_db = user_obj.role.role_name if user_obj.role else ""
-            # if accepted_role.lower() != roles_in_db.lower():
-            accepted_role = [role.lower() for role in accepted_roles]
-            if roles_in_db.lower() not in accepted_role:
+            # stateless mode: role / active flag come from the token as long as
+            # the user has not changed since it was issued
+            if app.config["JWT_STATELESS_ROLES"] and is_token_current(jwt_data):
+                roles = _roles_from_claims(jwt_data)
+            else:
+                roles = _roles_from_db(user_id)
+            if not any(role.lower() in accepted_role for role in roles):
                 raise MissingRoleError(
                     "This user is not having expected role to access this API"
                 )
@@ -1,9 +1,13 @@
 from flask_restx import Namespace, Resource, reqparse
 import flask_praetorian
 from flask import current_app as app
+from flask import request
 
+from ecom.auth.models import Role
+from ecom.ratelimit import rate_limited
 from ecom.utils import check_for_password
 from . import controllers
+from .decorator import roles_accepted
 
 api = Namespace("Auth", description="Auth related routes")
 
@@ -21,6 +25,7 @@ class Login(Resource):
         """
         return {"username": flask_praetorian.current_user().username}
 
+    @rate_limited("login")
     def post(self):
         """
         Logs a user in by parsing a POST request containing user credentials and
@@ -48,11 +53,68 @@ class RefreshToken(Resource):
 
 @api.route("/identity")
 class UserInfo(Resource):
+    @api.doc(params={"fields": "comma separated fields to return, e.g. user_id,email"})
     def get(self):
         """Get user information from token"""
-        return controllers.get_user_info()
+        return controllers.get_user_info(request.args.get("fields"))
     
 
+@api.route("/identity-cache")
+class IdentityCacheStats(Resource):
+    @roles_accepted([Role.ROLE_ADMIN])
+    def get(self):
+        """Get hit/miss counters of the identity cache of this worker"""
+        return controllers.get_identity_cache_stats()
+
+
+@api.route("/users")
+class Users(Resource):
+    @api.doc(
+        params={
+            "limit": "page size",
+            "cursor": "next_cursor / prev_cursor of the previous page",
+            "sort": "user_id or created_at",
+            "order": "asc or desc",
+            "fields": "comma separated fields to return",
+        }
+    )
+    @roles_accepted([Role.ROLE_ADMIN])
+    def get(self):
+        """List users, keyset paginated"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("limit", type=int, location="args")
+        parser.add_argument("cursor", type=str, location="args")
+        parser.add_argument("sort", type=str, location="args", default="user_id")
+        parser.add_argument(
+            "order", type=str, location="args", default="asc", choices=("asc", "desc")
+        )
+        parser.add_argument("fields", type=str, location="args")
+        args = parser.parse_args()
+        return controllers.list_users(
+            args["limit"], args["cursor"], args["sort"], args["order"], args["fields"]
+        )
+
+
+@api.route("/roles")
+class Roles(Resource):
+    @api.doc(
+        params={
+            "limit": "page size",
+            "cursor": "next_cursor / prev_cursor of the previous page",
+            "fields": "comma separated fields to return",
+        }
+    )
+    @roles_accepted([Role.ROLE_ADMIN])
+    def get(self):
+        """List roles, keyset paginated"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("limit", type=int, location="args")
+        parser.add_argument("cursor", type=str, location="args")
+        parser.add_argument("fields", type=str, location="args")
+        args = parser.parse_args()
+        return controllers.list_roles(args["limit"], args["cursor"], args["fields"])
+
+
 @api.route("/change-password")
 class ChangePassword(Resource):
     def put(self):
@@ -80,6 +142,7 @@ class ChangePassword(Resource):
 
 @api.route('/forgot_password')
 class ForgotPassword(Resource):
+    @rate_limited("forgot_password")
     def post(self):
         parser = reqparse.RequestParser()
         parser.add_argument("email", type=str, required=True, nullable=False)
@@ -90,6 +153,7 @@ class ForgotPassword(Resource):
 
 @api.route('/reset_password/<token>', endpoint='reset_password')
 class ResetPassword(Resource):
+    @rate_limited("reset_password")
     def post(self):
         parser = reqparse.RequestParser()
         parser.add_argument("token", location='view_args', type=str, required=True, nullable=False)
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    CHAR,
+    DECIMAL,
+    INTEGER,
+    Column,
+    DateTime,
+    ForeignKey,
+    String,
+    UniqueConstraint,
+)
+from sqlalchemy.orm import relationship
+
+from ecom.extensions import db
+
+
+class Cart(db.Model):
+    """Last persisted state of a redis cart, see ecom.cart.persist."""
+
+    __tablename__ = "carts"
+
+    STATUS_OPEN = "open"
+    STATUS_CHECKED_OUT = "checked_out"
+
+    cart_id = Column(INTEGER, primary_key=True)
+    # id of the redis hash, "u<user_id>" or "a<token>"; "u<user_id>:<order_id>"
+    # for the lines an order was placed from
+    cart_key = Column(String(64), nullable=False, unique=True)
+    user_id = Column(
+        INTEGER,
+        ForeignKey("users.user_id", name="carts_ibfk_1", ondelete="CASCADE"),
+        nullable=True,
+    )
+    status = Column(String(20), nullable=False, default=STATUS_OPEN)
+    # `_version` of the redis hash when it was persisted
+    version = Column(INTEGER, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
+    items = relationship(
+        "CartItem", backref="cart", lazy=True, cascade="all, delete-orphan"
+    )
+
+
+class CartItem(db.Model):
+    __tablename__ = "cart_items"
+
+    id = Column(INTEGER, primary_key=True)
+    cart_id = Column(
+        INTEGER,
+        ForeignKey(Cart.cart_id, name="cart_items_ibfk_1", ondelete="CASCADE"),
+        nullable=False,
+    )
+    product_id = Column(
+        INTEGER,
+        ForeignKey("product.product_id", name="cart_items_ibfk_2"),
+        nullable=False,
+    )
+    quantity = Column(INTEGER, nullable=False)
+    # price when the product was first added, honoured at checkout
+    unit_price = Column(DECIMAL(12, 2), nullable=False)
+    currency = Column(CHAR(3), nullable=False)
+    added_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("cart_id", "product_id", name="uq_cart_items_cart_id_product_id"),
+    )
@@ -0,0 +1,164 @@
+"""Write-behind of redis carts to the `carts` / `cart_items` tables.
+
+Cart requests only touch redis. A changed user cart is in the dirty set of
+ecom.cart.store and gets written to MySQL by `persist_cart`, either right
+away (checkout, merge at login) or by the beat task once it has been idle for
+CART_IDLE_SECONDS, so a busy cart costs one write whatever the number of
+clicks. A cart is dropped from the dirty set only if it did not change while
+being written.
+"""
+
+import logging
+import time
+
+from flask import current_app as app
+from sqlalchemy.exc import IntegrityError
+
+from ecom.cart import store
+from ecom.cart.models import Cart, CartItem
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import celery, db, get_redis_client
+
+CART_PERSIST_LOCK_KEY = "cart_persist_lock" + CACHE_CLEAR_SAFE_SUFFIX
+
+
+def persist_cart(cart_key, status=Cart.STATUS_OPEN, fields=None):
+    """Write the redis state of a cart to its row, in one short transaction.
+
+    Args:
+        cart_key (str): cart id
+        status (str, optional): status of the row. Defaults to Cart.STATUS_OPEN.
+        fields (dict, optional): hash fields to write instead of the live cart's,
+            which stays dirty. Defaults to None.
+
+    Returns:
+        Cart: the row, None if the cart is not in redis
+    """
+    live = fields is None
+    if live:
+        fields = store.read_fields(cart_key, load=False)
+    if not fields:
+        # expired meanwhile, the row keeps its last state
+        store.mark_clean(cart_key, 0)
+        return None
+    version = int(fields.get("_version", 0))
+    cart = Cart.query.filter_by(cart_key=cart_key).first()
+    if cart is not None and cart.version == version and cart.status == status:
+        if live:
+            store.mark_clean(cart_key, version)
+        return cart
+    if cart is None:
+        cart = Cart(cart_key=cart_key, user_id=store.user_id_of(cart_key))
+        db.session.add(cart)
+    cart.version = version
+    cart.status = status
+
+    lines = {item["product_id"]: item for item in store.parse_items(fields)}
+    for item in list(cart.items):
+        line = lines.pop(item.product_id, None)
+        if line is None:
+            cart.items.remove(item)
+            continue
+        item.quantity = line["quantity"]
+        item.unit_price = line["unit_price"]
+        item.currency = line["currency"]
+    for line in lines.values():
+        cart.items.append(
+            CartItem(
+                product_id=line["product_id"],
+                quantity=line["quantity"],
+                unit_price=line["unit_price"],
+                currency=line["currency"],
+            )
+        )
+    try:
+        db.session.commit()
+    except IntegrityError as exc:
+        # the same cart written by another worker, it stays dirty
+        db.session.rollback()
+        logging.error("Not able to persist cart %s. Exception : %s" % (cart_key, exc))
+        return None
+    if live:
+        store.mark_clean(cart_key, version)
+    return cart
+
+
+def check_out_cart(cart_key, order_id):
+    """Archive the lines an order was placed from as a checked out row
+    "<cart key>:<order_id>", see `store.check_out`."""
+    fields = store.checked_out_fields(order_id)
+    if fields:
+        persist_cart(f"{cart_key}:{order_id}", Cart.STATUS_CHECKED_OUT, fields)
+    store.drop_checked_out(order_id)
+
+
+def persist_idle_carts(idle_seconds=None, batch_size=None) -> int:
+    """Persist the dirty carts not changed for `idle_seconds`.
+
+    Args:
+        idle_seconds (int, optional): Defaults to CART_IDLE_SECONDS.
+        batch_size (int, optional): carts read from redis at once. Defaults to CART_PERSIST_BATCH_SIZE.
+
+    Returns:
+        int: number of persisted carts
+    """
+    if idle_seconds is None:
+        idle_seconds = app.config["CART_IDLE_SECONDS"]
+    batch_size = batch_size or app.config["CART_PERSIST_BATCH_SIZE"]
+    started_at = time.monotonic()
+    persisted = 0
+    while True:
+        cart_keys = store.idle_carts(idle_seconds, batch_size)
+        done = 0
+        for cart_key in cart_keys:
+            try:
+                if persist_cart(cart_key) is not None:
+                    done += 1
+            except Exception as exc:
+                db.session.rollback()
+                logging.error("Not able to persist cart %s. Exception : %s" % (cart_key, exc))
+        persisted += done
+        # carts left dirty would come back in the next batch, retried next run
+        if done < len(cart_keys) or len(cart_keys) < batch_size:
+            break
+    db.session.remove()
+    logging.info("Persisted %s idle carts in %.2fs", persisted, time.monotonic() - started_at)
+    return persisted
+
+
+def stats() -> dict:
+    """Number of user carts waiting to be written."""
+    client = get_redis_client()
+    if client is None:
+        return {}
+    try:
+        return {"dirty": client.zcard(store.CART_DIRTY_KEY)}
+    except Exception as exc:
+        logging.error("Not able to read cart stats. Exception : %s" % (exc))
+        return {}
+
+
+@celery.task(name="ecom.cart.persist.persist_cart")
+def persist_cart_task(cart_key):
+    return persist_cart(cart_key) is not None
+
+
+@celery.task(name="ecom.cart.persist.check_out_cart")
+def check_out_cart_task(cart_key, order_id):
+    check_out_cart(cart_key, order_id)
+
+
+@celery.task(name="ecom.cart.persist.persist_idle_carts")
+def persist_idle_carts_task():
+    """Beat task, skipped while a previous run still holds the lock."""
+    client = get_redis_client()
+    if client is None:
+        return 0
+    lock_timeout = max(app.config["CART_PERSIST_INTERVAL"], 60)
+    if not client.set(CART_PERSIST_LOCK_KEY, 1, nx=True, ex=lock_timeout):
+        logging.info("Cart persist already running, skipped")
+        return 0
+    try:
+        return persist_idle_carts()
+    finally:
+        client.delete(CART_PERSIST_LOCK_KEY)
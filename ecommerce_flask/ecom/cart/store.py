@@ -0,0 +1,473 @@
+"""Shopping carts kept as redis hashes.
+
+A cart is one hash on the redis connection of `extensions.cache`:
+
+    q:<product_id>   quantity
+    p:<product_id>   "<unit price in cents>:<currency>" when the line was added
+    _lines           number of lines
+    _version         bumped by every change
+    _updated         unix time of the last change
+
+Every change is one Lua script, so concurrent requests on the same cart never
+lose an update and a request costs one redis round trip. Anonymous carts live
+under a random token and expire after CART_ANONYMOUS_TTL of inactivity. User
+carts are written to MySQL behind the scenes (ecom.cart.persist): changes
+only add the cart to a sorted set of dirty carts, and a cart missing from
+redis is loaded back from its last persisted state. The change scripts check
+a user cart exists themselves and answer NOT_LOADED otherwise, so a cart
+evicted between requests is never recreated from the new line alone.
+"""
+
+import re
+import time
+import uuid
+from decimal import Decimal
+
+from flask import current_app as app
+
+from ecom.cart.models import Cart
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import get_redis_client
+
+USER_PREFIX = "u"
+ANONYMOUS_PREFIX = "a"
+CART_DIRTY_KEY = "cart_dirty" + CACHE_CLEAR_SAFE_SUFFIX
+_TOKEN_RE = re.compile(r"[0-9a-f]{32}")
+# answer of the change scripts for a user cart missing from redis
+NOT_LOADED = -2
+
+# KEYS[1] cart, KEYS[2] dirty carts
+# ARGV[1] product_id, ARGV[2] quantity, ARGV[3] "add" or "set", ARGV[4] price
+# snapshot, ARGV[5] max quantity, ARGV[6] max lines, ARGV[7] ttl, ARGV[8] now,
+# ARGV[9] cart key to mark dirty or "", a user cart that has to exist
+UPDATE_LINE_SCRIPT = """
+if ARGV[9] ~= '' and redis.call('EXISTS', KEYS[1]) == 0 then
+    return -2
+end
+local field = 'q:' .. ARGV[1]
+local current = tonumber(redis.call('HGET', KEYS[1], field) or '0')
+local quantity = tonumber(ARGV[2])
+if ARGV[3] == 'add' then
+    quantity = current + quantity
+end
+quantity = math.min(quantity, tonumber(ARGV[5]))
+if quantity <= 0 then
+    quantity = 0
+end
+if quantity == current then
+    return quantity
+end
+if current == 0 then
+    if tonumber(redis.call('HGET', KEYS[1], '_lines') or '0') >= tonumber(ARGV[6]) then
+        return -1
+    end
+    redis.call('HINCRBY', KEYS[1], '_lines', 1)
+    redis.call('HSET', KEYS[1], 'p:' .. ARGV[1], ARGV[4])
+end
+if quantity == 0 then
+    redis.call('HINCRBY', KEYS[1], '_lines', -1)
+    redis.call('HDEL', KEYS[1], field, 'p:' .. ARGV[1])
+else
+    redis.call('HSET', KEYS[1], field, quantity)
+end
+redis.call('HINCRBY', KEYS[1], '_version', 1)
+redis.call('HSET', KEYS[1], '_updated', ARGV[8])
+if tonumber(ARGV[7]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[7])
+end
+if ARGV[9] ~= '' then
+    redis.call('ZADD', KEYS[2], ARGV[8], ARGV[9])
+end
+return quantity
+"""
+
+# KEYS[1] cart, KEYS[2] dirty carts; ARGV[1] ttl, ARGV[2] now, ARGV[3] cart key or ""
+CLEAR_SCRIPT = """
+if ARGV[3] ~= '' and redis.call('EXISTS', KEYS[1]) == 0 then
+    return -2
+end
+local version = tonumber(redis.call('HGET', KEYS[1], '_version') or '0')
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '_version', version + 1, '_lines', 0, '_updated', ARGV[2])
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+if ARGV[3] ~= '' then
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+end
+return version + 1
+"""
+
+# KEYS[1] source cart, KEYS[2] target cart, KEYS[3] dirty carts
+# ARGV[1] max quantity, ARGV[2] max lines, ARGV[3] ttl, ARGV[4] now, ARGV[5] target cart key or ""
+MERGE_SCRIPT = """
+if ARGV[5] ~= '' and redis.call('EXISTS', KEYS[2]) == 0 then
+    return -2
+end
+local source = redis.call('HGETALL', KEYS[1])
+local merged = 0
+for i = 1, #source, 2 do
+    local field = source[i]
+    if string.sub(field, 1, 2) == 'q:' then
+        local product = string.sub(field, 3)
+        local current = tonumber(redis.call('HGET', KEYS[2], field) or '0')
+        local quantity = math.min(current + tonumber(source[i + 1]), tonumber(ARGV[1]))
+        if current > 0 then
+            redis.call('HSET', KEYS[2], field, quantity)
+            merged = merged + 1
+        elseif tonumber(redis.call('HGET', KEYS[2], '_lines') or '0') < tonumber(ARGV[2]) then
+            redis.call('HINCRBY', KEYS[2], '_lines', 1)
+            redis.call('HSET', KEYS[2], field, quantity,
+                'p:' .. product, redis.call('HGET', KEYS[1], 'p:' .. product))
+            merged = merged + 1
+        end
+    end
+end
+redis.call('DEL', KEYS[1])
+if merged > 0 then
+    redis.call('HINCRBY', KEYS[2], '_version', 1)
+    redis.call('HSET', KEYS[2], '_updated', ARGV[4])
+    if tonumber(ARGV[3]) > 0 then
+        redis.call('EXPIRE', KEYS[2], ARGV[3])
+    end
+    if ARGV[5] ~= '' then
+        redis.call('ZADD', KEYS[3], ARGV[4], ARGV[5])
+    end
+end
+return merged
+"""
+
+# KEYS[1] cart; ARGV[1] ttl, ARGV[2..] field / value pairs
+LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+# KEYS[1] cart, KEYS[2] dirty carts; ARGV[1] persisted version, ARGV[2] cart key
+MARK_CLEAN_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], '_version')
+if version and version ~= ARGV[1] then
+    return 0
+end
+redis.call('ZREM', KEYS[2], ARGV[2])
+return 1
+"""
+
+# KEYS[1] cart, KEYS[2] checked out copy, KEYS[3] dirty carts; ARGV[1] version
+# the order was built from, ARGV[2] cart key, ARGV[3] ttl, ARGV[4] now
+CHECK_OUT_SCRIPT = """
+local version = redis.call('HGET', KEYS[1], '_version')
+if version ~= ARGV[1] then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('HSET', KEYS[1], '_version', version + 1, '_lines', 0, '_updated', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[2])
+return 1
+"""
+
+_scripts = {}
+
+
+class CartUnavailable(Exception):
+    def __str__(self):
+        return "Carts need the redis cache"
+
+
+class CartFull(Exception):
+    def __str__(self):
+        return "Cart has reached the maximum number of lines"
+
+
+def user_cart_key(user_id) -> str:
+    return f"{USER_PREFIX}{user_id}"
+
+
+def anonymous_cart_key(token) -> str:
+    return f"{ANONYMOUS_PREFIX}{token}"
+
+
+def new_cart_token() -> str:
+    return uuid.uuid4().hex
+
+
+def is_cart_token(token) -> bool:
+    return bool(token) and _TOKEN_RE.fullmatch(token) is not None
+
+
+def user_id_of(cart_key):
+    # archived carts are "<cart key>:<order_id>"
+    return int(cart_key[1:].split(":")[0]) if cart_key.startswith(USER_PREFIX) else None
+
+
+def redis_key(cart_key) -> str:
+    return f"cart:{cart_key}{CACHE_CLEAR_SAFE_SUFFIX}"
+
+
+def _client():
+    client = get_redis_client()
+    if client is None:
+        raise CartUnavailable()
+    return client
+
+
+def _script(client, source):
+    key = (id(client), source)
+    script = _scripts.get(key)
+    if script is None:
+        script = _scripts[key] = client.register_script(source)
+    return script
+
+
+def _ttl(cart_key) -> int:
+    if cart_key.startswith(USER_PREFIX):
+        return app.config["CART_USER_TTL"]
+    return app.config["CART_ANONYMOUS_TTL"]
+
+
+def _dirty_member(cart_key) -> str:
+    # only user carts are persisted, anonymous ones are merged at login
+    return cart_key if cart_key.startswith(USER_PREFIX) else ""
+
+
+def _load(client, cart_key):
+    """Load a user cart missing from redis from its persisted state."""
+    fields = {"_version": 0, "_lines": 0, "_updated": int(time.time())}
+    cart = Cart.query.filter_by(cart_key=cart_key, status=Cart.STATUS_OPEN).first()
+    if cart is not None:
+        fields["_version"] = cart.version
+        fields["_lines"] = len(cart.items)
+        for item in cart.items:
+            fields[f"q:{item.product_id}"] = item.quantity
+            fields[f"p:{item.product_id}"] = price_snapshot(item.unit_price, item.currency)
+    args = [_ttl(cart_key)]
+    for field, value in fields.items():
+        args.extend((field, value))
+    # no-op when another request loaded it meanwhile
+    _script(client, LOAD_SCRIPT)(keys=[redis_key(cart_key)], args=args)
+
+
+def _change(client, source, cart_key, keys, args):
+    """Run a change script, loading the user cart when the script finds it missing."""
+    script = _script(client, source)
+    result = script(keys=keys, args=args)
+    if result == NOT_LOADED:
+        _load(client, cart_key)
+        result = script(keys=keys, args=args)
+        if result == NOT_LOADED:
+            # evicted again right after the load, redis is out of memory
+            raise CartUnavailable()
+    return result
+
+
+def price_snapshot(price, currency) -> str:
+    return f"{int(Decimal(str(price)) * 100)}:{currency}"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def read_fields(cart_key, load=True) -> dict:
+    """Raw fields of the cart hash, empty when it does not exist.
+
+    Args:
+        cart_key (str): cart id
+        load (bool, optional): load a user cart missing from redis first. Defaults to True.
+    """
+    client = _client()
+    fields = client.hgetall(redis_key(cart_key))
+    # a cart hash always has _version, empty means missing
+    if not fields and load and cart_key.startswith(USER_PREFIX):
+        _load(client, cart_key)
+        fields = client.hgetall(redis_key(cart_key))
+    return {_decode(field): _decode(value) for field, value in fields.items()}
+
+
+def parse_items(fields) -> list:
+    """Cart lines of the raw hash fields, ordered by product_id."""
+    items = []
+    for field, value in fields.items():
+        if not field.startswith("q:"):
+            continue
+        product_id = int(field[2:])
+        cents, currency = fields[f"p:{product_id}"].split(":")
+        unit_price = Decimal(cents) / 100
+        quantity = int(value)
+        items.append(
+            {
+                "product_id": product_id,
+                "quantity": quantity,
+                "unit_price": unit_price,
+                "currency": currency,
+                "line_total": unit_price * quantity,
+            }
+        )
+    items.sort(key=lambda item: item["product_id"])
+    return items
+
+
+def get_cart(cart_key) -> dict:
+    """Lines and totals per currency of a cart."""
+    fields = read_fields(cart_key)
+    items = parse_items(fields)
+    totals = {}
+    for item in items:
+        totals[item["currency"]] = totals.get(item["currency"], 0) + item["line_total"]
+    return {
+        "items": items,
+        "totals": totals,
+        "item_count": sum(item["quantity"] for item in items),
+        "version": int(fields.get("_version", 0)),
+    }
+
+
+def _update_line(cart_key, product_id, quantity, mode, snapshot=""):
+    client = _client()
+    result = _change(
+        client,
+        UPDATE_LINE_SCRIPT,
+        cart_key,
+        keys=[redis_key(cart_key), CART_DIRTY_KEY],
+        args=[
+            product_id,
+            quantity,
+            mode,
+            snapshot,
+            app.config["CART_MAX_QUANTITY"],
+            app.config["CART_MAX_LINES"],
+            _ttl(cart_key),
+            int(time.time()),
+            _dirty_member(cart_key),
+        ],
+    )
+    if result == -1:
+        raise CartFull()
+    return result
+
+
+def add_item(cart_key, product_id, quantity, snapshot) -> int:
+    """Add `quantity` (negative to take away) of a product.
+
+    Args:
+        cart_key (str): cart id
+        product_id (int): product
+        quantity (int): quantity to add
+        snapshot (str): `price_snapshot` kept if the line is new
+
+    Raises:
+        CartFull: the line is new and the cart has CART_MAX_LINES lines
+
+    Returns:
+        int: new quantity of the line, capped at CART_MAX_QUANTITY
+    """
+    return _update_line(cart_key, product_id, quantity, "add", snapshot)
+
+
+def set_quantity(cart_key, product_id, quantity, snapshot="") -> int:
+    """Set the quantity of a line, 0 removes it. See `add_item`."""
+    return _update_line(cart_key, product_id, quantity, "set", snapshot)
+
+
+def clear(cart_key) -> int:
+    client = _client()
+    return _change(
+        client,
+        CLEAR_SCRIPT,
+        cart_key,
+        keys=[redis_key(cart_key), CART_DIRTY_KEY],
+        args=[_ttl(cart_key), int(time.time()), _dirty_member(cart_key)],
+    )
+
+
+def merge(source_key, target_key) -> int:
+    """Move the lines of cart `source_key` into `target_key`, quantities add up.
+
+    Returns:
+        int: number of merged lines
+    """
+    client = _client()
+    return _change(
+        client,
+        MERGE_SCRIPT,
+        target_key,
+        keys=[redis_key(source_key), redis_key(target_key), CART_DIRTY_KEY],
+        args=[
+            app.config["CART_MAX_QUANTITY"],
+            app.config["CART_MAX_LINES"],
+            _ttl(target_key),
+            int(time.time()),
+            _dirty_member(target_key),
+        ],
+    )
+
+
+def checked_out_key(order_id) -> str:
+    return f"cart_checkout:{order_id}{CACHE_CLEAR_SAFE_SUFFIX}"
+
+
+def check_out(cart_key, version, order_id) -> bool:
+    """Move the lines of a user cart aside for `ecom.cart.persist.check_out_cart`
+    and leave it empty. Skipped when the cart changed after the order was built.
+
+    Returns:
+        bool: False when the cart is at another version than `version`
+    """
+    client = _client()
+    return bool(
+        _script(client, CHECK_OUT_SCRIPT)(
+            keys=[redis_key(cart_key), checked_out_key(order_id), CART_DIRTY_KEY],
+            args=[version, cart_key, app.config["CART_USER_TTL"], int(time.time())],
+        )
+    )
+
+
+def checked_out_fields(order_id) -> dict:
+    """Raw fields of a cart moved aside by `check_out`."""
+    client = _client()
+    return {
+        _decode(field): _decode(value)
+        for field, value in client.hgetall(checked_out_key(order_id)).items()
+    }
+
+
+def drop_checked_out(order_id):
+    _client().delete(checked_out_key(order_id))
+
+
+def delete(cart_key):
+    """Drop a cart from redis."""
+    client = _client()
+    pipe = client.pipeline(transaction=True)
+    pipe.delete(redis_key(cart_key))
+    pipe.zrem(CART_DIRTY_KEY, cart_key)
+    pipe.execute()
+
+
+def idle_carts(idle_seconds, limit) -> list:
+    """Dirty carts not changed for `idle_seconds`, oldest first."""
+    client = _client()
+    return [
+        _decode(cart_key)
+        for cart_key in client.zrangebyscore(
+            CART_DIRTY_KEY, "-inf", time.time() - idle_seconds, start=0, num=limit
+        )
+    ]
+
+
+def mark_clean(cart_key, version) -> bool:
+    """Drop the cart from the dirty set unless it changed after `version`."""
+    client = _client()
+    return bool(
+        _script(client, MARK_CLEAN_SCRIPT)(
+            keys=[redis_key(cart_key), CART_DIRTY_KEY], args=[version, cart_key]
+        )
+    )
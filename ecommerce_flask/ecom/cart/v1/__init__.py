@@ -0,0 +1 @@
+from .routes import api as cart_api_v1
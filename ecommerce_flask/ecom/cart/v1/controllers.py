@@ -0,0 +1,130 @@
+import logging
+
+from flask import request
+from flask_praetorian.exceptions import PraetorianError
+
+from ecom.cart import persist, store
+from ecom.catalog import listings
+from ecom.extensions import guard
+from ecom.utils import Response
+
+CART_TOKEN_HEADER = "X-Cart-Token"
+
+
+def _current_cart():
+    """Cart of the request: the user's with a JWT, else the anonymous one of X-Cart-Token.
+
+    Returns:
+        tuple: cart key, anonymous token (a new one when none was sent) or None
+    """
+    if request.headers.get("Authorization"):
+        token = guard.read_token_from_header()
+        return store.user_cart_key(guard.extract_jwt_token(token)["id"]), None
+    token = request.headers.get(CART_TOKEN_HEADER)
+    if not store.is_cart_token(token):
+        token = store.new_cart_token()
+    return store.anonymous_cart_key(token), token
+
+
+def _cart_response(cart_key, token, msg=None):
+    cart = store.get_cart(cart_key)
+    if token is not None:
+        # to be sent back as X-Cart-Token
+        cart["cart_token"] = token
+    return Response.success(cart, msg)
+
+
+def _handle(action):
+    """Run a cart action, mapping cart / auth errors to failure responses."""
+    try:
+        return action()
+    except PraetorianError as exc:
+        return Response.failure(401, payload=str(exc))
+    except store.CartFull as exc:
+        return Response.failure(400, str(exc))
+    except store.CartUnavailable as exc:
+        logging.error("Not able to serve cart. Exception : %s" % (exc))
+        return Response.failure(503, str(exc))
+
+
+def get_cart():
+    """Lines and totals of the current cart.
+
+    Returns:
+        dict: cart, with `cart_token` for anonymous carts
+    """
+    return _handle(lambda: _cart_response(*_current_cart()))
+
+
+def add_item(product_id, quantity=1):
+    """Add a product to the current cart at its current price.
+
+    Args:
+        product_id (int): active product
+        quantity (int, optional): quantity to add. Defaults to 1.
+
+    Returns:
+        dict: cart
+    """
+    product = listings.get_product(product_id)
+    if product is None:
+        return Response.failure(404, "Product not found")
+
+    def action():
+        cart_key, token = _current_cart()
+        store.add_item(
+            cart_key,
+            product_id,
+            quantity,
+            store.price_snapshot(product["price"], product["currency"]),
+        )
+        return _cart_response(cart_key, token)
+
+    return _handle(action)
+
+
+def update_item(product_id, quantity):
+    """Set the quantity of a product, 0 removes it. A new line gets the current price."""
+    snapshot = ""
+    if quantity > 0:
+        product = listings.get_product(product_id)
+        if product is None:
+            return Response.failure(404, "Product not found")
+        snapshot = store.price_snapshot(product["price"], product["currency"])
+
+    def action():
+        cart_key, token = _current_cart()
+        store.set_quantity(cart_key, product_id, quantity, snapshot)
+        return _cart_response(cart_key, token)
+
+    return _handle(action)
+
+
+def clear_cart():
+    def action():
+        cart_key, token = _current_cart()
+        store.clear(cart_key)
+        return _cart_response(cart_key, token, "Cart emptied")
+
+    return _handle(action)
+
+
+def merge_cart(cart_token):
+    """Move the anonymous cart of `cart_token` into the cart of the logged in user.
+
+    Args:
+        cart_token (str): X-Cart-Token used before login
+
+    Returns:
+        dict: cart of the user
+    """
+    if not store.is_cart_token(cart_token):
+        return Response.failure(400, "Invalid cart token")
+
+    def action():
+        cart_key, _ = _current_cart()
+        if store.merge(store.anonymous_cart_key(cart_token), cart_key):
+            persist.persist_cart_task.delay(cart_key)
+        return _cart_response(cart_key, None, "Carts merged")
+
+    return _handle(action)
@@ -0,0 +1,69 @@
+import flask_praetorian
+from flask import request
+from flask_restx import Namespace, Resource, reqparse
+
+from . import controllers
+
+api = Namespace("Cart", description="Shopping cart routes")
+
+CART_HEADERS = {
+    controllers.CART_TOKEN_HEADER: "cart_token of a previous response, anonymous carts only",
+}
+
+
+def check_for_quantity(value):
+    quantity = int(value)
+    if quantity < 0:
+        raise ValueError("Must be a positive number")
+    return quantity
+
+
+@api.route("/")
+class CurrentCart(Resource):
+    @api.doc(headers=CART_HEADERS)
+    def get(self):
+        """Get the cart of the user, or the anonymous cart of X-Cart-Token"""
+        return controllers.get_cart()
+
+    @api.doc(headers=CART_HEADERS)
+    def delete(self):
+        """Empty the cart"""
+        return controllers.clear_cart()
+
+
+@api.route("/items")
+class CartItems(Resource):
+    @api.doc(headers=CART_HEADERS)
+    def post(self):
+        """Add a product to the cart"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("product_id", type=int, location="json", required=True, nullable=False)
+        parser.add_argument("quantity", type=check_for_quantity, location="json", default=1)
+        args = parser.parse_args()
+        return controllers.add_item(args["product_id"], args["quantity"])
+
+
+@api.route("/items/<int:product_id>")
+class CartItem(Resource):
+    @api.doc(headers=CART_HEADERS)
+    def put(self, product_id):
+        """Set the quantity of a product in the cart, 0 removes it"""
+        parser = reqparse.RequestParser()
+        parser.add_argument(
+            "quantity", type=check_for_quantity, location="json", required=True, nullable=False
+        )
+        return controllers.update_item(product_id, parser.parse_args()["quantity"])
+
+    @api.doc(headers=CART_HEADERS)
+    def delete(self, product_id):
+        """Remove a product from the cart"""
+        return controllers.update_item(product_id, 0)
+
+
+@api.route("/merge")
+class MergeCart(Resource):
+    @api.doc(headers=CART_HEADERS)
+    @flask_praetorian.auth_required
+    def post(self):
+        """Move the anonymous cart of X-Cart-Token into the cart of the user, after login"""
+        return controllers.merge_cart(request.headers.get(controllers.CART_TOKEN_HEADER))
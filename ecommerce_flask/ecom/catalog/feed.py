@@ -0,0 +1,189 @@
+"""Change feed of the catalog.
+
+Every flush touching products or categories appends `catalog_changes` rows in
+the same transaction, so the feed can't miss a committed write. After the
+commit the `catalog_change_seq` counter in redis is bumped: workers compare it
+with the value they last saw and only query the feed when it moved, so idle
+workers don't poll MySQL. Product writes must go through the ORM session,
+bulk `Query.update` is not captured.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app as app
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+
+from ecom.catalog.models import CatalogChange, Category, Product
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import celery, db, get_redis_client
+
+CATALOG_CHANGE_SEQ_KEY = "catalog_change_seq" + CACHE_CLEAR_SAFE_SUFFIX
+_PENDING_KEY = "catalog_changes_pending"
+
+# called after a commit with changes, the index of this worker refreshes early
+_listeners = []
+
+
+def on_commit(callback):
+    """Register `callback()` to run after every commit changing the catalog."""
+    _listeners.append(callback)
+
+
+def current_seq():
+    """Returns the change counter of redis, None without redis."""
+    client = get_redis_client()
+    if client is None:
+        return None
+    try:
+        return int(client.get(CATALOG_CHANGE_SEQ_KEY) or 0)
+    except Exception as exc:
+        logging.error("Not able to read catalog change seq. Exception : %s" % (exc))
+        return None
+
+
+def read_changes(after_change_id, limit):
+    """Changes with a change_id above `after_change_id`, oldest first.
+
+    Returns:
+        list: (change_id, entity, entity_id) rows
+    """
+    return db.session.execute(
+        select(
+            CatalogChange.change_id, CatalogChange.entity, CatalogChange.entity_id
+        )
+        .where(CatalogChange.change_id > after_change_id)
+        .order_by(CatalogChange.change_id)
+        .limit(limit)
+    ).all()
+
+
+def last_change_id():
+    return db.session.execute(
+        select(CatalogChange.change_id).order_by(CatalogChange.change_id.desc()).limit(1)
+    ).scalar() or 0
+
+
+class FeedReader:
+    """Position of one consumer in the feed.
+
+    Change ids are assigned at insert but transactions commit in any order, so
+    every read starts CATALOG_FEED_OVERLAP ids below the last seen one and
+    skips the ids already applied, a transaction committing late is not missed.
+    """
+
+    def __init__(self, last_change_id=0, seen_seq=None):
+        self.last_change_id = last_change_id
+        self.seen_seq = seen_seq
+        self.applied = set()  # change ids of the overlap window
+
+    def read(self, batch_size=1000):
+        """New changes, one item per batch, marked applied once the caller
+        returns from it. Does nothing while the redis counter did not move.
+
+        Yields:
+            tuple: set of changed product ids, whether categories changed
+        """
+        seq = current_seq()
+        if seq is not None and seq == self.seen_seq:
+            return
+        window_start = max(0, self.last_change_id - app.config["CATALOG_FEED_OVERLAP"])
+        self.applied = {change_id for change_id in self.applied if change_id > window_start}
+        after = window_start
+        while True:
+            changes = read_changes(after, batch_size)
+            if not changes:
+                break
+            new_ids = []
+            product_ids = set()
+            categories_changed = False
+            for change_id, entity, entity_id in changes:
+                if change_id in self.applied:
+                    continue
+                new_ids.append(change_id)
+                if entity == CatalogChange.ENTITY_PRODUCT:
+                    product_ids.add(entity_id)
+                else:
+                    categories_changed = True
+            if new_ids:
+                yield product_ids, categories_changed
+                self.applied.update(new_ids)
+            after = changes[-1][0]
+            self.last_change_id = max(self.last_change_id, after)
+            if len(changes) < batch_size:
+                break
+        self.seen_seq = seq
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session, flush_context):
+    rows = []
+    now = datetime.utcnow()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Product):
+            entity, entity_id = CatalogChange.ENTITY_PRODUCT, obj.product_id
+        elif isinstance(obj, Category):
+            entity, entity_id = CatalogChange.ENTITY_CATEGORY, obj.category_id
+        else:
+            continue
+        rows.append({"entity": entity, "entity_id": entity_id, "created_at": now})
+    if rows:
+        # same connection and transaction as the flushed changes
+        session.connection().execute(insert(CatalogChange.__table__), rows)
+        session.info[_PENDING_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    if not session.info.pop(_PENDING_KEY, False):
+        return
+    client = get_redis_client()
+    if client is not None:
+        try:
+            client.incr(CATALOG_CHANGE_SEQ_KEY)
+        except Exception as exc:
+            logging.error("Not able to bump catalog change seq. Exception : %s" % (exc))
+    for callback in _listeners:
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+@celery.task(name="ecom.catalog.feed.purge_catalog_changes")
+def purge_catalog_changes():
+    """Delete feed rows older than CATALOG_CHANGES_RETENTION_HOURS in PK chunks."""
+    table = CatalogChange.__table__
+    cutoff = datetime.utcnow() - timedelta(
+        hours=app.config["CATALOG_CHANGES_RETENTION_HOURS"]
+    )
+    batch_size = app.config["CATALOG_CHANGES_PURGE_BATCH_SIZE"]
+    purged = 0
+    while True:
+        ids = (
+            db.session.execute(
+                select(table.c.change_id)
+                .where(table.c.created_at < cutoff)
+                .order_by(table.c.change_id)
+                .limit(batch_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            break
+        purged += db.session.execute(
+            delete(table).where(table.c.change_id.in_(ids))
+        ).rowcount
+        db.session.commit()
+        if len(ids) < batch_size:
+            break
+        time.sleep(app.config["CATALOG_CHANGES_PURGE_THROTTLE_SECONDS"])
+    logging.info("Purged %s catalog changes", purged)
+    return purged
@@ -0,0 +1,398 @@
+"""Per worker, read optimized in-memory index of the product catalog.
+
+Products are stored column wise: product ids, category ids, prices (in cents)
+and active flags in `array` columns, one prebuilt response dict per product.
+Category listings are sorted arrays of row numbers with a parallel array of
+sort keys, built on first use and binary searched for keyset pages, so a
+browse request never touches MySQL or redis. Writes move the changed rows of
+the cached listings with binary search inserts / deletes instead of sorting
+them again.
+
+The index is built once per process in a background thread and then follows
+the change feed (ecom.catalog.feed): when the redis change counter moves, the
+new `catalog_changes` rows are read and only the changed products reloaded.
+Requests arriving before the first build completes get None from `get_index`
+and are served by the redis cached listings instead.
+
+Writers hold `_write_lock`, readers take no lock: listings are copied and
+replaced, never mutated, and a row's scalar columns are written one at a time.
+"""
+
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from flask import current_app as app
+from sqlalchemy import select
+
+from ecom.catalog import feed
+from ecom.catalog.models import Category, Product
+from ecom.extensions import db
+from ecom.utils.pagination import NEXT, PREV
+
+# fields of a product in listings, description is only in the detail record
+LISTING_FIELDS = (
+    "product_id",
+    "sku",
+    "name",
+    "category_id",
+    "price",
+    "currency",
+    "updated_at",
+)
+SORTS = ("product_id", "price")
+ALL_CATEGORIES = 0
+# changed rows of one write above which a listing is sorted again instead
+LISTING_REBUILD_CHANGES = 1000
+
+_index = None
+_index_pid = None
+_index_lock = threading.Lock()
+_refresh = threading.Event()
+
+
+def price_cents(price) -> int:
+    return int(price * 100)
+
+
+class ProductIndex:
+    """Column arrays of the catalog with lazily sorted category listings."""
+
+    def __init__(self):
+        self.rows = {}  # product_id -> row
+        self.product_ids = array("l")
+        self.category_ids = array("l")
+        self.prices = array("q")
+        self.active = bytearray()
+        self.records = []  # row -> detail dict
+        self.summaries = []  # row -> listing dict
+        self.categories = {}  # category_id -> dict
+        self.feed = feed.FeedReader()
+        self.ready = False
+        self._listings = {}  # (category_id, sort, descending) -> (rows, keys)
+        self._write_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def product(self, product_id):
+        """Detail dict of an active product or None."""
+        row = self.rows.get(product_id)
+        if row is None or not self.active[row]:
+            return None
+        return self.records[row]
+
+    def summary(self, product_id):
+        """Listing dict of an active product or None."""
+        row = self.rows.get(product_id)
+        if row is None or not self.active[row]:
+            return None
+        return self.summaries[row]
+
+    def upsert(self, records):
+        """Insert / replace products from their column dicts."""
+        with self._write_lock:
+            before = {}  # row -> listed state before this write, None if new
+            for record in records:
+                product_id = record["product_id"]
+                category_id = record["category_id"] or ALL_CATEGORIES
+                summary = {field: record[field] for field in LISTING_FIELDS}
+                row = self.rows.get(product_id)
+                if row is None:
+                    row = len(self.product_ids)
+                    before[row] = None
+                    self.product_ids.append(product_id)
+                    self.category_ids.append(category_id)
+                    self.prices.append(price_cents(record["price"]))
+                    self.active.append(1 if record["is_active"] else 0)
+                    self.records.append(record)
+                    self.summaries.append(summary)
+                    self.rows[product_id] = row
+                else:
+                    before.setdefault(row, self._state(row))
+                    self.category_ids[row] = category_id
+                    self.prices[row] = price_cents(record["price"])
+                    self.active[row] = 1 if record["is_active"] else 0
+                    self.records[row] = record
+                    self.summaries[row] = summary
+            self._update_listings(before)
+
+    def remove(self, product_ids):
+        """Drop deleted products, their rows stay as inactive tombstones."""
+        with self._write_lock:
+            before = {}
+            for product_id in product_ids:
+                row = self.rows.pop(product_id, None)
+                if row is not None:
+                    before.setdefault(row, self._state(row))
+                    self.active[row] = 0
+            self._update_listings(before)
+
+    def set_categories(self, categories):
+        self.categories = {category["category_id"]: category for category in categories}
+
+    def _state(self, row):
+        return self.active[row], self.category_ids[row], self.prices[row]
+
+    @staticmethod
+    def _listed(category_id, active, row_category_id) -> bool:
+        return bool(active) and category_id in (ALL_CATEGORIES, row_category_id)
+
+    def _update_listings(self, before):
+        """Move the rows changed by a write inside the cached listings.
+
+        Args:
+            before (dict): row -> (active, category_id, price) before the write,
+                None for rows added by it
+        """
+        if not before or not self._listings:
+            return
+        listings = dict(self._listings)
+        for key, (rows, keys) in self._listings.items():
+            category_id, sort, descending = key
+            sign = -1 if descending else 1
+            removed, added = [], []
+            for row, state in before.items():
+                product_id = self.product_ids[row]
+                if state is not None and self._listed(category_id, state[0], state[1]):
+                    removed.append(_sort_values(sort, sign, state[2], product_id))
+                if self._listed(category_id, self.active[row], self.category_ids[row]):
+                    added.append(
+                        (_sort_values(sort, sign, self.prices[row], product_id), row)
+                    )
+            if not removed and not added:
+                continue
+            if len(removed) + len(added) > LISTING_REBUILD_CHANGES:
+                # done by the writer, the feed thread, never by a request
+                listings[key] = self._build_listing(category_id, sort, descending)
+                continue
+            # copied, readers holding the old listing keep a consistent snapshot
+            rows, keys = array("l", rows), list(keys)
+            for old_key in removed:
+                position = bisect_left(keys, old_key)
+                if position < len(keys) and keys[position] == old_key:
+                    del keys[position]
+                    del rows[position]
+            for new_key, row in added:
+                position = bisect_left(keys, new_key)
+                keys.insert(position, new_key)
+                rows.insert(position, row)
+            listings[key] = (rows, keys)
+        self._listings = listings
+
+    def _sort_key(self, sort, descending):
+        product_ids, prices = self.product_ids, self.prices
+        sign = -1 if descending else 1
+        return lambda row: _sort_values(sort, sign, prices[row], product_ids[row])
+
+    def _build_listing(self, category_id, sort, descending):
+        active, category_ids = self.active, self.category_ids
+        rows = [
+            row
+            for row in range(len(self.product_ids))
+            if self._listed(category_id, active[row], category_ids[row])
+        ]
+        sort_key = self._sort_key(sort, descending)
+        rows.sort(key=sort_key)
+        return array("l", rows), [sort_key(row) for row in rows]
+
+    def _listing(self, category_id, sort, descending):
+        key = (category_id, sort, descending)
+        listing = self._listings.get(key)
+        if listing is not None:
+            return listing
+        with self._write_lock:
+            listing = self._listings.get(key)
+            if listing is None:
+                listing = self._build_listing(category_id, sort, descending)
+                self._listings = {**self._listings, key: listing}
+        return listing
+
+    def page(self, category_id, sort, descending, limit, direction=NEXT, after=None):
+        """One keyset page of a category listing.
+
+        Args:
+            category_id (int): category, ALL_CATEGORIES for every product
+            sort (str): one of SORTS
+            descending (bool): sort direction
+            limit (int): page size
+            direction (str, optional): NEXT or PREV of `after`. Defaults to NEXT.
+            after (list, optional): cursor values, (price cents,) product_id. Defaults to None.
+
+        Raises:
+            ValueError: cursor values are not integers
+
+        Returns:
+            tuple: listing dicts, cursor values of the first / last item,
+            has_next, has_prev
+        """
+        if after is not None and not all(
+            isinstance(value, int) and not isinstance(value, bool) for value in after
+        ):
+            raise ValueError("Invalid cursor")
+        rows, keys = self._listing(category_id, sort, descending)
+        if after is None:
+            start = 0
+        else:
+            sign = -1 if descending else 1
+            after_key = tuple(sign * value for value in after)
+            if direction == PREV:
+                end = bisect_left(keys, after_key)
+                start = max(0, end - limit)
+                page_rows = rows[start:end]
+                return self._result(page_rows, sort, end < len(rows), start > 0)
+            start = bisect_right(keys, after_key)
+        page_rows = rows[start : start + limit]
+        return self._result(
+            page_rows, sort, start + limit < len(rows), after is not None and start > 0
+        )
+
+    def _result(self, page_rows, sort, has_next, has_prev):
+        items = [self.summaries[row] for row in page_rows]
+        first = self.cursor_values(page_rows[0], sort) if page_rows else None
+        last = self.cursor_values(page_rows[-1], sort) if page_rows else None
+        return items, first, last, has_next, has_prev
+
+    def cursor_values(self, row, sort):
+        if sort == "price":
+            return [self.prices[row], self.product_ids[row]]
+        return [self.product_ids[row]]
+
+
+def _sort_values(sort, sign, price, product_id):
+    if sort == "price":
+        return (sign * price, sign * product_id)
+    return (sign * product_id,)
+
+
+def product_records(product_ids=None, batch_size=5000):
+    """Column dicts of products, all of them or the given ids."""
+    table = Product.__table__
+    if product_ids is None:
+        result = db.session.execute(
+            select(table).order_by(table.c.product_id).execution_options(
+                yield_per=batch_size
+            )
+        )
+        for row in result.mappings():
+            yield dict(row)
+        return
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start : start + batch_size]
+        for row in db.session.execute(
+            select(table).where(table.c.product_id.in_(chunk))
+        ).mappings():
+            yield dict(row)
+
+
+def _category_records():
+    table = Category.__table__
+    return [
+        dict(row)
+        for row in db.session.execute(select(table).order_by(table.c.name)).mappings()
+    ]
+
+
+def build_index() -> ProductIndex:
+    """Load the whole catalog into a new index."""
+    started_at = time.monotonic()
+    index = ProductIndex()
+    # read first, changes committed during the load are replayed afterwards
+    index.feed = feed.FeedReader(feed.last_change_id(), feed.current_seq())
+    index.set_categories(_category_records())
+    batch = []
+    for record in product_records():
+        batch.append(record)
+        if len(batch) >= 10000:
+            index.upsert(batch)
+            batch = []
+    index.upsert(batch)
+    db.session.remove()
+    index.ready = True
+    logging.info(
+        "Catalog index built, %s products in %.2fs",
+        len(index),
+        time.monotonic() - started_at,
+    )
+    return index
+
+
+def apply_changes(index: ProductIndex, batch_size=1000):
+    """Replay the change feed after the position of the index into it."""
+    applied = 0
+    for product_ids, categories_changed in index.feed.read(batch_size):
+        if product_ids:
+            records = list(product_records(product_ids))
+            index.upsert(records)
+            index.remove(product_ids - {record["product_id"] for record in records})
+        if categories_changed:
+            index.set_categories(_category_records())
+        applied += len(product_ids)
+    db.session.remove()
+    return applied
+
+
+def get_index():
+    """Returns the index of this worker, None until its first build completes."""
+    _ensure_index()
+    return _index if _index is not None and _index.ready else None
+
+
+def _ensure_index():
+    """Start the build / follow thread once per process (workers are forked)."""
+    global _index_pid, _index
+    if _index_pid == os.getpid() or not app.config["CATALOG_INDEX_ENABLED"]:
+        return
+    with _index_lock:
+        if _index_pid == os.getpid():
+            return
+        _index_pid = os.getpid()
+        # an index inherited from the parent stops following the feed at fork
+        _index = None
+        threading.Thread(
+            target=_follow_feed,
+            args=(app._get_current_object(),),
+            name="catalog-index",
+            daemon=True,
+        ).start()
+
+
+def _follow_feed(flask_app):
+    global _index
+    interval = flask_app.config["CATALOG_INDEX_REFRESH_SECONDS"]
+    while _index is None:
+        try:
+            with flask_app.app_context():
+                _index = build_index()
+        except Exception as exc:
+            logging.error("Not able to build catalog index. Exception : %s" % (exc))
+            time.sleep(interval * 10)
+    while True:
+        _refresh.wait(interval)
+        _refresh.clear()
+        try:
+            with flask_app.app_context():
+                apply_changes(_index)
+        except Exception as exc:
+            logging.error("Not able to apply catalog changes. Exception : %s" % (exc))
+
+
+def stats() -> dict:
+    """Size and feed position of the index of this worker."""
+    index = _index
+    if index is None:
+        return {"ready": 0}
+    return {
+        "ready": int(index.ready),
+        "products": len(index),
+        "listings": len(index._listings),
+        "last_change_id": index.feed.last_change_id,
+    }
+
+
+# writes of this worker show up without waiting for the refresh interval
+feed.on_commit(_refresh.set)
@@ -0,0 +1,143 @@
+"""Read path of the catalog.
+
+Served from the in-memory index of the worker (ecom.catalog.index) once it is
+built. Until then, and in processes with CATALOG_INDEX_ENABLED off, pages are
+read from MySQL and cached in redis. Cache keys include the change counter of
+the feed, so any committed catalog write makes every cached page unreachable
+and no explicit invalidation is needed; without redis there is no counter and
+nothing is cached.
+"""
+
+from decimal import Decimal
+
+from flask import current_app as app
+
+from ecom.catalog import feed
+from ecom.catalog.index import ALL_CATEGORIES, LISTING_FIELDS, get_index, price_cents
+from ecom.catalog.models import Category, Product
+from ecom.catalog.schemas import CategorySchema, ProductSchema
+from ecom.extensions import cache
+from ecom.utils import pagination
+from ecom.utils.serialization import dump, dump_many
+
+PRODUCT_SORTS = {
+    "product_id": [Product.product_id],
+    "price": [Product.price, Product.product_id],
+}
+
+
+def _cached(key, load):
+    """`load()` through the redis cache, keyed on the current change counter."""
+    seq = feed.current_seq()
+    if seq is None:
+        return load()
+    key = f"catalog:{seq}:{key}"
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, timeout=app.config["CATALOG_LISTING_CACHE_TIMEOUT"])
+    return value
+
+
+def list_categories():
+    """All categories ordered by name."""
+    index = get_index()
+    if index is not None:
+        return sorted(index.categories.values(), key=lambda category: category["name"])
+    return _cached(
+        "categories",
+        lambda: dump_many(CategorySchema, Category.query.order_by(Category.name).all()),
+    )
+
+
+def category_exists(category_id) -> bool:
+    return any(category["category_id"] == category_id for category in list_categories())
+
+
+def get_product(product_id):
+    """Detail dict of an active product, None when missing or inactive."""
+    index = get_index()
+    if index is not None:
+        return index.product(product_id)
+
+    def load():
+        product = Product.query.filter_by(product_id=product_id, is_active=1).first()
+        # False is cached too, unknown ids don't reach MySQL again
+        return dump(ProductSchema, product) if product is not None else False
+
+    return _cached(f"product:{product_id}", load) or None
+
+
+def list_products(category_id=None, sort="product_id", descending=False, limit=None, cursor=None):
+    """One keyset page of the active products of a category.
+
+    Args:
+        category_id (int, optional): category to list, None for all products. Defaults to None.
+        sort (str, optional): one of PRODUCT_SORTS. Defaults to "product_id".
+        descending (bool, optional): sort direction. Defaults to False.
+        limit (int, optional): page size. Defaults to PAGINATION_DEFAULT_LIMIT.
+        cursor (str, optional): next/prev cursor of a previous page. Defaults to None.
+
+    Raises:
+        ValueError: the cursor is malformed, not of integers or belongs to another sort
+
+    Returns:
+        tuple: products, `pagination` dict and `links` dict
+    """
+    limit = pagination.get_limit(limit)
+    direction, values = pagination.NEXT, None
+    if cursor:
+        cursor_sort, direction, values = pagination.decode_cursor(cursor)
+        if cursor_sort != sort or len(values) != len(PRODUCT_SORTS[sort]):
+            raise ValueError("Cursor does not belong to this sort")
+        # price cents and product ids, anything else is a crafted cursor
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            raise ValueError("Invalid cursor")
+    index = get_index()
+    if index is not None:
+        items, first, last, has_next, has_prev = index.page(
+            category_id or ALL_CATEGORIES, sort, descending, limit, direction, values
+        )
+        next_cursor = (
+            pagination.encode_cursor(sort, last, pagination.NEXT) if has_next and items else None
+        )
+        prev_cursor = (
+            pagination.encode_cursor(sort, first, pagination.PREV) if has_prev and items else None
+        )
+    else:
+        items, next_cursor, prev_cursor = _cached(
+            f"products:{category_id}:{sort}:{int(descending)}:{limit}:{cursor}",
+            lambda: _query_products(category_id, sort, descending, limit, cursor),
+        )
+    page, links = pagination.page_metadata(sort, limit, len(items), next_cursor, prev_cursor)
+    return items, page, links
+
+
+def _query_products(category_id, sort, descending, limit, cursor):
+    query = Product.query.filter(Product.is_active == 1)
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+
+    # cursors carry the price in cents, the same cursor works on the index
+    def to_cursor(product):
+        if sort == "price":
+            return [price_cents(product.price), product.product_id]
+        return [product.product_id]
+
+    def from_cursor(values):
+        if sort == "price":
+            return [Decimal(values[0]) / 100, values[1]]
+        return values
+
+    products, page, _ = pagination.paginate(
+        query,
+        sort,
+        PRODUCT_SORTS[sort],
+        limit=limit,
+        cursor=cursor,
+        descending=descending,
+        to_cursor=to_cursor,
+        from_cursor=from_cursor,
+    )
+    items = dump_many(ProductSchema, products, only=LISTING_FIELDS)
+    return items, page["next_cursor"], page["prev_cursor"]
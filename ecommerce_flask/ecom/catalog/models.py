@@ -0,0 +1,78 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    CHAR,
+    DECIMAL,
+    INTEGER,
+    NVARCHAR,
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    text,
+)
+from sqlalchemy.orm import relationship
+
+from ecom.extensions import db
+
+
+class Category(db.Model):
+    __tablename__ = "category"
+
+    category_id = Column(INTEGER, primary_key=True)
+    name = Column(NVARCHAR(100), nullable=False)
+    slug = Column(String(100), nullable=False, unique=True)
+    parent_id = Column(
+        INTEGER,
+        ForeignKey("category.category_id", name="category_ibfk_1", ondelete="SET NULL"),
+        nullable=True,
+    )
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
+
+
+class Product(db.Model):
+    __tablename__ = "product"
+
+    product_id = Column(INTEGER, primary_key=True)
+    sku = Column(String(64), nullable=False, unique=True)
+    name = Column(NVARCHAR(255), nullable=False)
+    description = Column(Text)
+    category_id = Column(
+        INTEGER,
+        ForeignKey(Category.category_id, name="product_ibfk_1", ondelete="SET NULL"),
+        nullable=True,
+    )
+    price = Column(DECIMAL(12, 2), nullable=False)
+    currency = Column(CHAR(3), nullable=False, default="USD", server_default=text("'USD'"))
+    is_active = Column(INTEGER, nullable=False, default=1, server_default=text("1"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
+    category = relationship("Category", backref="products", lazy=True)
+
+    __table_args__ = (
+        # SQL fallback of the category listings, see ecom.catalog.listings
+        Index("ix_product_category_id_is_active_price", "category_id", "is_active", "price"),
+    )
+
+
+class CatalogChange(db.Model):
+    """Change feed of the catalog, written in the transaction of every product /
+    category write and replayed by the in-memory index of every worker."""
+
+    __tablename__ = "catalog_changes"
+
+    ENTITY_PRODUCT = "product"
+    ENTITY_CATEGORY = "category"
+
+    # sqlite only autoincrements INTEGER primary keys
+    change_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(INTEGER, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_catalog_changes_created_at", "created_at"),)
@@ -0,0 +1,14 @@
+from ecom.catalog.models import Category, Product
+from ecom.extensions import mm
+
+
+class CategorySchema(mm.SQLAlchemyAutoSchema):
+    class Meta:
+        model = Category
+        include_fk = True
+
+
+class ProductSchema(mm.SQLAlchemyAutoSchema):
+    class Meta:
+        model = Product
+        include_fk = True
@@ -0,0 +1,798 @@
+"""Full text search of the product catalog.
+
+Products are indexed by the words of their name, sku and description (name /
+sku words weigh NAME_WEIGHT times more) into an inverted index: for every word
+the sorted document numbers containing it and the weighted term frequencies.
+Queries match every word (falling back to any word when nothing matches all of
+them) and are ranked with BM25. Search as you type expands the last word to
+the most frequent words starting with it; suggestions also look up words
+sharing trigrams with it, which catches typos and infixes.
+
+The index is built in bulk from the products table into one file
+(`flask ecom build_search_index`, or the first worker finding no file) with
+every structure stored as a flat array, and memory mapped by the workers: a
+new gunicorn worker is ready after reading the header, and all workers of a
+host share the pages of the file. Products written after the build are
+followed through the catalog change feed (ecom.catalog.feed) into a small
+in-memory delta per worker; a rebuilt file is picked up when its mtime
+changes and replaces the delta. A worker whose delta outgrows
+SEARCH_DELTA_MAX_DOCS rebuilds the file of its host, which keeps the delta
+small without a manual `build_search_index`.
+"""
+
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app as app
+
+from ecom.catalog import feed
+from ecom.catalog.index import LISTING_FIELDS, get_index, product_records
+from ecom.catalog.models import Product
+from ecom.catalog.schemas import ProductSchema
+from ecom.extensions import db
+from ecom.utils.serialization import dump_many
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover, windows
+    fcntl = None
+
+MAGIC = b"ECOMSRCH"
+VERSION = 1
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# a word of the name / sku counts as much as this many words of the description
+NAME_WEIGHT = 3
+DESCRIPTION_CHARS = 4000
+MAX_TERM_LENGTH = 40
+MAX_TF = 65535
+# terms of a prefix range looked at for completions
+PREFIX_SCAN = 5000
+
+_TOKEN_RE = re.compile(r"\w+")
+
+_search = None
+_search_pid = None
+_search_lock = threading.Lock()
+_refresh = threading.Event()
+
+
+def tokenize(text) -> list:
+    """Lower case words of `text` with accents removed."""
+    if not text:
+        return []
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(
+            char
+            for char in unicodedata.normalize("NFKD", text)
+            if not unicodedata.combining(char)
+        )
+    return [token for token in _TOKEN_RE.findall(text) if len(token) <= MAX_TERM_LENGTH]
+
+
+def trigrams(term) -> set:
+    return {term[start : start + 3] for start in range(len(term) - 2)}
+
+
+def document_terms(name, sku, description) -> Counter:
+    """Weighted term frequencies of a product."""
+    terms = Counter()
+    for token in tokenize(name):
+        terms[token] += NAME_WEIGHT
+    for token in tokenize(sku):
+        terms[token] += NAME_WEIGHT
+    for token in tokenize((description or "")[:DESCRIPTION_CHARS]):
+        terms[token] += 1
+    return terms
+
+
+class IndexBuilder:
+    """Accumulates documents in memory and writes them as an index file."""
+
+    def __init__(self):
+        self.postings = {}  # term -> (document numbers, term frequencies)
+        self.doc_ids = array("q")
+        self.doc_lens = array("I")
+        self.doc_categories = array("I")
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def add(self, product_id, category_id, terms):
+        doc = len(self.doc_ids)
+        length = sum(terms.values())
+        self.doc_ids.append(product_id)
+        self.doc_lens.append(length)
+        self.doc_categories.append(category_id or 0)
+        self.total_len += length
+        postings = self.postings
+        for term, tf in terms.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = (array("I"), array("H"))
+            entry[0].append(doc)
+            entry[1].append(min(tf, MAX_TF))
+
+    def write(self, path, last_change_id=0):
+        """Write the index to `path`, atomically replacing an older file.
+
+        Args:
+            path (str): index file
+            last_change_id (int, optional): feed position the documents are current to. Defaults to 0.
+        """
+        terms = sorted(self.postings)
+        term_blob, term_offsets = _string_table(terms)
+        avg_len = self.total_len / len(self.doc_ids) if self.doc_ids else 0
+        doc_lens = self.doc_lens
+        posting_offsets = array("Q", [0])
+        post_docs = array("I")
+        post_tfs = array("H")
+        impact_docs = array("I")
+        impact_tfs = array("H")
+        gram_terms = {}
+        for term_id, term in enumerate(terms):
+            docs, tfs = self.postings[term]
+            post_docs.extend(docs)
+            post_tfs.extend(tfs)
+            posting_offsets.append(len(post_docs))
+            # the same postings by descending BM25 weight, for early termination
+            order = sorted(
+                range(len(docs)),
+                key=lambda position: _bm25(tfs[position], doc_lens[docs[position]], avg_len),
+                reverse=True,
+            )
+            impact_docs.extend(docs[position] for position in order)
+            impact_tfs.extend(tfs[position] for position in order)
+            for gram in trigrams(term):
+                gram_terms.setdefault(gram, array("I")).append(term_id)
+        grams = sorted(gram_terms)
+        gram_blob, gram_offsets = _string_table(grams)
+        gram_posting_offsets = array("Q", [0])
+        gram_post_terms = array("I")
+        for gram in grams:
+            gram_post_terms.extend(gram_terms[gram])
+            gram_posting_offsets.append(len(gram_post_terms))
+
+        meta = {
+            "version": VERSION,
+            "byteorder": sys.byteorder,
+            "doc_count": len(self.doc_ids),
+            "avg_doc_len": avg_len,
+            "last_change_id": last_change_id,
+            "built_at": time.time(),
+        }
+        _write_file(
+            path,
+            meta,
+            {
+                "doc_ids": self.doc_ids,
+                "doc_lens": self.doc_lens,
+                "doc_categories": self.doc_categories,
+                "term_offsets": term_offsets,
+                "term_blob": term_blob,
+                "posting_offsets": posting_offsets,
+                "post_docs": post_docs,
+                "post_tfs": post_tfs,
+                "impact_docs": impact_docs,
+                "impact_tfs": impact_tfs,
+                "gram_offsets": gram_offsets,
+                "gram_blob": gram_blob,
+                "gram_posting_offsets": gram_posting_offsets,
+                "gram_post_terms": gram_post_terms,
+            },
+        )
+
+
+def _string_table(strings):
+    """Sorted strings as one utf-8 blob and the offsets of every string in it."""
+    blob = bytearray()
+    offsets = array("Q", [0])
+    for string in strings:
+        blob += string.encode("utf-8")
+        offsets.append(len(blob))
+    return blob, offsets
+
+
+def _write_file(path, meta, sections):
+    """MAGIC, header length, json header, then every section 8 byte aligned."""
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        size = memoryview(data).nbytes
+        typecode = data.typecode if isinstance(data, array) else "B"
+        layout[name] = [offset, size, typecode]
+        offset += size + (-size % 8)
+    header = json.dumps(dict(meta, sections=layout)).encode("utf-8")
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as index_file:
+        index_file.write(MAGIC)
+        index_file.write(len(header).to_bytes(4, "little"))
+        index_file.write(header)
+        index_file.write(b"\0" * (-(12 + len(header)) % 8))
+        for name, data in sections.items():
+            index_file.write(data)
+            index_file.write(b"\0" * (-layout[name][1] % 8))
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    # workers keep reading the old file through their mapping until they reload
+    os.replace(tmp_path, path)
+
+
+class _Strings:
+    """Read only sequence over a string table, bisect works on it."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return str(self.blob[self.offsets[position] : self.offsets[position + 1]], "utf-8")
+
+    def find(self, string):
+        position = bisect_left(self, string)
+        if position < len(self) and self[position] == string:
+            return position
+        return None
+
+    def prefix_range(self, prefix):
+        start = bisect_left(self, prefix)
+        return start, bisect_left(self, prefix + "\U0010ffff", start)
+
+
+class MappedIndex:
+    """Index file mapped read only, sections are zero copy memoryviews."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        with open(path, "rb") as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a search index")
+        header_len = int.from_bytes(self._mmap[8:12], "little")
+        meta = json.loads(self._mmap[12 : 12 + header_len])
+        if meta["version"] != VERSION or meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built by another version / platform")
+        data_start = 12 + header_len + (-(12 + header_len) % 8)
+
+        view = memoryview(self._mmap)
+        for name, (offset, size, typecode) in meta.pop("sections").items():
+            section = view[data_start + offset : data_start + offset + size]
+            setattr(self, name, section if typecode == "B" else section.cast(typecode))
+        self.meta = meta
+        self.terms = _Strings(self.term_offsets, self.term_blob)
+        self.grams = _Strings(self.gram_offsets, self.gram_blob)
+
+    def __len__(self):
+        return self.meta["doc_count"]
+
+    def df(self, term_id) -> int:
+        return self.posting_offsets[term_id + 1] - self.posting_offsets[term_id]
+
+    def postings(self, term_id):
+        """Document numbers containing the term and their frequencies, sorted
+        by document number and by descending BM25 weight."""
+        start, end = self.posting_offsets[term_id], self.posting_offsets[term_id + 1]
+        return (
+            self.post_docs[start:end],
+            self.post_tfs[start:end],
+            self.impact_docs[start:end],
+            self.impact_tfs[start:end],
+        )
+
+    def prefix_terms(self, prefix, limit):
+        """Most frequent terms starting with `prefix`, as (term, df)."""
+        start, end = self.terms.prefix_range(prefix)
+        best = heapq.nlargest(limit, range(start, min(end, start + PREFIX_SCAN)), key=self.df)
+        return [(self.terms[term_id], self.df(term_id)) for term_id in best]
+
+    def similar_terms(self, term, limit):
+        """Terms sharing at least half of the trigrams of `term`, as (term, df)."""
+        grams = trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            gram_id = self.grams.find(gram)
+            if gram_id is not None:
+                start = self.gram_posting_offsets[gram_id]
+                shared.update(self.gram_post_terms[start : self.gram_posting_offsets[gram_id + 1]])
+        threshold = max(1, math.ceil(len(grams) / 2))
+        best = heapq.nlargest(
+            limit,
+            (term_id for term_id, count in shared.items() if count >= threshold),
+            key=lambda term_id: (shared[term_id], self.df(term_id)),
+        )
+        return [(self.terms[term_id], self.df(term_id)) for term_id in best]
+
+
+class SearchIndex:
+    """Mapped base index plus the products changed since it was built.
+
+    The delta is written by the feed thread only; readers take no lock, the
+    per term posting dicts and the sorted term list are replaced on write,
+    never mutated.
+    """
+
+    def __init__(self, base: MappedIndex):
+        self.base = base
+        self.feed = feed.FeedReader(base.meta["last_change_id"])
+        self.hidden = set()  # product ids whose base document is stale
+        self.docs = {}  # product_id -> (terms, length, category_id)
+        self.postings = {}  # term -> {product_id: tf}
+        self.terms = []  # sorted terms of the delta, for prefix lookups
+        self._terms_changed = False
+        self._write_lock = threading.Lock()
+
+    def update(self, records, removed_ids=()):
+        """Reindex changed products from their column dicts."""
+        with self._write_lock:
+            for record in records:
+                self._remove(record["product_id"])
+                if record["is_active"]:
+                    self._add(record)
+            for product_id in removed_ids:
+                self._remove(product_id)
+            if self._terms_changed:
+                self.terms = sorted(self.postings)
+                self._terms_changed = False
+
+    def _add(self, record):
+        product_id = record["product_id"]
+        terms = document_terms(record["name"], record["sku"], record["description"])
+        self.docs[product_id] = (terms, sum(terms.values()), record["category_id"] or 0)
+        for term, tf in terms.items():
+            if term not in self.postings:
+                self._terms_changed = True
+            postings = dict(self.postings.get(term, ()))
+            postings[product_id] = min(tf, MAX_TF)
+            self.postings[term] = postings
+
+    def _remove(self, product_id):
+        self.hidden.add(product_id)
+        doc = self.docs.pop(product_id, None)
+        if doc is None:
+            return
+        for term in doc[0]:
+            postings = dict(self.postings[term])
+            postings.pop(product_id, None)
+            if postings:
+                self.postings[term] = postings
+            else:
+                del self.postings[term]
+                self._terms_changed = True
+
+    def expand(self, prefix, limit):
+        """Most frequent terms starting with `prefix` in base and delta, as (term, df)."""
+        counts = dict(self.base.prefix_terms(prefix, limit))
+        terms = self.terms
+        start = bisect_left(terms, prefix)
+        for term in terms[start : bisect_left(terms, prefix + "\U0010ffff", start)]:
+            counts[term] = counts.get(term, 0) + len(self.postings.get(term, ()))
+        return heapq.nlargest(limit, counts.items(), key=lambda item: item[1])
+
+    def search(
+        self, query, limit=20, category_id=None, prefix=False, expansions=10, max_scan=None
+    ):
+        """Top products matching `query`, BM25 ranked.
+
+        Args:
+            query (str): words to look for
+            limit (int, optional): number of results. Defaults to 20.
+            category_id (int, optional): only products of this category. Defaults to None.
+            prefix (bool, optional): the last word also matches longer words. Defaults to False.
+            expansions (int, optional): words the last word expands to with `prefix`. Defaults to 10.
+            max_scan (int, optional): postings read at most, see `_top_base`. Defaults to None.
+
+        Returns:
+            list: (product_id, score) best first
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        groups = [[token] for token in tokens]
+        if prefix:
+            groups[-1] = [term for term, _ in self.expand(tokens[-1], expansions)] or groups[-1]
+
+        # document frequencies span base and delta; stale base documents are
+        # still counted until the next rebuild, scores are approximate
+        doc_count = len(self.base) + len(self.docs)
+        avg_len = self.base.meta["avg_doc_len"] or 1
+        base_groups, delta_groups = [], []
+        for terms in groups:
+            base_group, delta_group = [], []
+            for term in terms:
+                term_id = self.base.terms.find(term)
+                postings = self.base.postings(term_id) if term_id is not None else None
+                delta = self.postings.get(term, {})
+                df = (len(postings[0]) if postings else 0) + len(delta)
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                if postings and len(postings[0]):
+                    base_group.append(postings + (idf,))
+                if delta:
+                    delta_group.append((delta, idf))
+            base_groups.append(base_group)
+            delta_groups.append(delta_group)
+
+        args = (base_groups, delta_groups, avg_len, category_id, limit, max_scan)
+        hits = self._top(*args, match_all=True)
+        if not hits and len(groups) > 1:
+            hits = self._top(*args, match_all=False)
+        return hits
+
+    def _top(
+        self, base_groups, delta_groups, avg_len, category_id, limit, max_scan, match_all
+    ):
+        base = self.base
+        hidden = self.hidden
+
+        def accept(doc):
+            if base.doc_ids[doc] in hidden:
+                return False
+            return not category_id or base.doc_categories[doc] == category_id
+
+        hits = [
+            (base.doc_ids[doc], score)
+            for doc, score in _top_base(
+                base, base_groups, avg_len, limit, match_all, accept, max_scan
+            )
+        ]
+        for product_id, score in self._score_delta(delta_groups, avg_len, match_all).items():
+            doc = self.docs.get(product_id)
+            if doc is not None and (not category_id or doc[2] == category_id):
+                hits.append((product_id, score))
+        return heapq.nlargest(limit, hits, key=lambda item: item[1])
+
+    def _score_delta(self, groups, avg_len, match_all):
+        scores = Counter()
+        matched = Counter()
+        for group in groups:
+            seen = set()
+            for postings, idf in group:
+                for product_id, tf in postings.items():
+                    doc = self.docs.get(product_id)
+                    if doc is None:
+                        continue
+                    scores[product_id] += idf * _bm25(tf, doc[1], avg_len)
+                    seen.add(product_id)
+            matched.update(seen)
+        if match_all:
+            return {
+                product_id: score
+                for product_id, score in scores.items()
+                if matched[product_id] == len(groups)
+            }
+        return scores
+
+    def suggest(self, text, limit=10):
+        """Completions of the last word of `text`, most frequent first, then
+        words sharing trigrams with it (typos / infixes).
+
+        Returns:
+            list: `text` with its last word completed
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        head, last = tokens[:-1], tokens[-1]
+        candidates = dict(self.expand(last, limit))
+        if len(candidates) < limit and len(last) >= 3:
+            for term, df in self.base.similar_terms(last, limit):
+                candidates.setdefault(term, df)
+        return [" ".join(head + [term]) for term in list(candidates)[:limit]]
+
+    def stats(self) -> dict:
+        return {
+            "base_docs": len(self.base),
+            "base_terms": len(self.base.terms),
+            "delta_docs": len(self.docs),
+            "hidden_docs": len(self.hidden),
+            "last_change_id": self.feed.last_change_id,
+        }
+
+
+def _bm25(tf, length, avg_len):
+    return tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_len))
+
+
+def _top_base(base, groups, avg_len, limit, match_all, accept, max_scan=None):
+    """Best `limit` base documents as (document number, score), with the
+    threshold algorithm.
+
+    Postings of the scanned words are read by descending weight and every
+    document met is scored in full by binary search in the document ordered
+    postings. The scan stops once the worst kept score reaches the best score
+    a document not met yet could have, so a query for a common word reads
+    about `limit` postings instead of all of them. With `match_all` only the
+    group with the fewest postings is scanned, a match must contain it.
+
+    When all words of the query are very common the bound stays loose, the
+    scan then stops after `max_scan` postings: the result holds the matches
+    weighing the most on the scanned word, no longer the exact top.
+
+    Args:
+        groups (list): per query word, (docs, tfs, impact_docs, impact_tfs, idf) of its terms
+        accept (callable): document number -> whether it may be returned
+        max_scan (int, optional): postings read at most. Defaults to None (no limit).
+    """
+    if match_all:
+        if not all(groups):
+            return []
+        scanned = [min(groups, key=lambda group: sum(len(entry[0]) for entry in group))]
+    else:
+        scanned = groups
+    lens = base.doc_lens
+    lists = [entry for group in scanned for entry in group]
+    if not lists:
+        return []
+    others = [group for group in groups if group is not scanned[0]] if match_all else []
+    # the scanned group adds at most the sum of its heads, other groups their max
+    rest_bound = sum(
+        max(
+            idf * _bm25(impact_tfs[0], lens[impact_docs[0]], avg_len)
+            for _, _, impact_docs, impact_tfs, idf in group
+        )
+        for group in others
+    )
+    positions = [0] * len(lists)
+    heads = [entry[4] * _bm25(entry[3][0], lens[entry[2][0]], avg_len) for entry in lists]
+    head_sum = sum(heads)
+    best = []  # min heap of (score, doc)
+    seen = set()
+    scans = 0
+    while max_scan is None or scans < max_scan:
+        current = 0 if len(lists) == 1 else max(range(len(lists)), key=heads.__getitem__)
+        head = heads[current]
+        if head < 0 or (len(best) >= limit and best[0][0] >= rest_bound + head_sum):
+            break
+        _, _, impact_docs, impact_tfs, idf = lists[current]
+        position = positions[current]
+        doc = impact_docs[position]
+        doc_len = lens[doc]
+        position += 1
+        positions[current] = position
+        scans += 1
+        if position < len(impact_docs):
+            heads[current] = idf * _bm25(impact_tfs[position], lens[impact_docs[position]], avg_len)
+            head_sum += heads[current] - head
+        else:
+            heads[current] = -1.0
+            head_sum -= head
+        if len(lists) > 1:
+            if doc in seen:
+                continue
+            seen.add(doc)
+        if not accept(doc):
+            continue
+
+        # words not scanned first, most documents are rejected by one probe
+        score = 0.0
+        for group in others:
+            group_score = _group_score(group, doc, doc_len, avg_len)
+            if group_score is None:
+                break
+            score += group_score
+        else:
+            if len(lists) == 1:
+                score += head
+            else:
+                for group in scanned:
+                    score += _group_score(group, doc, doc_len, avg_len) or 0.0
+            if len(best) < limit:
+                heapq.heappush(best, (score, doc))
+            elif score > best[0][0]:
+                heapq.heapreplace(best, (score, doc))
+    return [(doc, score) for score, doc in sorted(best, reverse=True)]
+
+
+def _group_score(group, doc, doc_len, avg_len):
+    """Score of `doc` for the terms of one query word, None when it has none of them."""
+    score = None
+    for docs, tfs, _, _, idf in group:
+        found = bisect_left(docs, doc)
+        if found < len(docs) and docs[found] == doc:
+            score = (score or 0.0) + idf * _bm25(tfs[found], doc_len, avg_len)
+    return score
+
+
+@contextmanager
+def _build_lock(path):
+    """One process per host builds a missing file, the others wait for it."""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_index_file(path=None, batch_size=5000) -> int:
+    """Build the index file from the active products.
+
+    Args:
+        path (str, optional): index file. Defaults to SEARCH_INDEX_PATH.
+        batch_size (int, optional): rows fetched per round trip. Defaults to 5000.
+
+    Returns:
+        int: number of indexed products
+    """
+    path = path or app.config["SEARCH_INDEX_PATH"]
+    started_at = time.monotonic()
+    # read first, changes committed during the build are replayed by the workers
+    last_change_id = feed.last_change_id()
+    builder = IndexBuilder()
+    for record in product_records(batch_size=batch_size):
+        if record["is_active"]:
+            builder.add(
+                record["product_id"],
+                record["category_id"],
+                document_terms(record["name"], record["sku"], record["description"]),
+            )
+    db.session.remove()
+    builder.write(path, last_change_id)
+    logging.info(
+        "Search index of %s products written to %s in %.2fs",
+        len(builder),
+        path,
+        time.monotonic() - started_at,
+    )
+    return len(builder)
+
+
+def load_index(path) -> SearchIndex:
+    """Map the index file, building it first when there is none."""
+    if not os.path.exists(path):
+        with _build_lock(path):
+            if not os.path.exists(path):
+                build_index_file(path)
+    return SearchIndex(MappedIndex(path))
+
+
+def _rebuild(path, mtime):
+    """Rebuild the file once per host, skipped when another worker just did."""
+    with _build_lock(path):
+        if _mtime(path) == mtime:
+            build_index_file(path)
+
+
+def apply_changes(search: SearchIndex, batch_size=1000) -> int:
+    """Reindex the products changed since the position of `search` in the feed."""
+    applied = 0
+    for product_ids, _ in search.feed.read(batch_size):
+        if product_ids:
+            records = list(product_records(product_ids))
+            search.update(records, product_ids - {record["product_id"] for record in records})
+            applied += len(product_ids)
+    db.session.remove()
+    return applied
+
+
+def get_search():
+    """Returns the search index of this worker, None until it is loaded."""
+    _ensure_search()
+    return _search
+
+
+def _ensure_search():
+    """Start the load / follow thread once per process (workers are forked)."""
+    global _search_pid, _search
+    if _search_pid == os.getpid() or not app.config["SEARCH_ENABLED"]:
+        return
+    with _search_lock:
+        if _search_pid == os.getpid():
+            return
+        _search_pid = os.getpid()
+        # the mapping is shared, the delta inherited at fork stops following the feed
+        _search = None
+        threading.Thread(
+            target=_follow_feed,
+            args=(app._get_current_object(),),
+            name="catalog-search",
+            daemon=True,
+        ).start()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _follow_feed(flask_app):
+    global _search
+    path = flask_app.config["SEARCH_INDEX_PATH"]
+    interval = flask_app.config["SEARCH_REFRESH_SECONDS"]
+    while True:
+        try:
+            with flask_app.app_context():
+                if _search is None or _search.base.mtime != _mtime(path):
+                    # a rebuilt file replaces the delta, it is caught up before use
+                    search = load_index(path)
+                    apply_changes(search)
+                    _search = search
+                else:
+                    apply_changes(_search)
+                    if len(_search.hidden) > flask_app.config["SEARCH_DELTA_MAX_DOCS"]:
+                        # picked up through its mtime on the next round
+                        _rebuild(path, _search.base.mtime)
+        except Exception as exc:
+            logging.error("Not able to refresh search index. Exception : %s" % (exc))
+            time.sleep(interval * 10)
+        _refresh.wait(interval)
+        _refresh.clear()
+
+
+def search_products(query, limit=20, category_id=None, prefix=False):
+    """Listing dicts of the best matches with their `score`, None while the
+    index is loading."""
+    search = get_search()
+    if search is None:
+        return None
+    hits = search.search(
+        query,
+        limit,
+        category_id,
+        prefix,
+        app.config["SEARCH_PREFIX_EXPANSIONS"],
+        app.config["SEARCH_MAX_SCAN"],
+    )
+    index = get_index()
+    if index is not None:
+        summaries = {product_id: index.summary(product_id) for product_id, _ in hits}
+    else:
+        products = Product.query.filter(
+            Product.product_id.in_([product_id for product_id, _ in hits]),
+            Product.is_active == 1,
+        ).all()
+        summaries = {
+            item["product_id"]: item
+            for item in dump_many(ProductSchema, products, only=LISTING_FIELDS)
+        }
+    items = []
+    for product_id, score in hits:
+        summary = summaries.get(product_id)
+        if summary is not None:
+            items.append(dict(summary, score=round(score, 4)))
+    return items
+
+
+def suggest(text, limit=10):
+    """Typeahead completions, None while the index is loading."""
+    search = get_search()
+    if search is None:
+        return None
+    return search.suggest(text, limit)
+
+
+def stats() -> dict:
+    """Size and feed position of the search index of this worker."""
+    search = _search
+    if search is None:
+        return {"ready": 0}
+    return dict(search.stats(), ready=1)
+
+
+# writes of this worker show up without waiting for the refresh interval
+feed.on_commit(_refresh.set)
@@ -0,0 +1,2 @@
+from .routes import api as catalog_api_v1
+from .routes import search_api as search_api_v1
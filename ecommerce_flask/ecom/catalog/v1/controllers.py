@@ -0,0 +1,134 @@
+import logging
+
+from flask import current_app as app
+from sqlalchemy.exc import IntegrityError
+
+from ecom.catalog import listings, search
+from ecom.catalog.models import Category, Product
+from ecom.catalog.schemas import CategorySchema, ProductSchema
+from ecom.extensions import db
+from ecom.utils import Response
+from ecom.utils.serialization import dump
+
+PRODUCT_FIELDS = ("sku", "name", "description", "category_id", "price", "currency")
+
+
+def get_categories():
+    """Get all categories, served from the index / redis.
+
+    Returns:
+        dict: categories ordered by name
+    """
+    return Response.success(listings.list_categories())
+
+
+def get_products(category_id=None, limit=None, cursor=None, sort="product_id", order="asc"):
+    """Get a page of active products with keyset pagination.
+
+    Args:
+        category_id (int, optional): category to list, None for all. Defaults to None.
+        limit (int, optional): page size. Defaults to PAGINATION_DEFAULT_LIMIT.
+        cursor (str, optional): next/prev cursor of a previous page. Defaults to None.
+        sort (str, optional): one of PRODUCT_SORTS. Defaults to "product_id".
+        order (str, optional): "asc" or "desc". Defaults to "asc".
+
+    Returns:
+        dict: products with pagination and links
+    """
+    if sort not in listings.PRODUCT_SORTS:
+        return Response.failure(
+            400, payload=f"sort must be one of {list(listings.PRODUCT_SORTS)}"
+        )
+    if category_id is not None and not listings.category_exists(category_id):
+        return Response.failure(404, "Category not found")
+    try:
+        products, page, links = listings.list_products(
+            category_id, sort, order == "desc", limit, cursor
+        )
+    except ValueError as exc:
+        return Response.failure(400, payload=str(exc))
+    return Response.success(products, pagination=page, links=links)
+
+
+def get_product(product_id):
+    product = listings.get_product(product_id)
+    if product is None:
+        return Response.failure(404, "Product not found")
+    return Response.success(product)
+
+
+def create_category(name, slug, parent_id=None):
+    category = Category(name=name, slug=slug, parent_id=parent_id)
+    db.session.add(category)
+    try:
+        db.session.commit()
+    except IntegrityError as exc:
+        db.session.rollback()
+        logging.error("Not able to create category. Exception : %s" % (exc))
+        return Response.failure(409, "Category with same slug or unknown parent")
+    return Response.success(dump(CategorySchema, category))
+
+
+def create_product(args):
+    product = Product(**{field: args[field] for field in PRODUCT_FIELDS if args.get(field) is not None})
+    db.session.add(product)
+    try:
+        db.session.commit()
+    except IntegrityError as exc:
+        db.session.rollback()
+        logging.error("Not able to create product. Exception : %s" % (exc))
+        return Response.failure(409, "Product with same sku or unknown category")
+    return Response.success(dump(ProductSchema, product))
+
+
+def update_product(product_id, args):
+    product = db.session.get(Product, product_id)
+    if product is None:
+        return Response.failure(404, "Product not found")
+    for field in PRODUCT_FIELDS + ("is_active",):
+        if args.get(field) is not None:
+            setattr(product, field, args[field])
+    try:
+        db.session.commit()
+    except IntegrityError as exc:
+        db.session.rollback()
+        logging.error("Not able to update product. Exception : %s" % (exc))
+        return Response.failure(409, "Product with same sku or unknown category")
+    return Response.success(dump(ProductSchema, product))
+
+
+def delete_product(product_id):
+    """Deactivate a product, the row stays for carts / orders referencing it."""
+    product = db.session.get(Product, product_id)
+    if product is None:
+        return Response.failure(404, "Product not found")
+    product.is_active = 0
+    db.session.commit()
+    return Response.success("Product deleted")
+
+
+def search_products(query, limit=None, category_id=None, prefix=False):
+    """Search active products.
+
+    Args:
+        query (str): words to look for
+        limit (int, optional): number of results, clamped to SEARCH_MAX_RESULTS. Defaults to 20.
+        category_id (int, optional): only products of this category. Defaults to None.
+        prefix (bool, optional): the last word is still being typed. Defaults to False.
+
+    Returns:
+        dict: products best match first, each with its `score`
+    """
+    limit = max(1, min(limit or 20, app.config["SEARCH_MAX_RESULTS"]))
+    items = search.search_products(query, limit, category_id, prefix)
+    if items is None:
+        return Response.failure(503, "Search index is loading")
+    return Response.success(items, metadata={"query": query, "count": len(items)})
+
+
+def suggest(text, limit=10):
+    limit = max(1, min(limit, app.config["SEARCH_MAX_RESULTS"]))
+    completions = search.suggest(text, limit)
+    if completions is None:
+        return Response.failure(503, "Search index is loading")
+    return Response.success(completions)
@@ -0,0 +1,150 @@
+from decimal import Decimal, InvalidOperation
+
+from flask_restx import Namespace, Resource, reqparse
+
+from ecom.auth.models import Role
+from ecom.auth.v1.decorator import roles_accepted
+from . import controllers
+
+api = Namespace("Catalog", description="Product catalog routes")
+search_api = Namespace("Search", description="Product search routes")
+
+LISTING_PARAMS = {
+    "limit": "page size",
+    "cursor": "next_cursor / prev_cursor of the previous page",
+    "sort": "product_id or price",
+    "order": "asc or desc",
+}
+
+
+def check_for_price(value):
+    # via str, a json float would keep its binary rounding error
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError("Must be a decimal number")
+    if price < 0 or price != price.quantize(Decimal("0.01")):
+        raise ValueError("Must be a positive amount with at most 2 decimals")
+    return price
+
+
+def listing_args():
+    parser = reqparse.RequestParser()
+    parser.add_argument("limit", type=int, location="args")
+    parser.add_argument("cursor", type=str, location="args")
+    parser.add_argument("sort", type=str, location="args", default="product_id")
+    parser.add_argument(
+        "order", type=str, location="args", default="asc", choices=("asc", "desc")
+    )
+    return parser.parse_args()
+
+
+def product_parser(required):
+    parser = reqparse.RequestParser()
+    parser.add_argument("sku", type=str, location="json", required=required, nullable=False)
+    parser.add_argument("name", type=str, location="json", required=required, nullable=False)
+    parser.add_argument("description", type=str, location="json")
+    parser.add_argument("category_id", type=int, location="json")
+    parser.add_argument(
+        "price", type=check_for_price, location="json", required=required, nullable=False
+    )
+    parser.add_argument("currency", type=str, location="json")
+    return parser
+
+
+@api.route("/categories")
+class Categories(Resource):
+    def get(self):
+        """List all categories"""
+        return controllers.get_categories()
+
+    @roles_accepted([Role.ROLE_ADMIN])
+    def post(self):
+        """Create a category"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("name", type=str, location="json", required=True, nullable=False)
+        parser.add_argument("slug", type=str, location="json", required=True, nullable=False)
+        parser.add_argument("parent_id", type=int, location="json")
+        args = parser.parse_args()
+        return controllers.create_category(args["name"], args["slug"], args["parent_id"])
+
+
+@api.route("/categories/<int:category_id>/products")
+class CategoryProducts(Resource):
+    @api.doc(params=LISTING_PARAMS)
+    def get(self, category_id):
+        """List active products of a category, keyset paginated"""
+        args = listing_args()
+        return controllers.get_products(
+            category_id, args["limit"], args["cursor"], args["sort"], args["order"]
+        )
+
+
+@api.route("/products")
+class Products(Resource):
+    @api.doc(params=LISTING_PARAMS)
+    def get(self):
+        """List all active products, keyset paginated"""
+        args = listing_args()
+        return controllers.get_products(
+            None, args["limit"], args["cursor"], args["sort"], args["order"]
+        )
+
+    @roles_accepted([Role.ROLE_ADMIN])
+    def post(self):
+        """Create a product"""
+        return controllers.create_product(product_parser(required=True).parse_args())
+
+
+@api.route("/products/<int:product_id>")
+class ProductDetail(Resource):
+    def get(self, product_id):
+        """Get an active product"""
+        return controllers.get_product(product_id)
+
+    @roles_accepted([Role.ROLE_ADMIN])
+    def put(self, product_id):
+        """Update fields of a product"""
+        parser = product_parser(required=False)
+        parser.add_argument("is_active", type=int, location="json", choices=(0, 1))
+        return controllers.update_product(product_id, parser.parse_args())
+
+    @roles_accepted([Role.ROLE_ADMIN])
+    def delete(self, product_id):
+        """Deactivate a product"""
+        return controllers.delete_product(product_id)
+
+
+@search_api.route("/")
+class Search(Resource):
+    @search_api.doc(
+        params={
+            "q": "words to look for",
+            "limit": "number of results",
+            "category_id": "only products of this category",
+            "prefix": "1 when the last word is still being typed",
+        }
+    )
+    def get(self):
+        """Search active products, best matches first"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("q", type=str, location="args", required=True, nullable=False)
+        parser.add_argument("limit", type=int, location="args")
+        parser.add_argument("category_id", type=int, location="args")
+        parser.add_argument("prefix", type=int, location="args", default=0, choices=(0, 1))
+        args = parser.parse_args()
+        return controllers.search_products(
+            args["q"], args["limit"], args["category_id"], bool(args["prefix"])
+        )
+
+
+@search_api.route("/suggest")
+class Suggest(Resource):
+    @search_api.doc(params={"q": "text typed so far", "limit": "number of completions"})
+    def get(self):
+        """Typeahead completions of the last word"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("q", type=str, location="args", required=True, nullable=False)
+        parser.add_argument("limit", type=int, location="args", default=10)
+        args = parser.parse_args()
+        return controllers.suggest(args["q"], args["limit"])
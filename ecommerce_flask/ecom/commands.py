@@ -1,10 +1,15 @@
 import logging
+import click
 from flask.cli import AppGroup, with_appcontext
 from flask import current_app as app
 from os import getenv
 
 from ecom.commands_seed_data import create_roles, create_users, flask_profiler
-from ecom.extensions import db, cache
+from ecom.commands_import_users import import_users
+from ecom import commands_benchmarks, commands_explain
+from ecom.catalog import search
+from ecom.constants import CACHE_GENERATION_KEY
+from ecom.extensions import db, cache, get_redis_client, sweep_cache_generations
 
 
 ecom_cli = AppGroup("ecom", help="ECOM custom CLI commands")
@@ -24,6 +29,124 @@ def create_users_command():
     create_users()
 
 
+@ecom_cli.command(name="import_users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=5000, show_default=True, help="rows per transaction")
+@click.option("--workers", type=int, default=None, help="hashing processes, defaults to cpu count")
+@with_appcontext
+def import_users_command(path, batch_size, workers):
+    """import_users command used to bulk create/update users from a CSV or XLSX file."""
+    logging.root.setLevel(logging.INFO)
+    import_users(path, batch_size=batch_size, workers=workers)
+
+
+@ecom_cli.command(name="sweep_cache")
+@with_appcontext
+def sweep_cache_command():
+    """sweep_cache command used to remove keys of old cache generations from redis."""
+    client = get_redis_client()
+    if client is None or not app.config["CACHE_USE_GENERATIONS"]:
+        logging.info("Cache generations are not in use, nothing to sweep")
+        return
+    key_prefix = cache.cache.key_prefix
+    generation = int(client.get(key_prefix + CACHE_GENERATION_KEY) or 0)
+    sweep_cache_generations(
+        client, key_prefix, generation, app.config["CACHE_CLEAR_BATCH_SIZE"]
+    )
+
+
+@ecom_cli.command(name="bench_password_policy")
+@click.option("--iterations", default=2000, show_default=True)
+@with_appcontext
+def bench_password_policy_command(iterations):
+    """bench_password_policy command used to measure per call cost of password validation."""
+    logging.root.setLevel(logging.INFO)
+    commands_benchmarks.bench_password_policy(iterations)
+
+
+@ecom_cli.command(name="bench_json")
+@click.option("--rows", default=10000, show_default=True, help="items in the list response")
+@click.option("--iterations", default=10, show_default=True)
+@with_appcontext
+def bench_json_command(rows, iterations):
+    """bench_json command used to compare the JSON encoders on a large list response."""
+    logging.root.setLevel(logging.INFO)
+    commands_benchmarks.bench_json(rows, iterations)
+
+
+@ecom_cli.command(name="bench_startup")
+@click.option("--role", default="web", show_default=True, type=click.Choice(["web", "celery", "cli"]))
+@click.option("--runs", default=5, show_default=True)
+@click.option("--top", default=15, show_default=True, help="packages to report")
+@with_appcontext
+def bench_startup_command(role, runs, top):
+    """bench_startup command used to measure cold start and import cost per package."""
+    logging.root.setLevel(logging.INFO)
+    commands_benchmarks.bench_startup(role, runs, top)
+
+
+@ecom_cli.command(name="bench_memory")
+@click.option("--runs", default=3, show_default=True)
+@with_appcontext
+def bench_memory_command(runs):
+    """bench_memory command used to compare RSS after boot of the web / celery / cli profiles."""
+    logging.root.setLevel(logging.INFO)
+    commands_benchmarks.bench_memory(runs=runs)
+
+
+@ecom_cli.command(name="build_search_index")
+@click.option("--path", type=click.Path(dir_okay=False), help="index file, defaults to SEARCH_INDEX_PATH")
+@with_appcontext
+def build_search_index_command(path):
+    """build_search_index command used to rebuild the product search index file, workers reload it."""
+    logging.root.setLevel(logging.INFO)
+    search.build_index_file(path)
+
+
+@ecom_cli.command(name="bench_search")
+@click.option("--products", default=1000000, show_default=True, help="size of the synthetic catalog")
+@click.option("--queries", default=1000, show_default=True, help="queries per kind")
+@click.option("--max-scan", default=5000, show_default=True, help="see SEARCH_MAX_SCAN")
+@with_appcontext
+def bench_search_command(products, queries, max_scan):
+    """bench_search command used to measure build / load time and query latency of product search."""
+    logging.root.setLevel(logging.INFO)
+    commands_benchmarks.bench_search(products, queries, max_scan)
+
+
+@ecom_cli.command(name="bench_cart")
+@click.option("--threads", default="1,4,16,64", show_default=True, help="comma separated thread counts")
+@click.option("--seconds", default=3.0, show_default=True, help="duration of each run")
+@with_appcontext
+def bench_cart_command(threads, seconds):
+    """bench_cart command used to measure cart operations per second under concurrency."""
+    logging.root.setLevel(logging.INFO)
+    commands_benchmarks.bench_cart(tuple(int(count) for count in threads.split(",")), seconds)
+
+
+@ecom_cli.command(name="bench_inventory")
+@click.option("--attempts", default=10000, show_default=True, help="reservations tried in total")
+@click.option("--threads", default=64, show_default=True, help="concurrent buyers")
+@click.option("--stock", default=5000, show_default=True, help="units of the product")
+@with_appcontext
+def bench_inventory_command(attempts, threads, stock):
+    """bench_inventory command used to measure concurrent reservations of one product."""
+    logging.root.setLevel(logging.INFO)
+    commands_benchmarks.bench_inventory(attempts, threads, stock)
+
+
+@ecom_cli.command(name="explain_hot_queries")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="expected index per query")
+@click.option("--save-baseline", type=click.Path(dir_okay=False), help="write the current plans as baseline")
+@with_appcontext
+def explain_hot_queries_command(baseline, save_baseline):
+    """explain_hot_queries command used to check the query plans of the auth hot paths."""
+    logging.root.setLevel(logging.INFO)
+    regressions = commands_explain.explain_hot_queries(baseline, save_baseline)
+    if regressions:
+        raise SystemExit(1)
+
+
 @ecom_cli.command(name="deploy")
 @with_appcontext
 def deploy():
@@ -44,7 +167,9 @@ def deploy():
         flask_profiler()
 
     try:
-        cache.clear()  # To clear the cache while deploying the app
+        # To clear the cache while deploying the app, only bumps the generation
+        # when generations are used, see sweep_cache for old ones
+        cache.clear()
     except Exception as exc:
         logging.error(
             "Failed to clear cache. This happends mostly when connection to Redis could not be established. Exception: %s"
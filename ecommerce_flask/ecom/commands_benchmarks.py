@@ -0,0 +1,663 @@
+"""Micro benchmarks run through the `ecom bench_*` CLI commands.
+
+Each benchmark keeps a copy of the implementation it replaced, so the numbers
+compare old and new code on the same machine.
+"""
+
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import uuid
+from decimal import Decimal
+
+from flask import current_app as app
+from redis.exceptions import WatchError
+
+from ecom.cart import store
+from ecom.catalog import search
+from ecom.extensions import get_redis_client
+from ecom.inventory import reservations
+from ecom.utils import Response, check_for_password, generate_password
+from ecom.utils import json_encoder
+
+
+def _legacy_check_for_password(password_text):
+    """`check_for_password` before the password policy engine."""
+    char_regex = re.compile(r"([\w\W]{12,})")
+    lower_regex = re.compile(r"[a-z]+")
+    upper_regex = re.compile(r"[A-Z]+")
+    digit_regex = re.compile(r"[0-9]+")
+    non_alpha_regex = re.compile(r"\W+")
+
+    if char_regex.findall(password_text) == []:
+        raise ValueError("Password must contain atleast 12 characters")
+    elif lower_regex.findall(password_text) == []:
+        raise ValueError("Password must contain atleast one lowercase character")
+    elif upper_regex.findall(password_text) == []:
+        raise ValueError("Password must contain atleast one uppercase character")
+    elif digit_regex.findall(password_text) == []:
+        raise ValueError("Password must contain atleast one digit character")
+    elif non_alpha_regex.findall(password_text) == []:
+        raise ValueError("Password must contain atleast one non alphanumeric character")
+    return password_text
+
+
+def _legacy_generate_password():
+    """`generate_password` before the password policy engine."""
+    password = ""
+    special_chars = "!@#$&~"
+    while True:
+        password += random.choice(string.ascii_uppercase)
+        password += random.choice(string.ascii_lowercase)
+        password += random.choice(string.digits)
+        password += random.choice(special_chars)
+        for _ in range(0, random.randint(12, 15)):
+            password += random.choice(
+                string.ascii_uppercase
+                + string.ascii_lowercase
+                + string.digits
+                + special_chars
+            )
+        password = "".join(random.sample(password, len(password)))
+        try:
+            _legacy_check_for_password(password)
+            break
+        except Exception:
+            pass
+    return password
+
+
+def _per_call_us(func, samples, iterations):
+    def run():
+        for sample in samples:
+            try:
+                func(sample)
+            except ValueError:
+                pass
+
+    seconds = min(timeit.repeat(run, number=iterations, repeat=5))
+    return seconds / (iterations * len(samples)) * 1e6
+
+
+def bench_password_policy(iterations=2000):
+    """Per call cost of password validation / generation, legacy vs policy engine.
+
+    change-password validates two passwords per request, reset-password one.
+
+    Returns:
+        dict: microseconds per call / per request path
+    """
+    valid = [_legacy_generate_password() for _ in range(20)]
+    invalid = [
+        "short",
+        "nouppercase123!x",
+        "NOLOWERCASE123!X",
+        "NoDigitsHere!!xx",
+        "NoSpecial12345xx",
+    ]
+    results = {}
+    for label, samples in (("valid", valid), ("invalid", invalid)):
+        legacy = _per_call_us(_legacy_check_for_password, samples, iterations)
+        current = _per_call_us(check_for_password, samples, iterations)
+        results[f"validate_{label}_us"] = {"legacy": legacy, "policy": current}
+
+    legacy_valid = results["validate_valid_us"]["legacy"]
+    policy_valid = results["validate_valid_us"]["policy"]
+    results["change_password_path_us"] = {
+        "legacy": 2 * legacy_valid,
+        "policy": 2 * policy_valid,
+    }
+    results["reset_password_path_us"] = {"legacy": legacy_valid, "policy": policy_valid}
+
+    number = max(1, iterations // 10)
+    results["generate_us"] = {
+        "legacy": min(timeit.repeat(_legacy_generate_password, number=number, repeat=5))
+        / number
+        * 1e6,
+        "policy": min(timeit.repeat(generate_password, number=number, repeat=5))
+        / number
+        * 1e6,
+    }
+
+    for name, values in results.items():
+        logging.info(
+            "%-26s legacy %8.2f us  policy %8.2f us  (x%.1f)",
+            name,
+            values["legacy"],
+            values["policy"],
+            values["legacy"] / values["policy"] if values["policy"] else 0,
+        )
+    return results
+
+
+def _legacy_dumps_json(data):
+    """flask-restx `output_json` body with `RESTX_JSON = {"default": str}`."""
+    return (json.dumps(data, default=str) + "\n").encode("utf-8")
+
+
+def _list_response(rows):
+    now = datetime.datetime.utcnow()
+    data = [
+        {
+            "user_id": index,
+            "uuid": uuid.uuid4(),
+            "email": f"user{index}@example.com",
+            "first_name": "First",
+            "last_name": "Last",
+            "is_active": 1,
+            "balance": Decimal("1234.56"),
+            "created_at": now,
+            "updated_at": now,
+            "roles": ["Business User"],
+        }
+        for index in range(rows)
+    ]
+    return Response.success(data, pagination={"limit": rows, "next_cursor": None})
+
+
+def bench_json(rows=10000, iterations=10):
+    """Serialization time and allocations of a large list response per encoder.
+
+    Returns:
+        dict: milliseconds, peak KiB allocated and output KiB per encoder
+    """
+    data = _list_response(rows)
+    encoders = {"restx": _legacy_dumps_json}
+    for name in json_encoder.BACKENDS:
+        encoders[name] = json_encoder.get_dumps(name)
+
+    results = {}
+    for name, dumps in encoders.items():
+        seconds = min(timeit.repeat(lambda: dumps(data), number=iterations, repeat=3))
+        tracemalloc.start()
+        body = dumps(data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            "ms": seconds / iterations * 1000,
+            "peak_kib": peak / 1024,
+            "output_kib": len(body) / 1024,
+        }
+
+    baseline = results["restx"]["ms"]
+    for name, values in results.items():
+        logging.info(
+            "%-8s %9.2f ms  peak %9.1f KiB  output %9.1f KiB  (x%.1f)",
+            name,
+            values["ms"],
+            values["peak_kib"],
+            values["output_kib"],
+            baseline / values["ms"] if values["ms"] else 0,
+        )
+    return results
+
+
+_STARTUP_SCRIPT = """
+import time
+started_at = time.perf_counter()
+from ecom import create_app
+imported_at = time.perf_counter()
+create_app()
+print(imported_at - started_at, time.perf_counter() - imported_at)
+"""
+
+
+def _parse_importtime(stderr):
+    """Sum `-X importtime` self times per top level package, in microseconds."""
+    costs = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        package = name.strip().split(".")[0]
+        costs[package] = costs.get(package, 0) + int(self_us)
+    return costs
+
+
+def bench_startup(role="web", runs=5, top=15):
+    """Cold start of a process of `role`: import of ecom, create_app and import cost per package.
+
+    Every run is a fresh interpreter, like a new gunicorn / celery worker.
+
+    Returns:
+        dict: median import / create_app milliseconds and import ms per package
+    """
+    env = dict(os.environ, APP_ROLE=role)
+    import_times, create_times = [], []
+    packages = {}
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _STARTUP_SCRIPT],
+            capture_output=True,
+            text=True,
+            env=env,
+        )
+        if result.returncode != 0:
+            logging.error("Startup run failed:\n%s", result.stderr[-2000:])
+            return {}
+        import_seconds, create_seconds = map(float, result.stdout.split()[-2:])
+        import_times.append(import_seconds * 1000)
+        create_times.append(create_seconds * 1000)
+        for package, cost in _parse_importtime(result.stderr).items():
+            packages.setdefault(package, []).append(cost / 1000)
+
+    results = {
+        "import_ecom_ms": statistics.median(import_times),
+        "create_app_ms": statistics.median(create_times),
+        "packages_ms": dict(
+            sorted(
+                ((package, statistics.median(costs)) for package, costs in packages.items()),
+                key=lambda item: item[1],
+                reverse=True,
+            )[:top]
+        ),
+    }
+    logging.info(
+        "role %s: import ecom %.1f ms, create_app %.1f ms (median of %s runs)",
+        role,
+        results["import_ecom_ms"],
+        results["create_app_ms"],
+        runs,
+    )
+    for package, cost in results["packages_ms"].items():
+        logging.info("    %-24s %8.1f ms", package, cost)
+    return results
+
+
+_MEMORY_SCRIPT = """
+import gc, resource, sys
+from ecom import create_app
+app = create_app(role=sys.argv[1])
+gc.collect()
+rss_kib = 0
+try:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                rss_kib = int(line.split()[1])
+except OSError:
+    pass
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is KiB on linux, bytes on macOS
+peak_kib = peak // 1024 if sys.platform == "darwin" else peak
+print(rss_kib or peak_kib, peak_kib, len(sys.modules), len(app.url_map._rules))
+"""
+
+
+def bench_memory(roles=("web", "celery", "cli"), runs=3):
+    """RSS of a freshly booted process per app role.
+
+    Returns:
+        dict: median RSS / peak RSS MiB, loaded modules and url rules per role
+    """
+    results = {}
+    for role in roles:
+        samples = []
+        for _ in range(runs):
+            result = subprocess.run(
+                [sys.executable, "-c", _MEMORY_SCRIPT, role],
+                capture_output=True,
+                text=True,
+            )
+            if result.returncode != 0:
+                logging.error("Boot of role %s failed:\n%s", role, result.stderr[-2000:])
+                break
+            samples.append([int(value) for value in result.stdout.split()[-4:]])
+        if not samples:
+            continue
+        rss, peak, modules, rules = (
+            statistics.median(column) for column in zip(*samples)
+        )
+        results[role] = {
+            "rss_mib": rss / 1024,
+            "peak_rss_mib": peak / 1024,
+            "modules": modules,
+            "url_rules": rules,
+        }
+        logging.info(
+            "%-7s rss %7.1f MiB  peak %7.1f MiB  %5d modules  %4d url rules",
+            role,
+            rss / 1024,
+            peak / 1024,
+            modules,
+            rules,
+        )
+    return results
+
+
+def _synthetic_products(count, vocabulary_size=20000, seed=7):
+    """(product_id, category_id, name, sku, description) with Zipf distributed words."""
+    rng = random.Random(seed)
+    vocabulary = set()
+    while len(vocabulary) < vocabulary_size:
+        vocabulary.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))))
+    vocabulary = sorted(vocabulary)
+    rng.shuffle(vocabulary)
+    cum_weights = list(
+        itertools.accumulate(1 / rank**1.07 for rank in range(1, vocabulary_size + 1))
+    )
+    for product_id in range(1, count + 1):
+        name = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(2, 6))
+        description = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(10, 40))
+        yield (
+            product_id,
+            rng.randint(1, 200),
+            " ".join(name),
+            f"SKU-{product_id:08d}",
+            " ".join(description),
+        )
+
+
+def _latency_ms(func, args_list):
+    samples = []
+    for args in args_list:
+        started_at = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started_at) * 1000)
+    percentiles = statistics.quantiles(samples, n=100)
+    return {"p50": percentiles[49], "p95": percentiles[94], "p99": percentiles[98]}
+
+
+def bench_search(products=1000000, queries=1000, max_scan=5000, seed=7):
+    """Build / write / load time of the search index on a synthetic catalog and
+    query latency per kind of query.
+
+    Returns:
+        dict: build numbers and p50 / p95 / p99 milliseconds per query kind
+    """
+    rng = random.Random(seed)
+    sample_every = max(1, products // queries)
+    names = []
+    builder = search.IndexBuilder()
+    started_at = time.perf_counter()
+    for product_id, category_id, name, sku, description in _synthetic_products(
+        products, seed=seed
+    ):
+        builder.add(product_id, category_id, search.document_terms(name, sku, description))
+        if product_id % sample_every == 0:
+            names.append(name.split())
+    built_at = time.perf_counter()
+
+    directory = tempfile.mkdtemp(prefix="ecom-search-")
+    try:
+        path = os.path.join(directory, "search_index.bin")
+        builder.write(path)
+        written_at = time.perf_counter()
+        del builder
+        load_started_at = time.perf_counter()
+        index = search.SearchIndex(search.MappedIndex(path))
+        loaded_at = time.perf_counter()
+        results = {
+            "build_s": built_at - started_at,
+            "write_s": written_at - built_at,
+            "load_ms": (loaded_at - load_started_at) * 1000,
+            "file_mib": os.path.getsize(path) / 1024 / 1024,
+            "terms": len(index.base.terms),
+        }
+        logging.info(
+            "%s products: build %.1fs  write %.1fs  load %.2f ms  file %.1f MiB  %s terms",
+            products,
+            results["build_s"],
+            results["write_s"],
+            results["load_ms"],
+            results["file_mib"],
+            results["terms"],
+        )
+
+        def typo(word):
+            if len(word) < 4:
+                return word
+            position = rng.randrange(len(word) - 1)
+            return word[:position] + word[position + 1] + word[position] + word[position + 2 :]
+
+        kinds = {
+            "1 word": (index.search, [(words[0],) for words in names]),
+            "2 words": (
+                index.search,
+                [(" ".join(words[:2]), 20, None, False, 10, max_scan) for words in names],
+            ),
+            "3 words": (
+                index.search,
+                [(" ".join(words[:3]), 20, None, False, 10, max_scan) for words in names],
+            ),
+            "as you type": (
+                index.search,
+                [(f"{words[0]} {words[1][:3]}", 20, None, True, 10, max_scan) for words in names],
+            ),
+            "suggest": (index.suggest, [(words[0][:2],) for words in names]),
+            "suggest typo": (index.suggest, [(typo(words[1]),) for words in names]),
+        }
+        for kind, (func, args_list) in kinds.items():
+            results[kind] = _latency_ms(func, args_list)
+            logging.info(
+                "%-13s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms",
+                kind,
+                results[kind]["p50"],
+                results[kind]["p95"],
+                results[kind]["p99"],
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def _cart_worker(flask_app, thread_no, cart_keys, deadline, atomic, counts):
+    snapshot = store.price_snapshot(Decimal("9.99"), "USD")
+    rng = random.Random(thread_no)
+    operations = 0
+    with flask_app.app_context():
+        client = get_redis_client()
+        while time.perf_counter() < deadline:
+            cart_key = rng.choice(cart_keys)
+            product_id = rng.randrange(1, 20)
+            if atomic:
+                store.add_item(cart_key, product_id, 1, snapshot)
+                store.add_item(cart_key, product_id, -1, snapshot)
+            else:
+                # read-modify-write from the client, what the scripts replace
+                key, field = store.redis_key(cart_key), f"q:{product_id}"
+                for delta in (1, -1):
+                    quantity = int(client.hget(key, field) or 0) + delta
+                    client.hset(key, field, quantity)
+            operations += 2
+            if operations % 20 == 0:
+                store.get_cart(cart_key)
+                operations += 1
+    counts[thread_no] = operations
+
+
+def bench_cart(threads=(1, 4, 16, 64), seconds=3.0, carts_per_thread=100):
+    """Cart operations per second against redis, with every thread on its own
+    carts and with all threads on one hot cart.
+
+    Each thread adds one of a product and takes it away again, so every line
+    left at the end is a lost update. The "naive" run does the same with a
+    client side read-modify-write for comparison.
+
+    Returns:
+        dict: ops/s and lost updates per run
+    """
+    flask_app = app._get_current_object()
+    client = get_redis_client()
+    if client is None:
+        raise store.CartUnavailable()
+    run_id = uuid.uuid4().hex[:8]
+    results = {}
+    cart_keys = []
+    try:
+        for mode in ("distinct", "hot", "naive hot"):
+            for count in threads:
+                hot_key = store.anonymous_cart_key(f"bench{run_id}-{mode[0]}{count}")
+                per_thread = [
+                    [hot_key]
+                    if mode != "distinct"
+                    else [
+                        store.anonymous_cart_key(f"bench{run_id}-{count}-{thread_no}-{i}")
+                        for i in range(carts_per_thread)
+                    ]
+                    for thread_no in range(count)
+                ]
+                run_keys = {key for keys in per_thread for key in keys}
+                cart_keys.extend(run_keys)
+                counts = [0] * count
+                deadline = time.perf_counter() + seconds
+                workers = [
+                    threading.Thread(
+                        target=_cart_worker,
+                        args=(flask_app, thread_no, keys, deadline, mode != "naive hot", counts),
+                    )
+                    for thread_no, keys in enumerate(per_thread)
+                ]
+                started_at = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - started_at
+                lost = sum(
+                    int(value)
+                    for key in run_keys
+                    for field, value in store.read_fields(key, load=False).items()
+                    if field.startswith("q:")
+                )
+                results[f"{mode} {count}"] = {"ops_s": sum(counts) / elapsed, "lost": lost}
+                logging.info(
+                    "%-9s %3s threads  %9.0f ops/s  lost updates %s",
+                    mode,
+                    count,
+                    sum(counts) / elapsed,
+                    lost,
+                )
+    finally:
+        for start in range(0, len(cart_keys), 1000):
+            client.delete(*[store.redis_key(key) for key in cart_keys[start : start + 1000]])
+    return results
+
+
+def _watch_reserve(client, key, quantity):
+    """Check-and-decrement with WATCH / MULTI, what the reserve script replaces.
+
+    Returns:
+        tuple: reserved, number of retries after a conflicting write
+    """
+    retries = 0
+    with client.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                if int(pipe.hget(key, "available")) < quantity:
+                    pipe.unwatch()
+                    return False, retries
+                pipe.multi()
+                pipe.hincrby(key, "available", -quantity)
+                pipe.hincrby(key, "held", quantity)
+                pipe.execute()
+                return True, retries
+            except WatchError:
+                retries += 1
+
+
+def bench_inventory(attempts=10000, threads=64, stock=5000):
+    """Concurrent reservations of one product, more demand than stock.
+
+    Runs the reserve script and, for comparison, an optimistic WATCH / MULTI
+    check-and-decrement. A correct run holds exactly `stock` units.
+
+    Returns:
+        dict: throughput, latency percentiles, units held and retries per mode
+    """
+    client = get_redis_client()
+    if client is None:
+        raise reservations.InventoryUnavailable()
+    product_id = f"bench{uuid.uuid4().hex[:8]}"
+    key = reservations.stock_key(product_id)
+    per_thread = attempts // threads
+    hold_ids = []
+    results = {}
+    try:
+        for mode in ("script", "watch"):
+            client.delete(key)
+            client.hset(key, mapping={"available": stock, "held": 0})
+            samples = [[] for _ in range(threads)]
+            held = [0] * threads
+            retries = [0] * threads
+            barrier = threading.Barrier(threads)
+
+            def worker(thread_no):
+                barrier.wait()
+                for attempt in range(per_thread):
+                    started_at = time.perf_counter()
+                    if mode == "script":
+                        reservation_id = f"{product_id}-{thread_no}-{attempt}"
+                        try:
+                            reservations._hold(
+                                client, reservation_id, [(product_id, 1)], time.time() + 600
+                            )
+                            held[thread_no] += 1
+                            hold_ids.append(reservation_id)
+                        except reservations.OutOfStock:
+                            pass
+                    else:
+                        reserved, conflicts = _watch_reserve(client, key, 1)
+                        held[thread_no] += reserved
+                        retries[thread_no] += conflicts
+                    samples[thread_no].append((time.perf_counter() - started_at) * 1000)
+
+            workers = [threading.Thread(target=worker, args=(no,)) for no in range(threads)]
+            started_at = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started_at
+            percentiles = statistics.quantiles(itertools.chain(*samples), n=100)
+            counters = {
+                field.decode(): int(value) for field, value in client.hgetall(key).items()
+            }
+            results[mode] = {
+                "ops_s": per_thread * threads / elapsed,
+                "p50_ms": percentiles[49],
+                "p99_ms": percentiles[98],
+                "held": sum(held),
+                "available": counters["available"],
+                "retries": sum(retries),
+            }
+            logging.info(
+                "%-6s %s attempts / %s threads: %8.0f ops/s  p50 %6.2f ms  p99 %6.2f ms  "
+                "held %s  available %s  retries %s",
+                mode,
+                per_thread * threads,
+                threads,
+                results[mode]["ops_s"],
+                results[mode]["p50_ms"],
+                results[mode]["p99_ms"],
+                results[mode]["held"],
+                results[mode]["available"],
+                results[mode]["retries"],
+            )
+            if results[mode]["held"] != min(stock, per_thread * threads):
+                logging.error("%s held %s units of %s", mode, results[mode]["held"], stock)
+    finally:
+        for start in range(0, len(hold_ids), 1000):
+            chunk = hold_ids[start : start + 1000]
+            client.delete(*[reservations.hold_key(reservation_id) for reservation_id in chunk])
+            client.zrem(reservations.STOCK_HOLDS_KEY, *chunk)
+        client.srem(reservations.STOCK_DIRTY_KEY, product_id)
+        client.delete(key)
+    return results
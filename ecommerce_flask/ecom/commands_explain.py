@@ -0,0 +1,145 @@
+"""EXPLAIN the hot auth queries and report plan regressions.
+
+A plan is a regression when the query scans a whole table, or when it uses a
+different index than recorded in a baseline file (`--save-baseline` writes one
+from the current plans). MySQL and SQLite are supported.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text
+
+from ecom.auth.models import OTP, AuditEvent, Role, User
+from ecom.extensions import db
+
+
+def hot_queries():
+    """Statements of the auth hot paths, with representative parameters."""
+    now = datetime(2024, 1, 1)
+    return {
+        "user_lookup_active": select(User).where(
+            User.email == "user@example.com", User.is_active == 1
+        ),
+        "user_identify": select(User).where(User.user_id == 1),
+        "role_identify": select(Role).where(Role.role_id == 1),
+        "decorator_role_join": select(Role.role_name)
+        .join(User, User.role_id == Role.role_id)
+        .where(User.user_id == 1),
+        "otp_by_email": select(OTP).where(
+            OTP.email == "user@example.com", OTP.created_at >= now - timedelta(minutes=2)
+        ),
+        "otp_expiry_sweep": select(OTP.id)
+        .where(OTP.created_at < now)
+        .order_by(OTP.id)
+        .limit(1000),
+        "users_page_created_at": select(User)
+        .where(User.created_at > now)
+        .order_by(User.created_at, User.user_id)
+        .limit(51),
+        "audit_by_user": select(AuditEvent)
+        .where(AuditEvent.user_id == 1)
+        .order_by(AuditEvent.created_at.desc())
+        .limit(50),
+    }
+
+
+def _explain_mysql(connection, sql):
+    rows = connection.execute(text("EXPLAIN " + sql)).mappings().all()
+    steps = []
+    for row in rows:
+        if row["table"] is None:
+            continue
+        steps.append(
+            {
+                "table": row["table"],
+                "index": row["key"],
+                "full_scan": row["type"] == "ALL",
+                "detail": f"type={row['type']} rows={row['rows']} extra={row['Extra']}",
+            }
+        )
+    return steps
+
+
+def _explain_sqlite(connection, sql):
+    rows = connection.execute(text("EXPLAIN QUERY PLAN " + sql)).all()
+    steps = []
+    for row in rows:
+        detail = row[-1]
+        words = detail.split()
+        if words[0] not in ("SCAN", "SEARCH"):
+            continue
+        index = None
+        if " INDEX " in detail:
+            index = words[words.index("INDEX") + 1]
+        elif "PRIMARY KEY" in detail:
+            index = "PRIMARY"
+        steps.append(
+            {
+                "table": words[1],
+                "index": index,
+                "full_scan": words[0] == "SCAN" and index is None,
+                "detail": detail,
+            }
+        )
+    return steps
+
+
+EXPLAINERS = {"mysql": _explain_mysql, "sqlite": _explain_sqlite}
+
+
+def explain_hot_queries(baseline=None, save_baseline=None):
+    """EXPLAIN every hot query and log its plan.
+
+    Args:
+        baseline (str, optional): json file with the expected index per query. Defaults to None.
+        save_baseline (str, optional): write the current indexes to this file. Defaults to None.
+
+    Returns:
+        list: names of the queries with a regressed plan
+    """
+    dialect = db.engine.dialect.name
+    explain = EXPLAINERS.get(dialect)
+    if explain is None:
+        logging.error("EXPLAIN is not supported for the %s dialect", dialect)
+        return []
+
+    expected = {}
+    if baseline:
+        with open(baseline) as baseline_file:
+            expected = json.load(baseline_file)
+
+    plans = {}
+    regressions = []
+    with db.engine.connect() as connection:
+        for name, statement in hot_queries().items():
+            sql = str(
+                statement.compile(
+                    dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+                )
+            )
+            steps = explain(connection, sql)
+            plans[name] = {step["table"]: step["index"] for step in steps}
+
+            problems = [
+                f"full scan of {step['table']}" for step in steps if step["full_scan"]
+            ]
+            for table, index in expected.get(name, {}).items():
+                if plans[name].get(table) != index:
+                    problems.append(
+                        f"{table} uses {plans[name].get(table)}, baseline {index}"
+                    )
+
+            if problems:
+                regressions.append(name)
+                logging.error("%-24s REGRESSION: %s", name, "; ".join(problems))
+            else:
+                logging.info("%-24s ok", name)
+            for step in steps:
+                logging.info("    %-14s %s", step["table"], step["detail"])
+
+    if save_baseline:
+        with open(save_baseline, "w") as baseline_file:
+            json.dump(plans, baseline_file, indent=4, sort_keys=True)
+    return regressions
@@ -0,0 +1,210 @@
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, update
+
+from ecom.auth import identity_cache
+from ecom.auth.hashing import bulk_hasher
+from ecom.auth.models import Role, User
+from ecom.auth.token_versions import forget_user_versions
+from ecom.extensions import db
+from ecom.utils.password_policy import get_password_policy
+
+USER_COLUMNS = ["email", "first_name", "last_name", "password", "role"]
+
+
+def import_users(path, batch_size=5000, workers=None):
+    """Import/update users from a CSV or XLSX file in batches.
+
+    Each batch costs one SELECT for the existing emails, a process pool pass
+    for the password hashes and one transaction with a bulk insert and a bulk
+    update. Rows of an existing email update that user. New users without a
+    password get a random one and set theirs with the forgot password flow.
+
+    Args:
+        path (str): CSV or XLSX file with `email` and optional
+            `first_name`, `last_name`, `password`, `role` columns
+        batch_size (int, optional): rows per transaction. Defaults to 5000.
+        workers (int, optional): hashing processes. Defaults to cpu count.
+
+    Returns:
+        dict: inserted / updated / skipped row counts
+    """
+    role_ids = {role.role_name: role.role_id for role in Role.query.all()}
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+    started_at = time.perf_counter()
+
+    with bulk_hasher(workers) as hash_many:
+        for batch_no, rows in enumerate(_read_batches(path, batch_size), start=1):
+            batch_started_at = time.perf_counter()
+            counts = _import_batch(rows, role_ids, hash_many)
+            for key, value in counts.items():
+                totals[key] += value
+            elapsed = time.perf_counter() - batch_started_at
+            logging.info(
+                "Batch %s: %s rows in %.2fs (%.0f rows/sec) %s",
+                batch_no,
+                len(rows),
+                elapsed,
+                len(rows) / elapsed if elapsed else 0,
+                counts,
+            )
+
+    elapsed = time.perf_counter() - started_at
+    processed = totals["inserted"] + totals["updated"]
+    logging.info(
+        "Users import finished: %s rows in %.2fs (%.0f rows/sec) %s",
+        processed,
+        elapsed,
+        processed / elapsed if elapsed else 0,
+        totals,
+    )
+    return totals
+
+
+def _read_batches(path, batch_size):
+    """Stream rows of the file as lists of dicts without loading it whole."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [
+                str(cell).strip() if cell is not None else "" for cell in next(rows)
+            ]
+            batch = []
+            for row in rows:
+                batch.append(dict(zip(header, row)))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            workbook.close()
+    else:
+        import pandas as pd
+
+        for frame in pd.read_csv(
+            path,
+            chunksize=batch_size,
+            dtype=str,
+            keep_default_na=False,
+            usecols=lambda column: column.strip() in USER_COLUMNS,
+        ):
+            frame.columns = [column.strip() for column in frame.columns]
+            yield frame.to_dict("records")
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _keep(column):
+    return func.coalesce(bindparam(f"b_{column.name}"), column)
+
+
+def _import_batch(rows, role_ids, hash_many):
+    # last row wins for duplicated emails inside a batch, emails are compared
+    # lower-cased like the case insensitive collation of `users.email` does
+    by_email = {}
+    skipped = 0
+    for row in rows:
+        email = _clean(row.get("email"))
+        if email is None:
+            skipped += 1
+            continue
+        by_email[email.lower()] = row
+
+    if not by_email:
+        return {"inserted": 0, "updated": 0, "skipped": skipped}
+
+    # stored emails keep their case, they are the identity cache keys
+    stored_emails = {}
+    existing = {}
+    for stored_email, user_id in db.session.query(User.email, User.user_id).filter(
+        User.email.in_(list(by_email))
+    ):
+        stored_emails[stored_email.lower()] = stored_email
+        existing[stored_email.lower()] = user_id
+
+    # existing users keep their password unless the row carries one
+    emails = list(by_email)
+    passwords = [_clean(by_email[email].get("password")) for email in emails]
+    to_hash = [
+        index
+        for index, (email, password) in enumerate(zip(emails, passwords))
+        if password is not None or email not in existing
+    ]
+    hashes = [None] * len(emails)
+    # new users without a password get a random one of their own and sign in
+    # through the forgot password flow, never a shared default
+    policy = get_password_policy()
+    hashed = hash_many([passwords[index] or policy.generate() for index in to_hash])
+    for index, value in zip(to_hash, hashed):
+        hashes[index] = value
+
+    now = datetime.utcnow()
+    inserts, updates = [], []
+    for email, hashed_password in zip(emails, hashes):
+        row = by_email[email]
+        values = {
+            "first_name": _clean(row.get("first_name")),
+            "last_name": _clean(row.get("last_name")),
+            "passwords": hashed_password,
+            "role_id": role_ids.get(_clean(row.get("role"))),
+        }
+        if email in existing:
+            values["password_changed_at"] = now if hashed_password else None
+            values["user_id"] = existing[email]
+            updates.append({f"b_{key}": value for key, value in values.items()})
+        else:
+            inserts.append({"email": _clean(row.get("email")), **values})
+
+    users = User.__table__
+    try:
+        if inserts:
+            db.session.execute(users.insert(), inserts)
+        if updates:
+            db.session.execute(
+                update(users)
+                .where(users.c.user_id == bindparam("b_user_id"))
+                .values(
+                    # like `User.update_user`, empty values keep the stored ones
+                    first_name=_keep(users.c.first_name),
+                    last_name=_keep(users.c.last_name),
+                    passwords=_keep(users.c.passwords),
+                    role_id=_keep(users.c.role_id),
+                    password_changed_at=_keep(users.c.password_changed_at),
+                    version_id=users.c.version_id + 1,
+                ),
+                updates,
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if updates:
+        # core statements bypass the session hooks, drop the cached users here
+        updated = [
+            (existing[email], stored_emails[email]) for email in emails if email in existing
+        ]
+        # versions read before this commit must not be published again
+        identity_cache.write_fences(
+            dict(
+                db.session.query(User.user_id, User.version_id).filter(
+                    User.user_id.in_([user_id for user_id, _ in updated])
+                )
+            )
+        )
+        db.session.commit()
+        identity_cache.invalidate_users(updated)
+        forget_user_versions([user_id for user_id, _ in updated])
+
+    return {"inserted": len(inserts), "updated": len(updates), "skipped": skipped}
@@ -2,12 +2,9 @@ import json
 import logging
 from re import L
 import uuid
-import pandas as pd
 from flask import current_app as app
 from io import BytesIO
 
-import pandas as pd
-
 from sqlalchemy import table, func
 
 from ecom.constants import (
@@ -20,7 +20,10 @@ class BaseConfig(object):
     TRUTHY_VALUES = TRUTHY_VALUES
 
     # To safely convert datetime objects while sending response back to frontend
+    # only used with JSON_BACKEND = "restx"
     RESTX_JSON = {"default": str}
+    # "auto" (orjson if installed, else stdlib), "orjson", "stdlib" or "restx"
+    JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
     # for flask restx abort
     ERROR_INCLUDE_MESSAGE = False
     SECRET_KEY = os.getenv("APP_VALIDATION_KEY") or os.urandom(15).hex()
@@ -52,6 +55,18 @@ class BaseConfig(object):
     SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # connection pool (ignored for sqlite)
+    SQLALCHEMY_POOL_SIZE = int(os.getenv("SQLALCHEMY_POOL_SIZE", 10))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", 10))
+    SQLALCHEMY_POOL_RECYCLE = int(os.getenv("SQLALCHEMY_POOL_RECYCLE", 1800))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.getenv("SQLALCHEMY_POOL_TIMEOUT", 10))
+    # liveness check on checkout: "always" (pool_pre_ping), "never", or "idle" to
+    # ping only connections idle longer than SQLALCHEMY_POOL_PING_IDLE_SECONDS
+    SQLALCHEMY_POOL_PRE_PING = os.getenv("SQLALCHEMY_POOL_PRE_PING", "idle")
+    SQLALCHEMY_POOL_PING_IDLE_SECONDS = int(
+        os.getenv("SQLALCHEMY_POOL_PING_IDLE_SECONDS", 30)
+    )
+
     # flask-caching variables
     CACHE_TYPE = os.getenv("CACHE_TYPE", "null")
     CACHE_REDIS_HOST = os.getenv("CACHE_HOST")
@@ -59,8 +74,29 @@ class BaseConfig(object):
     CACHE_REDIS_DB = os.getenv("CACHE_DB")
     CACHE_REDIS_PASSWORD = os.getenv("CACHE_SECRET")
     CACHE_DEFAULT_TIMEOUT = int(os.getenv("CACHE_TIMEOUT", "120"))
+    # keys removed per SCAN / UNLINK pipeline round trip by cache.clear
+    CACHE_CLEAR_BATCH_SIZE = int(os.getenv("CACHE_CLEAR_BATCH_SIZE", "500"))
+    # cache.clear bumps a generation counter that is part of every key (O(1))
+    CACHE_USE_GENERATIONS = (
+        os.getenv("CACHE_USE_GENERATIONS", "false") in TRUTHY_VALUES
+    )
+    # seconds a worker keeps the current generation before reading it again
+    CACHE_GENERATION_LOCAL_TTL = int(os.getenv("CACHE_GENERATION_LOCAL_TTL", "2"))
+    # timeout of keys set without one while generations are used, old
+    # generations are never read again and would otherwise stay in redis
+    CACHE_GENERATION_MAX_TIMEOUT = int(
+        os.getenv("CACHE_GENERATION_MAX_TIMEOUT", "86400")
+    )
 
     DEFAULT_PASSWORD = os.getenv("DEFAULT_PASSWORD", "Dummy@1234567")
+    # rules of check_for_password / generate_password, see utils.password_policy
+    PASSWORD_POLICY = {
+        "min_length": int(os.getenv("PASSWORD_MIN_LENGTH", 12)),
+        "require_lower": True,
+        "require_upper": True,
+        "require_digit": True,
+        "require_special": True,
+    }
 
 
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
@@ -69,6 +105,15 @@ class BaseConfig(object):
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'true').lower() in TRUTHY_VALUES
     MAIL_USE_SSL = os.environ.get('MAIL_USE_SSL', 'false').lower() in TRUTHY_VALUES
+    # mails are queued to celery and sent in batches over a persistent connection
+    MAIL_ASYNC = os.environ.get('MAIL_ASYNC', 'true').lower() in TRUTHY_VALUES
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 50))
+    MAIL_BATCH_WINDOW_SECONDS = int(os.environ.get('MAIL_BATCH_WINDOW_SECONDS', 2))
+    MAIL_MAX_RETRIES = int(os.environ.get('MAIL_MAX_RETRIES', 5))
+    MAIL_RETRY_BACKOFF = int(os.environ.get('MAIL_RETRY_BACKOFF', 10))
+    # a claimed batch not sent within this goes back to the outbox
+    MAIL_PROCESSING_TIMEOUT = int(os.environ.get('MAIL_PROCESSING_TIMEOUT', 600))
+    MAIL_FLUSH_INTERVAL = int(os.environ.get('MAIL_FLUSH_INTERVAL', 60))
 
 
     # flask-praetorian variables
@@ -85,10 +130,70 @@ class BaseConfig(object):
 
     REFRESH_DATA_TOKEN = os.getenv("REFRESH_DATA_TOKEN", "")
 
+    # Stateless role checks in `roles_accepted`: trust role / active claims of the
+    # token while the user version in it matches the published one (no SQL)
+    JWT_STATELESS_ROLES = os.getenv("JWT_STATELESS_ROLES", "false") in TRUTHY_VALUES
+    # seconds a worker trusts its in-process copy of a user version
+    JWT_VERSION_LOCAL_TTL = int(os.getenv("JWT_VERSION_LOCAL_TTL", 5))
+    # seconds a user version is kept in redis
+    JWT_VERSION_CACHE_TIMEOUT = int(os.getenv("JWT_VERSION_CACHE_TIMEOUT", 86400))
+
+    # Read-through cache of User.identify / User.lookup (in-process LRU + redis)
+    IDENTITY_CACHE_ENABLED = (
+        os.getenv("IDENTITY_CACHE_ENABLED", "true") in TRUTHY_VALUES
+    )
+    IDENTITY_CACHE_LOCAL_MAXSIZE = int(os.getenv("IDENTITY_CACHE_LOCAL_MAXSIZE", 10000))
+    IDENTITY_CACHE_LOCAL_TTL = int(os.getenv("IDENTITY_CACHE_LOCAL_TTL", 30))
+    IDENTITY_CACHE_TIMEOUT = int(os.getenv("IDENTITY_CACHE_TIMEOUT", 300))
+
+    # Password hashing pool (processes per web worker, 0 workers hashes inline).
+    # Above MAX_PENDING running + queued operations requests are shed with 503.
+    PASSWORD_HASH_POOL_ENABLED = (
+        os.getenv("PASSWORD_HASH_POOL_ENABLED", "true") in TRUTHY_VALUES
+    )
+    PASSWORD_HASH_POOL_WORKERS = int(os.getenv("PASSWORD_HASH_POOL_WORKERS", 2))
+    PASSWORD_HASH_POOL_MAX_PENDING = int(
+        os.getenv("PASSWORD_HASH_POOL_MAX_PENDING", 16)
+    )
+    PASSWORD_HASH_POOL_TIMEOUT = float(os.getenv("PASSWORD_HASH_POOL_TIMEOUT", 10))
+
     BASIC_AUTH_USERNAME = os.getenv("ADMIN_USERNAME")
     BASIC_AUTH_PASSWORD = os.getenv("ADMIN_PASSWORD")
 
+    # process role, selects the optional flask extensions initialized by
+    # init_extensions: "web" (gunicorn), "celery" (celery_worker.py) or "cli"
+    APP_ROLE = os.getenv("APP_ROLE", "web")
+    ROLE_EXTENSIONS = {
+        "web": os.getenv(
+            "WEB_EXTENSIONS", "mail,admin,compress,socketio,cors,migrate,profiler"
+        ).split(","),
+        "celery": os.getenv("CELERY_EXTENSIONS", "mail").split(","),
+        "cli": os.getenv("CLI_EXTENSIONS", "mail,migrate").split(","),
+    }
+
     RUN_PROFILER = os.getenv("RUN_PROFILER", False) in TRUTHY_VALUES
+    # sampling profiler used when RUN_PROFILER is set
+    PROFILER_SAMPLE_RATE = int(os.getenv("PROFILER_SAMPLE_RATE", 100))
+    PROFILER_SLOW_THRESHOLD_MS = int(os.getenv("PROFILER_SLOW_THRESHOLD_MS", 1000))
+    PROFILER_SAMPLE_INTERVAL_MS = int(os.getenv("PROFILER_SAMPLE_INTERVAL_MS", 10))
+    PROFILER_MAX_FILES = int(os.getenv("PROFILER_MAX_FILES", 200))
+    PROFILER_FLUSH_INTERVAL = int(os.getenv("PROFILER_FLUSH_INTERVAL", 60))
+    # flask-profiler dashboard on /api/profiler, independent of RUN_PROFILER
+    FLASK_PROFILER_ENABLED = (
+        os.getenv("FLASK_PROFILER_ENABLED", "false") in TRUTHY_VALUES
+    )
+    FLASK_PROFILER_USERNAME = os.getenv("FLASK_PROFILER_USERNAME", "admin")
+    FLASK_PROFILER_PASSWORD = os.getenv("FLASK_PROFILER_PASSWORD", "")
+    # per endpoint latency / SQL / payload metrics exported on /api/metrics
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true") in TRUTHY_VALUES
+    # comma separated scraper addresses (empty allows any), and an optional
+    # bearer token the scraper must send
+    METRICS_ALLOWED_IPS = [
+        ip.strip()
+        for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+        if ip.strip()
+    ]
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
     # Authentication realted
     # It is also configured in constants.py file
@@ -97,12 +202,155 @@ class BaseConfig(object):
         "auth_app": int(os.environ.get("AUTH_CODE_EXPIRY_INTERVAL_AUTH_APP", 30)),
         "mail": int(os.environ.get("AUTH_CODE_EXPIRY_INTERVAL_MAIL", 120)),
     }
+    # failed verifications before an OTP is locked until it expires
+    OTP_MAX_ATTEMPTS = int(os.environ.get("OTP_MAX_ATTEMPTS", 5))
     SKIP_SEED_USERS_AUTH_CHECKS = (
         os.getenv("SKIP_SEED_USERS_AUTH_CHECKS", "false") in TRUTHY_VALUES
     )
 
     REDIS_URL = os.getenv("broker_url")
 
+    # reverse proxies in front of the app that append to X-Forwarded-For, the
+    # client address is taken that many hops from the right (0: no proxy)
+    PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", 0))
+
+    # sliding window limits of the auth endpoints ("<count>/<second|minute|hour|day>")
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true") in TRUTHY_VALUES
+    RATE_LIMITS = {
+        "login": {
+            "ip": os.getenv("RATE_LIMIT_LOGIN_IP", "60/minute"),
+            "username": os.getenv("RATE_LIMIT_LOGIN_USERNAME", "10/minute"),
+        },
+        "forgot_password": {
+            "ip": os.getenv("RATE_LIMIT_FORGOT_PASSWORD_IP", "20/minute"),
+            "username": os.getenv("RATE_LIMIT_FORGOT_PASSWORD_USERNAME", "5/hour"),
+        },
+        "reset_password": {
+            "ip": os.getenv("RATE_LIMIT_RESET_PASSWORD_IP", "20/minute"),
+        },
+    }
+    # max tokens a worker leases from redis at once for a key
+    RATE_LIMIT_LOCAL_LEASE = int(os.getenv("RATE_LIMIT_LOCAL_LEASE", 10))
+
+    # page size of keyset paginated listings
+    PAGINATION_DEFAULT_LIMIT = int(os.getenv("PAGINATION_DEFAULT_LIMIT", 50))
+    PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", 500))
+
+    # audit events are buffered per worker and written in bulk, see ecom.auth.audit
+    AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "true") in TRUTHY_VALUES
+    AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", 10000))
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 2))
+    # "oldest" or "newest", which events are dropped when the buffer is full
+    AUDIT_DROP_POLICY = os.getenv("AUDIT_DROP_POLICY", "oldest")
+
+    # expired rows of the otp table are purged by celery beat in PK chunks
+    OTP_PURGE_INTERVAL = int(os.getenv("OTP_PURGE_INTERVAL", 300))
+    OTP_PURGE_BATCH_SIZE = int(os.getenv("OTP_PURGE_BATCH_SIZE", 1000))
+    OTP_PURGE_THROTTLE_SECONDS = float(os.getenv("OTP_PURGE_THROTTLE_SECONDS", 0.1))
+
+    # per worker in-memory catalog index following the change feed, see ecom.catalog
+    CATALOG_INDEX_ENABLED = os.getenv("CATALOG_INDEX_ENABLED", "true") in TRUTHY_VALUES
+    # max seconds before a worker sees writes made by other workers
+    CATALOG_INDEX_REFRESH_SECONDS = float(os.getenv("CATALOG_INDEX_REFRESH_SECONDS", 1))
+    # change ids re-read on every refresh, covers transactions committing out of order
+    CATALOG_FEED_OVERLAP = int(os.getenv("CATALOG_FEED_OVERLAP", 1000))
+    # redis cached pages served while the index is being built
+    CATALOG_LISTING_CACHE_TIMEOUT = int(os.getenv("CATALOG_LISTING_CACHE_TIMEOUT", 300))
+    CATALOG_CHANGES_RETENTION_HOURS = int(os.getenv("CATALOG_CHANGES_RETENTION_HOURS", 24))
+    CATALOG_CHANGES_PURGE_INTERVAL = int(os.getenv("CATALOG_CHANGES_PURGE_INTERVAL", 3600))
+    CATALOG_CHANGES_PURGE_BATCH_SIZE = int(os.getenv("CATALOG_CHANGES_PURGE_BATCH_SIZE", 5000))
+    CATALOG_CHANGES_PURGE_THROTTLE_SECONDS = float(
+        os.getenv("CATALOG_CHANGES_PURGE_THROTTLE_SECONDS", 0.1)
+    )
+
+    # memory mapped product search index, see ecom.catalog.search
+    SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true") in TRUTHY_VALUES
+    SEARCH_INDEX_PATH = os.getenv(
+        "SEARCH_INDEX_PATH", os.path.join(BASE_DIR, "search_index.bin")
+    )
+    SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", 1))
+    # changed products followed in memory before a worker rebuilds the file
+    SEARCH_DELTA_MAX_DOCS = int(os.getenv("SEARCH_DELTA_MAX_DOCS", 20000))
+    SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 100))
+    # words the last word of a search as you type expands to
+    SEARCH_PREFIX_EXPANSIONS = int(os.getenv("SEARCH_PREFIX_EXPANSIONS", 10))
+    # postings read per query when every word is very common, bounds the p99
+    SEARCH_MAX_SCAN = int(os.getenv("SEARCH_MAX_SCAN", 5000))
+
+    # carts are redis hashes, user carts are persisted behind, see ecom.cart
+    CART_ANONYMOUS_TTL = int(os.getenv("CART_ANONYMOUS_TTL", 7 * 24 * 3600))
+    CART_USER_TTL = int(os.getenv("CART_USER_TTL", 30 * 24 * 3600))
+    CART_MAX_QUANTITY = int(os.getenv("CART_MAX_QUANTITY", 99))
+    CART_MAX_LINES = int(os.getenv("CART_MAX_LINES", 100))
+    # a changed user cart is written to MySQL once untouched for this long
+    CART_IDLE_SECONDS = int(os.getenv("CART_IDLE_SECONDS", 900))
+    CART_PERSIST_INTERVAL = int(os.getenv("CART_PERSIST_INTERVAL", 60))
+    CART_PERSIST_BATCH_SIZE = int(os.getenv("CART_PERSIST_BATCH_SIZE", 500))
+
+    # stock reservations are counted in redis, see ecom.inventory.reservations
+    STOCK_HOLD_SECONDS = int(os.getenv("STOCK_HOLD_SECONDS", 900))
+    STOCK_EXPIRE_INTERVAL = int(os.getenv("STOCK_EXPIRE_INTERVAL", 30))
+    # held rows this long past expiry are expired even if redis lost the hold
+    STOCK_HOLD_GRACE_SECONDS = int(os.getenv("STOCK_HOLD_GRACE_SECONDS", 600))
+    # committed holds leave a marker this long, retried commits recognise it
+    STOCK_COMMITTED_MARKER_SECONDS = int(os.getenv("STOCK_COMMITTED_MARKER_SECONDS", 86400))
+    STOCK_RECONCILE_INTERVAL = int(os.getenv("STOCK_RECONCILE_INTERVAL", 60))
+    STOCK_BATCH_SIZE = int(os.getenv("STOCK_BATCH_SIZE", 1000))
+
+    # responses kept for retries with the same Idempotency-Key, see ecom.idempotency
+    IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+    # max seconds a request holds its key, retries meanwhile get a 409
+    IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 30))
+    # import path of the capture function, see ecom.orders.payments
+    PAYMENT_BACKEND = os.getenv("PAYMENT_BACKEND", "ecom.orders.payments.offline_capture")
+    # import path of the refund function, see ecom.orders.payments
+    PAYMENT_REFUND_BACKEND = os.getenv(
+        "PAYMENT_REFUND_BACKEND", "ecom.orders.payments.offline_refund"
+    )
+    # payment tokens wait for their capture task encrypted in redis, the key
+    # must be the same for the web and celery processes
+    PAYMENT_TOKEN_KEY = os.getenv("PAYMENT_TOKEN_KEY") or SECRET_KEY
+    PAYMENT_TOKEN_TTL = int(os.getenv("PAYMENT_TOKEN_TTL", 3600))
+    # orders left this long in a step of their fulfillment are failed / refunded
+    ORDER_STUCK_SECONDS = int(os.getenv("ORDER_STUCK_SECONDS", 900))
+    ORDER_SWEEP_INTERVAL = int(os.getenv("ORDER_SWEEP_INTERVAL", 300))
+    ORDER_SWEEP_BATCH_SIZE = int(os.getenv("ORDER_SWEEP_BATCH_SIZE", 500))
+
+    # extra celery settings, broker / backend come from the environment
+    CELERY = {
+        "beat_schedule": {
+            "purge-expired-otps": {
+                "task": "ecom.auth.sweeper.purge_expired_otps",
+                "schedule": OTP_PURGE_INTERVAL,
+            },
+            "purge-catalog-changes": {
+                "task": "ecom.catalog.feed.purge_catalog_changes",
+                "schedule": CATALOG_CHANGES_PURGE_INTERVAL,
+            },
+            "persist-idle-carts": {
+                "task": "ecom.cart.persist.persist_idle_carts",
+                "schedule": CART_PERSIST_INTERVAL,
+            },
+            "expire-stock-holds": {
+                "task": "ecom.inventory.reservations.expire_holds",
+                "schedule": STOCK_EXPIRE_INTERVAL,
+            },
+            "reconcile-stock": {
+                "task": "ecom.inventory.reservations.reconcile_stock",
+                "schedule": STOCK_RECONCILE_INTERVAL,
+            },
+            "sweep-stuck-orders": {
+                "task": "ecom.orders.tasks.sweep_stuck_orders",
+                "schedule": ORDER_SWEEP_INTERVAL,
+            },
+            "flush-mail-outbox": {
+                "task": "ecom.mailer.flush_mail_outbox",
+                "schedule": MAIL_FLUSH_INTERVAL,
+            },
+        },
+    }
+
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
@@ -113,13 +361,24 @@ class DevelopmentConfig(BaseConfig):
     #     "SQLALCHEMY_DATABASE_URI"
     # ) or "sqlite:///" + os.path.join(BASE_DIR, "db.sqlite")
     SQLALCHEMY_ECHO = False  # print logs from sql-alchemy for dev and testing
+    SQLALCHEMY_POOL_SIZE = int(os.getenv("SQLALCHEMY_POOL_SIZE", 2))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", 3))
 
 
 class TestingConfig(BaseConfig):
     TESTING = True
+    # tasks run in-process on an in-memory broker
+    CELERY = {
+        "broker_url": "memory://",
+        "result_backend": "cache+memory://",
+        "task_always_eager": True,
+        "task_eager_propagates": True,
+    }
     SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(BASE_DIR, "tests/db.sqlite")
     # SQLALCHEMY_ECHO = True  # print logs from sql-alchemy for dev and testing
 
 
 class ProductionConfig(BaseConfig):
     SKIP_SEED_USERS_AUTH_CHECKS = False
+    SQLALCHEMY_POOL_SIZE = int(os.getenv("SQLALCHEMY_POOL_SIZE", 20))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", 20))
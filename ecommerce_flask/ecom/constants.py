@@ -25,4 +25,5 @@ USERS_SEED_DATA = [
 ]
 
 CACHE_CLEAR_SAFE_SUFFIX = "_clear_safe"
+CACHE_GENERATION_KEY = "cache_generation" + CACHE_CLEAR_SAFE_SUFFIX
 CACHE_INDEFINETLY = 0
@@ -1,48 +1,206 @@
 import logging
 import os
+import time
 from flask import current_app as app
 from flask_sqlalchemy import SQLAlchemy as _BaseSQLAlchemy
+from sqlalchemy import event
+from sqlalchemy import exc as sqlalchemy_exc
+from sqlalchemy.pool import QueuePool
+import threading
 from flask_marshmallow import Marshmallow
 from flask_caching import Cache
-from flask_cors import CORS
 from flask_praetorian import Praetorian
-from flask_migrate import Migrate
-from flask_compress import Compress
-from flask_socketio import SocketIO
-from flask_profiler import Profiler
-import socketio
 from celery import Celery
 
-from flask_admin import Admin
-from flask_basicauth import BasicAuth
 from flask_mail import Mail
 
-from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX, CACHE_INDEFINETLY
+from ecom.constants import (
+    CACHE_CLEAR_SAFE_SUFFIX,
+    CACHE_GENERATION_KEY,
+    CACHE_INDEFINETLY,
+)
+from ecom.metrics import record_cache_lookup
+from ecom.utils.local_cache import LocalTTLCache
 import os
-from werkzeug.middleware.profiler import ProfilerMiddleware
+from ecom.profiling import SamplingProfilerMiddleware
 
 # from flask_limiter import Limiter
 # from flask_limiter.util import get_remote_address
 
 
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording checkout wait time, overflow use and timeouts."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {
+            "checkouts": 0,
+            "checkout_wait_seconds_total": 0.0,
+            "checkout_wait_seconds_max": 0.0,
+            "overflow_checkouts": 0,
+            "checkout_timeouts": 0,
+            "idle_pings": 0,
+            "stale_connections": 0,
+        }
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except sqlalchemy_exc.TimeoutError:
+            self.stats["checkout_timeouts"] += 1
+            raise
+        waited = time.perf_counter() - started
+        self.stats["checkouts"] += 1
+        self.stats["checkout_wait_seconds_total"] += waited
+        if waited > self.stats["checkout_wait_seconds_max"]:
+            self.stats["checkout_wait_seconds_max"] = waited
+        if self.overflow() > 0:
+            self.stats["overflow_checkouts"] += 1
+        return record
+
+
+def _ping_idle_connections(engine, idle_seconds):
+    """Pre ping only connections that sat in the pool longer than `idle_seconds`.
+
+    Connections checked out again right away skip the extra round trip that
+    `pool_pre_ping` pays on every checkout.
+    """
+
+    @event.listens_for(engine, "checkin")
+    def _checked_in(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def _checked_out(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get("checked_in_at")
+        if checked_in_at is None or time.monotonic() - checked_in_at < idle_seconds:
+            return
+        stats = getattr(engine.pool, "stats", {})
+        stats["idle_pings"] = stats.get("idle_pings", 0) + 1
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception:
+            stats["stale_connections"] = stats.get("stale_connections", 0) + 1
+            # the pool drops this connection and retries with a fresh one
+            raise sqlalchemy_exc.DisconnectionError()
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
 class SQLAlchemy(_BaseSQLAlchemy):
-    def apply_pool_defaults(self, app, options):
-        super(SQLAlchemy, self).apply_pool_defaults(app, options)
-        options["pool_pre_ping"] = True
-        return options
+    def _apply_driver_defaults(self, options, app):
+        super(SQLAlchemy, self)._apply_driver_defaults(options, app)
+        if options["url"].get_backend_name() == "sqlite":
+            return
+        options.setdefault("poolclass", InstrumentedQueuePool)
+        options.setdefault("pool_size", app.config["SQLALCHEMY_POOL_SIZE"])
+        options.setdefault("max_overflow", app.config["SQLALCHEMY_MAX_OVERFLOW"])
+        options.setdefault("pool_recycle", app.config["SQLALCHEMY_POOL_RECYCLE"])
+        options.setdefault("pool_timeout", app.config["SQLALCHEMY_POOL_TIMEOUT"])
+        options.setdefault(
+            "pool_pre_ping", app.config["SQLALCHEMY_POOL_PRE_PING"] == "always"
+        )
+
+    def _make_engine(self, bind_key, options, app):
+        engine = super(SQLAlchemy, self)._make_engine(bind_key, options, app)
+        if (
+            app.config["SQLALCHEMY_POOL_PRE_PING"] == "idle"
+            and not options.get("pool_pre_ping")
+            and engine.url.get_backend_name() != "sqlite"
+        ):
+            _ping_idle_connections(
+                engine, app.config["SQLALCHEMY_POOL_PING_IDLE_SECONDS"]
+            )
+        return engine
+
+    def pool_stats(self) -> dict:
+        """Returns checkout / overflow counters and usage of the engine pool."""
+        pool = self.engine.pool
+        if not isinstance(pool, InstrumentedQueuePool):
+            return {}
+        return {
+            **pool.stats,
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
 
 
 db = SQLAlchemy()
 mm = Marshmallow()
 cache = Cache()
 guard = Praetorian()
-compress = Compress()
-socketio = SocketIO()
-profiler = Profiler()
 mail = Mail()
 
-admin = Admin(url="/api/admin")
-basic_auth = BasicAuth()
+
+def _make_admin():
+    from flask_admin import Admin
+
+    return Admin(url="/api/admin")
+
+
+def _make_basic_auth():
+    from flask_basicauth import BasicAuth
+
+    return BasicAuth()
+
+
+def _make_compress():
+    from flask_compress import Compress
+
+    return Compress()
+
+
+def _make_socketio():
+    from flask_socketio import SocketIO
+
+    return SocketIO()
+
+
+def _make_profiler():
+    from flask_profiler import Profiler
+
+    return Profiler()
+
+
+# optional extensions, imported and created on first use so processes that
+# don't enable them (see ROLE_EXTENSIONS) never pay their import time
+_LAZY_EXTENSIONS = {
+    "admin": _make_admin,
+    "basic_auth": _make_basic_auth,
+    "compress": _make_compress,
+    "socketio": _make_socketio,
+    "profiler": _make_profiler,
+}
+_lazy_lock = threading.Lock()
+
+
+def get_extension(name):
+    """Returns the optional extension `name`, creating it on first access."""
+    extension = globals().get(name)
+    if extension is None:
+        with _lazy_lock:
+            extension = globals().get(name)
+            if extension is None:
+                extension = globals()[name] = _LAZY_EXTENSIONS[name]()
+    return extension
+
+
+def __getattr__(name):
+    # PEP 562, keeps `from ecom.extensions import admin` working
+    if name in _LAZY_EXTENSIONS:
+        return get_extension(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def enabled_extensions(app) -> set:
+    """Optional extensions of the process role `APP_ROLE` of the app."""
+    return set(app.config["ROLE_EXTENSIONS"][app.config["APP_ROLE"]])
 
 
 CACHE_SECRET = os.getenv("CACHE_SECRET", "")
@@ -71,6 +229,8 @@ celery = make_celery()
 def init_celery(app):
     print(celery)
     celery.conf.update(app.config)
+    # celery settings (lowercase names) of the environment, e.g. the in-memory broker
+    celery.conf.update(app.config["CELERY"])
 
     class ContextTask(celery.Task):
         def __call__(self, *args, **kwargs):
@@ -81,6 +241,8 @@ def init_celery(app):
 
 
 def init_extensions(app):
+    enabled = enabled_extensions(app)
+
     # sqlalchecmy
     # with app.app_context():
     db.init_app(app)
@@ -88,16 +250,20 @@ def init_extensions(app):
     # marshmallow
     mm.init_app(app)
 
-    mail.init_app(app)
+    if "mail" in enabled:
+        mail.init_app(app)
 
     # flask caching
     cache.init_app(app)
 
     # Flask Admin
-    admin.init_app(app)
-    basic_auth.init_app(app)
-    compress.init_app(app)
-    socketio.init_app(app)
+    if "admin" in enabled:
+        get_extension("admin").init_app(app)
+        get_extension("basic_auth").init_app(app)
+    if "compress" in enabled:
+        get_extension("compress").init_app(app)
+    if "socketio" in enabled:
+        get_extension("socketio").init_app(app)
 
     # Currently Stopping Limit
     # limiter.init_app(app)
@@ -105,79 +271,202 @@ def init_extensions(app):
     # Monkey Patching Cache function to handle exception at central place
     cache_get = cache.get
     cache_set = cache.set
+    cache_delete = cache.delete
+    cache_delete_many = cache.delete_many
     cache_clear = cache.clear
     _cache_cache = cache.cache
+    redis_client = getattr(_cache_cache, "_write_client", None)
+    use_generations = (
+        app.config["CACHE_USE_GENERATIONS"] is True and redis_client is not None
+    )
+    # null / simple caches have no key_prefix, generations need redis anyway
+    generation_key = (
+        _cache_cache.key_prefix + CACHE_GENERATION_KEY
+        if redis_client is not None
+        else None
+    )
+    _generation = LocalTTLCache(maxsize=1, ttl=app.config["CACHE_GENERATION_LOCAL_TTL"])
+
+    def current_generation():
+        generation = _generation.get(generation_key)
+        if generation is None:
+            generation = int(redis_client.get(generation_key) or 0)
+            _generation.set(generation_key, generation)
+        return generation
+
+    def namespaced(key):
+        # keys with the safe suffix survive generation bumps
+        if not use_generations or CACHE_CLEAR_SAFE_SUFFIX in key:
+            return key
+        return f"g{current_generation()}:{key}"
+
+    def expiring(key, timeout):
+        # keys of a generation nobody reads anymore must not live forever
+        if use_generations and CACHE_CLEAR_SAFE_SUFFIX not in key and not timeout:
+            return app.config["CACHE_GENERATION_MAX_TIMEOUT"]
+        return timeout
 
     def get_from_cache(key):
         try:
-            return cache_get(key)
+            value = cache_get(namespaced(key))
+            record_cache_lookup(value is not None)
+            return value
         except Exception:
             logging.error("Not able to get value from cache - %s", key)
             return None
 
     def set_to_cache(key, value, timeout=CACHE_INDEFINETLY):
         try:
-            cache_set(key, value, timeout)
+            cache_set(namespaced(key), value, expiring(key, timeout))
             logging.info("Cache set successfully - %s", key)
         except Exception:
             logging.error("Not able to set value in cache - %s", key)
 
-    def clear_cache(**kwargs):
+    def delete_from_cache(key):
         try:
-            k_prefix = _cache_cache.key_prefix
-            keys = _cache_cache._write_client.keys(k_prefix + "*")
-            keys = [k.decode("utf8") for k in keys]
-            keys = [
-                k.replace(k_prefix, "")
-                for k in keys
-                if CACHE_CLEAR_SAFE_SUFFIX not in k
-            ]
-            cache.delete_many(*keys, **kwargs)
-            logging.info("Cache Cleared.")
+            return cache_delete(namespaced(key))
+        except Exception:
+            logging.error("Not able to delete value from cache - %s", key)
+            return False
+
+    def delete_many_from_cache(*keys):
+        try:
+            return cache_delete_many(*[namespaced(key) for key in keys])
+        except Exception:
+            logging.error("Not able to delete values from cache - %s", keys)
+            return []
+
+    def clear_cache(sweep=False, **kwargs):
+        """Invalidate every key without the safe suffix.
+
+        With CACHE_USE_GENERATIONS this only bumps the generation counter, old
+        generations expire within CACHE_GENERATION_MAX_TIMEOUT or are removed
+        right away when `sweep` is set. Otherwise keys are
+        removed with SCAN + pipelined UNLINK so redis is never blocked.
+        """
+        try:
+            if redis_client is None:
+                cache_clear()
+            elif use_generations:
+                generation = redis_client.incr(generation_key)
+                _generation.set(generation_key, generation)
+                logging.info("Cache generation bumped to %s", generation)
+                if sweep:
+                    sweep_cache_generations(
+                        redis_client, _cache_cache.key_prefix, generation
+                    )
+            else:
+                deleted = scan_unlink(
+                    redis_client,
+                    _cache_cache.key_prefix + "*",
+                    app.config["CACHE_CLEAR_BATCH_SIZE"],
+                )
+                logging.info("Cache Cleared. %s keys removed", deleted)
         except Exception as exc:
             logging.error("Not able to clear cache. Exception : %s" % (exc))
 
     cache.get = get_from_cache
     cache.set = set_to_cache
+    cache.delete = delete_from_cache
+    cache.delete_many = delete_many_from_cache
     cache.clear = clear_cache
 
-    # flask-profiler werkzeug
-    ## uncomment for code profiling
-    if app.config["RUN_PROFILER"] is True:
+    # werkzeug sampling profiler
+    if app.config["RUN_PROFILER"] is True and "profiler" in enabled:
         path_to_write = os.path.join("ecom", "profile")
-        app.wsgi_app = ProfilerMiddleware(
-            app.wsgi_app, restrictions=[0], profile_dir="ecom/profile"
+        # profiles 1-in-N requests and stack samples slow ones,
+        # PROFILER_SAMPLE_RATE=1 profiles every request like ProfilerMiddleware did
+        app.wsgi_app = SamplingProfilerMiddleware(
+            app.wsgi_app,
+            profile_dir=path_to_write,
+            sample_rate=app.config["PROFILER_SAMPLE_RATE"],
+            slow_threshold=app.config["PROFILER_SLOW_THRESHOLD_MS"] / 1000,
+            sample_interval=app.config["PROFILER_SAMPLE_INTERVAL_MS"] / 1000,
+            max_files=app.config["PROFILER_MAX_FILES"],
+            flush_interval=app.config["PROFILER_FLUSH_INTERVAL"],
         )
-        if app.config["APP_DB_USE_SSL"]:
-            connection_uri = (
-                app.config["SQLALCHEMY_DATABASE_URI"] + "?" + "ssl_verify_cert=true"
-            )
+
+    # flask-profiler stores every request, only on when asked for explicitly
+    if app.config["FLASK_PROFILER_ENABLED"] and "profiler" in enabled:
+        if not app.config["FLASK_PROFILER_PASSWORD"]:
+            logging.error("Not able to start flask-profiler. Exception : FLASK_PROFILER_PASSWORD is not set")
         else:
-            connection_uri = app.config["SQLALCHEMY_DATABASE_URI"]
-
-        # You need to declare necessary configuration to initialize
-        # flask-profiler as follows:
-        profiler.init_app(app)
-        app.config["flask_profiler"] = {
-            "enabled": app.config["RUN_PROFILER"],
-            "storage": {
-                "engine": "sqlite"
-                # "engine": "sqlalchemy",
-                # "db_url": connection_uri
-                # +"?"+str(ssl_connection)
-                # +str(ssl_connection)
-                # +"?ssl_ca=C:\\projects\\sofac\\azure database\\BaltimoreCyberTrustRoot.crt.pem"
-            },
-            "basicAuth": {"enabled": True, "username": "admin", "password": "password"},
-            "ignore": ["^/static/.*"],
-            "endpointRoot": "api/profiler",
-        }
+            # flask-profiler reads its configuration in init_app
+            app.config["flask_profiler"] = {
+                "enabled": True,
+                "storage": {"engine": "sqlite"},
+                "basicAuth": {
+                    "enabled": True,
+                    "username": app.config["FLASK_PROFILER_USERNAME"],
+                    "password": app.config["FLASK_PROFILER_PASSWORD"],
+                },
+                "ignore": ["^/static/.*"],
+                "endpointRoot": "api/profiler",
+            }
+            get_extension("profiler").init_app(app)
 
     # migration
-    Migrate(app, db)
-
-    CORS(app)
+    if "migrate" in enabled:
+        from flask_migrate import Migrate
+
+        Migrate(app, db)
+
+    if "cors" in enabled:
+        from flask_cors import CORS
+
+        CORS(app)
+
+
+def scan_unlink(client, pattern, batch_size=500, keep=None):
+    """Remove keys matching `pattern` without blocking redis.
+
+    Keys are walked with cursor based SCAN and removed with UNLINK (memory is
+    freed in a background thread) sent through a pipeline every `batch_size`.
+    Keys containing `CACHE_CLEAR_SAFE_SUFFIX` are never removed.
+
+    Args:
+        client (redis.Redis): redis client
+        pattern (str): SCAN match pattern
+        batch_size (int, optional): SCAN count and keys per pipeline. Defaults to 500.
+        keep (callable, optional): extra predicate on the decoded key to keep it.
+
+    Returns:
+        int: number of removed keys
+    """
+    deleted = 0
+    queued = 0
+    pipe = client.pipeline(transaction=False)
+    for key in client.scan_iter(match=pattern, count=batch_size):
+        decoded = key.decode("utf8", "replace")
+        if CACHE_CLEAR_SAFE_SUFFIX in decoded or (keep and keep(decoded)):
+            continue
+        pipe.unlink(key)
+        queued += 1
+        if queued >= batch_size:
+            deleted += sum(pipe.execute())
+            queued = 0
+    if queued:
+        deleted += sum(pipe.execute())
+    return deleted
+
+
+def sweep_cache_generations(client, key_prefix, generation, batch_size=500):
+    """Remove the keys of every cache generation older than `generation`."""
+    current = f"{key_prefix}g{generation}:"
+    deleted = scan_unlink(
+        client,
+        key_prefix + "g*:*",
+        batch_size,
+        keep=lambda key: key.startswith(current),
+    )
+    logging.info("Swept %s keys of old cache generations", deleted)
+    return deleted
 
 
 def get_redis_cache():
     return cache
+
+
+def get_redis_client():
+    """Returns the raw redis client behind `cache` or None if cache is not redis backed."""
+    return getattr(cache.cache, "_write_client", None)
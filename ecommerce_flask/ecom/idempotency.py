@@ -0,0 +1,138 @@
+"""Idempotency keys for the endpoints creating things.
+
+Clients send an `Idempotency-Key` header; the first response for a key is
+kept in redis for IDEMPOTENCY_TTL and replayed for retries of the same
+request without running the view again, so retries never touch the
+database. While the first request runs, the key holds a pending marker and
+concurrent retries get a 409. 5xx responses are not kept, the request can be
+retried. Reusing a key for a different body is refused with a 422.
+
+Without redis the view simply runs, views must still be safe to retry (e.g. a
+unique constraint on the key).
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import re
+
+import flask_praetorian
+from flask import current_app as app
+from flask import request
+from flask_restx import abort
+from redis.exceptions import RedisError
+from werkzeug.exceptions import HTTPException
+
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import get_redis_client
+from ecom.utils import Response
+from ecom.utils.json_encoder import default
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+_KEY_RE = re.compile(r"[\w.:-]{1,64}")
+_PENDING = "pending"
+
+
+def idempotency_key():
+    """The Idempotency-Key of the request, None when missing or malformed."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    return key if key and _KEY_RE.fullmatch(key) else None
+
+
+def _fingerprint() -> str:
+    return hashlib.sha256(request.get_data()).hexdigest()
+
+
+def _save(client, redis_key, fingerprint, status, body):
+    try:
+        client.set(
+            redis_key,
+            json.dumps(
+                {"fingerprint": fingerprint, "status": status, "body": body},
+                default=default,
+            ),
+            ex=app.config["IDEMPOTENCY_TTL"],
+        )
+    except RedisError as exc:
+        logging.error("Not able to save idempotent response. Exception : %s" % (exc))
+
+
+def _replay(entry):
+    if entry["status"] >= 400:
+        abort(entry["status"], None, **entry["body"])
+    return entry["body"], entry["status"], {REPLAYED_HEADER: "true"}
+
+
+def idempotent(scope: str):
+    """Require an Idempotency-Key and replay the stored response of retries.
+
+    Keys are per user, the view must be behind `auth_required`.
+
+    Args:
+        scope (str): part of the redis keys, one per endpoint
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            key = idempotency_key()
+            if key is None:
+                return Response.failure(
+                    400, payload=f"{IDEMPOTENCY_HEADER} header of up to 64 characters is required"
+                )
+            client = get_redis_client()
+            if client is None:
+                return f(*args, **kwargs)
+
+            redis_key = (
+                f"idempotency:{scope}:{flask_praetorian.current_user_id()}:{key}"
+                f"{CACHE_CLEAR_SAFE_SUFFIX}"
+            )
+            fingerprint = _fingerprint()
+            try:
+                claimed = client.set(
+                    redis_key,
+                    json.dumps({"fingerprint": fingerprint, "status": _PENDING}),
+                    nx=True,
+                    ex=app.config["IDEMPOTENCY_LOCK_SECONDS"],
+                )
+                entry = None if claimed else client.get(redis_key)
+            except RedisError as exc:
+                logging.error("Not able to check idempotency key. Exception : %s" % (exc))
+                return f(*args, **kwargs)
+            if not claimed:
+                if entry is None:
+                    # expired in between, the next retry claims it
+                    return Response.failure(409, "Request with this key in progress, retry")
+                entry = json.loads(entry)
+                if entry["fingerprint"] != fingerprint:
+                    return Response.failure(
+                        422, f"{IDEMPOTENCY_HEADER} already used for another request"
+                    )
+                if entry["status"] == _PENDING:
+                    return Response.failure(409, "Request with this key in progress, retry")
+                return _replay(entry)
+
+            try:
+                result = f(*args, **kwargs)
+            except HTTPException as exc:
+                if exc.code < 500:
+                    _save(client, redis_key, fingerprint, exc.code, getattr(exc, "data", {}))
+                else:
+                    client.delete(redis_key)
+                raise
+            except Exception:
+                client.delete(redis_key)
+                raise
+            body, status = result[:2] if isinstance(result, tuple) else (result, 200)
+            if status >= 500:
+                client.delete(redis_key)
+            else:
+                _save(client, redis_key, fingerprint, status, body)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    INTEGER,
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    text,
+)
+
+from ecom.extensions import db
+
+
+class Stock(db.Model):
+    """Stock of a product. Requests never lock this row, reservations are
+    counted in redis and folded in by ecom.inventory.reservations."""
+
+    __tablename__ = "stock"
+
+    product_id = Column(
+        INTEGER,
+        ForeignKey("product.product_id", name="stock_ibfk_1", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    # units not sold yet, committed reservations are taken off by reconciliation
+    on_hand = Column(INTEGER, nullable=False, default=0, server_default=text("0"))
+    # units in active holds at the last reconciliation, informational
+    reserved = Column(INTEGER, nullable=False, default=0, server_default=text("0"))
+    updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
+
+
+class StockReservation(db.Model):
+    """One product line of a reservation, insert only on the request path."""
+
+    __tablename__ = "stock_reservations"
+
+    STATUS_HELD = "held"
+    STATUS_COMMITTED = "committed"
+    STATUS_RELEASED = "released"
+    STATUS_EXPIRED = "expired"
+
+    # sqlite only autoincrements INTEGER primary keys
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    reservation_id = Column(String(32), nullable=False)
+    product_id = Column(
+        INTEGER,
+        ForeignKey("product.product_id", name="stock_reservations_ibfk_1"),
+        nullable=False,
+    )
+    quantity = Column(INTEGER, nullable=False)
+    status = Column(String(20), nullable=False, default=STATUS_HELD)
+    # cart key / order the units are held for
+    owner = Column(String(64), nullable=True)
+    # 1 once a committed line is taken off `stock.on_hand`
+    applied = Column(INTEGER, nullable=False, default=0, server_default=text("0"))
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "reservation_id", "product_id", name="uq_stock_reservations_reservation_id_product_id"
+        ),
+        # sweep of holds left behind by a lost redis, see expire_holds
+        Index("ix_stock_reservations_status_expires_at", "status", "expires_at"),
+        # committed lines not yet applied, see reconcile_stock
+        Index("ix_stock_reservations_status_applied", "status", "applied"),
+    )
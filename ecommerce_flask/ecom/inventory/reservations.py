@@ -0,0 +1,650 @@
+"""Stock reservations counted in redis, folded into MySQL in the background.
+
+A `SELECT ... FOR UPDATE` on the stock row serializes every buyer of a hot
+product. Here the stock row is never touched on the request path:
+
+- redis keeps per product counters `available` / `held` in a hash, a
+  reservation is one Lua script checking and moving units for all its
+  products at once, all or nothing, so buyers of the same product only
+  queue for a few microseconds inside redis;
+- the reservation lines are inserted into `stock_reservations` (new rows, no
+  shared lock) and held until `commit_reservation` / `release_reservation`
+  or until they expire, released by the `expire-stock-holds` beat task;
+- the `reconcile-stock` beat task takes committed lines off `stock.on_hand`
+  with one update per product and chunk, and copies the `held` counters.
+- committed lines of a cancelled order go back on sale with
+  `return_reservation`.
+
+A product missing from redis (first use, lost redis) is loaded back as
+`on_hand - held lines - committed lines not applied yet`.
+"""
+
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app as app
+from sqlalchemy import and_, case, func, or_, select, update
+
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import celery, db, get_redis_client
+from ecom.inventory.models import Stock, StockReservation
+
+STOCK_KEY_PREFIX = "stock:"
+HOLD_KEY_PREFIX = "stock_hold:"
+COMMITTED_KEY_PREFIX = "stock_committed:"
+STOCK_HOLDS_KEY = "stock_holds" + CACHE_CLEAR_SAFE_SUFFIX
+STOCK_DIRTY_KEY = "stock_dirty" + CACHE_CLEAR_SAFE_SUFFIX
+STOCK_EXPIRE_LOCK_KEY = "stock_expire_lock" + CACHE_CLEAR_SAFE_SUFFIX
+STOCK_RECONCILE_LOCK_KEY = "stock_reconcile_lock" + CACHE_CLEAR_SAFE_SUFFIX
+
+RELEASE = "release"
+COMMIT = "commit"
+# answers of FINISH_SCRIPT besides 0 (no hold)
+FINISHED = 1
+ALREADY_COMMITTED = 2
+
+# KEYS[1] holds by expiry, KEYS[2] hold, KEYS[3] dirty products, KEYS[3 + i] stock of product i
+# ARGV[1] reservation id, ARGV[2] expires at, ARGV[2 + i] product i, ARGV[2 + n + i] quantity i
+# returns {1, 0} held, {0, 0} already held, {-1, i} product i not loaded, {-2, i} product i short
+RESERVE_SCRIPT = """
+local n = #KEYS - 3
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return {0, 0}
+end
+for i = 1, n do
+    local available = redis.call('HGET', KEYS[3 + i], 'available')
+    if not available then
+        return {-1, i}
+    end
+    if tonumber(available) < tonumber(ARGV[2 + n + i]) then
+        return {-2, i}
+    end
+end
+for i = 1, n do
+    local quantity = tonumber(ARGV[2 + n + i])
+    redis.call('HINCRBY', KEYS[3 + i], 'available', -quantity)
+    redis.call('HINCRBY', KEYS[3 + i], 'held', quantity)
+    redis.call('HSET', KEYS[2], ARGV[2 + i], quantity)
+    redis.call('SADD', KEYS[3], ARGV[2 + i])
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+return {1, 0}
+"""
+
+# KEYS[1] holds by expiry, KEYS[2] hold, KEYS[3] dirty products, KEYS[4] commit marker
+# ARGV[1] reservation id, ARGV[2] "release" or "commit", ARGV[3] / ARGV[4]
+# prefix / suffix of the stock keys, built here as the products are in the hold,
+# ARGV[5] lifetime of the commit marker
+# returns 1 finished, 2 committed before (the marker), 0 no hold
+FINISH_SCRIPT = """
+local hold = redis.call('HGETALL', KEYS[2])
+redis.call('ZREM', KEYS[1], ARGV[1])
+if #hold == 0 then
+    if redis.call('EXISTS', KEYS[4]) == 1 then
+        return 2
+    end
+    return 0
+end
+for i = 1, #hold, 2 do
+    local key = ARGV[3] .. hold[i] .. ARGV[4]
+    -- a lost stock is loaded back from the rows, updated by the caller
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HINCRBY', key, 'held', -tonumber(hold[i + 1]))
+        if ARGV[2] == 'release' then
+            redis.call('HINCRBY', key, 'available', hold[i + 1])
+        end
+        redis.call('SADD', KEYS[3], hold[i])
+    end
+end
+redis.call('DEL', KEYS[2])
+if ARGV[2] == 'commit' then
+    -- a retry after a failed status update still sees the hold was sold
+    redis.call('SET', KEYS[4], 1, 'EX', ARGV[5])
+end
+return 1
+"""
+
+# KEYS[1] stock; ARGV[1] available, ARGV[2] held
+LOAD_STOCK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'available', ARGV[1], 'held', ARGV[2])
+return 1
+"""
+
+# KEYS[1] stock; ARGV[1] units added / removed
+ADJUST_STOCK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'available', ARGV[1])
+return 1
+"""
+
+_scripts = {}
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(product_id)
+        self.product_id = product_id
+
+    def __str__(self):
+        return f"Not enough stock of product {self.product_id}"
+
+
+class InventoryUnavailable(Exception):
+    def __str__(self):
+        return "Stock reservations need the redis cache"
+
+
+def stock_key(product_id) -> str:
+    return f"{STOCK_KEY_PREFIX}{product_id}{CACHE_CLEAR_SAFE_SUFFIX}"
+
+
+def hold_key(reservation_id) -> str:
+    return f"{HOLD_KEY_PREFIX}{reservation_id}{CACHE_CLEAR_SAFE_SUFFIX}"
+
+
+def committed_key(reservation_id) -> str:
+    return f"{COMMITTED_KEY_PREFIX}{reservation_id}{CACHE_CLEAR_SAFE_SUFFIX}"
+
+
+def _client():
+    client = get_redis_client()
+    if client is None:
+        raise InventoryUnavailable()
+    return client
+
+
+def _script(client, source):
+    key = (id(client), source)
+    script = _scripts.get(key)
+    if script is None:
+        script = _scripts[key] = client.register_script(source)
+    return script
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _load_stock(client, product_id):
+    """Put the counters of a product missing from redis back from MySQL."""
+    stock = db.session.get(Stock, product_id)
+    table = StockReservation.__table__
+    held, unapplied = db.session.execute(
+        select(
+            func.coalesce(
+                func.sum(case((table.c.status == StockReservation.STATUS_HELD, table.c.quantity), else_=0)),
+                0,
+            ),
+            func.coalesce(
+                func.sum(
+                    case((table.c.status == StockReservation.STATUS_COMMITTED, table.c.quantity), else_=0)
+                ),
+                0,
+            ),
+        ).where(
+            table.c.product_id == product_id,
+            or_(
+                table.c.status == StockReservation.STATUS_HELD,
+                and_(table.c.status == StockReservation.STATUS_COMMITTED, table.c.applied == 0),
+            ),
+        )
+    ).one()
+    on_hand = stock.on_hand if stock is not None else 0
+    _script(client, LOAD_STOCK_SCRIPT)(
+        keys=[stock_key(product_id)], args=[on_hand - held - unapplied, held]
+    )
+
+
+def _hold(client, reservation_id, lines, expires_at) -> bool:
+    """Run the reserve script, loading products missing from redis on the way.
+
+    Returns:
+        bool: False when the reservation was already held (a retry)
+    """
+    keys = [STOCK_HOLDS_KEY, hold_key(reservation_id), STOCK_DIRTY_KEY]
+    keys.extend(stock_key(product_id) for product_id, _ in lines)
+    args = [reservation_id, expires_at]
+    args.extend(product_id for product_id, _ in lines)
+    args.extend(quantity for _, quantity in lines)
+    for _ in range(len(lines) + 1):
+        status, position = _script(client, RESERVE_SCRIPT)(keys=keys, args=args)
+        if status == -1:
+            _load_stock(client, lines[position - 1][0])
+        elif status == -2:
+            raise OutOfStock(lines[position - 1][0])
+        else:
+            return status == 1
+    raise InventoryUnavailable()
+
+
+def _finish(client, reservation_id, mode) -> int:
+    """Run the finish script, returns FINISHED, ALREADY_COMMITTED or 0 (no hold)."""
+    return _script(client, FINISH_SCRIPT)(
+        keys=[
+            STOCK_HOLDS_KEY,
+            hold_key(reservation_id),
+            STOCK_DIRTY_KEY,
+            committed_key(reservation_id),
+        ],
+        args=[
+            reservation_id,
+            mode,
+            STOCK_KEY_PREFIX,
+            CACHE_CLEAR_SAFE_SUFFIX,
+            app.config["STOCK_COMMITTED_MARKER_SECONDS"],
+        ],
+    )
+
+
+def reserve(lines, owner=None, reservation_id=None, hold_seconds=None, commit=True):
+    """Hold stock of several products, all or nothing.
+
+    Args:
+        lines (dict): product_id -> quantity
+        owner (str, optional): cart key / order the stock is held for. Defaults to None.
+        reservation_id (str, optional): id to reuse on retries. Defaults to a new id.
+        hold_seconds (int, optional): lifetime of the hold. Defaults to STOCK_HOLD_SECONDS.
+        commit (bool, optional): commit the reservation rows, False to leave them in the
+            session for the caller's transaction, which must `release_reservation` a new
+            hold if it fails. Defaults to True.
+
+    Raises:
+        OutOfStock: a product has fewer available units than asked
+        InventoryUnavailable: redis is not reachable
+
+    Returns:
+        tuple: reservation id, False when `reservation_id` was already held (a retry)
+    """
+    client = _client()
+    reservation_id = reservation_id or uuid.uuid4().hex
+    hold_seconds = hold_seconds or app.config["STOCK_HOLD_SECONDS"]
+    # sorted, the same reservation always builds the same script call
+    lines = sorted(lines.items())
+    held = _hold(client, reservation_id, lines, time.time() + hold_seconds)
+    # rows of a retried hold are missing if the first attempt died before its commit
+    if not held and (
+        db.session.execute(
+            select(StockReservation.id)
+            .where(StockReservation.reservation_id == reservation_id)
+            .limit(1)
+        ).first()
+        is not None
+    ):
+        return reservation_id, False
+    expires_at = datetime.utcnow() + timedelta(seconds=hold_seconds)
+    db.session.add_all(
+        StockReservation(
+            reservation_id=reservation_id,
+            product_id=product_id,
+            quantity=quantity,
+            owner=owner,
+            expires_at=expires_at,
+        )
+        for product_id, quantity in lines
+    )
+    if commit:
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if held:
+                _finish(client, reservation_id, RELEASE)
+            raise
+    return reservation_id, held
+
+
+def _set_status(reservation_id, status):
+    table = StockReservation.__table__
+    db.session.execute(
+        update(table)
+        .where(
+            table.c.reservation_id == reservation_id,
+            table.c.status == StockReservation.STATUS_HELD,
+        )
+        .values(status=status, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def _is_committed(reservation_id) -> bool:
+    return (
+        db.session.execute(
+            select(StockReservation.id).where(
+                StockReservation.reservation_id == reservation_id,
+                StockReservation.status == StockReservation.STATUS_COMMITTED,
+            ).limit(1)
+        ).first()
+        is not None
+    )
+
+
+def commit_reservation(reservation_id) -> bool:
+    """Turn a hold into a sale, the units are taken off `on_hand` by reconciliation.
+
+    Safe to retry: the redis hold leaves a commit marker, so a retry after the
+    status update failed finishes that update and still answers True.
+
+    Returns:
+        bool: False if the hold has expired or was released
+    """
+    client = _client()
+    if _finish(client, reservation_id, COMMIT) in (FINISHED, ALREADY_COMMITTED):
+        _set_status(reservation_id, StockReservation.STATUS_COMMITTED)
+        return True
+    # committed before the marker expired
+    return _is_committed(reservation_id)
+
+
+def release_reservation(reservation_id, status=StockReservation.STATUS_RELEASED) -> bool:
+    """Give the units of a hold back.
+
+    Returns:
+        bool: False if the hold was already committed, released or expired
+    """
+    client = _client()
+    finished = _finish(client, reservation_id, RELEASE)
+    if finished == ALREADY_COMMITTED:
+        # sold in redis, rows left held by a failed commit follow it
+        _set_status(reservation_id, StockReservation.STATUS_COMMITTED)
+        return False
+    _set_status(reservation_id, status)
+    return finished == FINISHED
+
+
+def return_reservation(reservation_id) -> bool:
+    """Put the units of a committed reservation back on sale (cancelled order).
+
+    Rows are flipped to released under a row lock, once: lines already taken
+    off `on_hand` by reconciliation are added back to it, the others only
+    stop counting as sold. Redis gets the units back afterwards, like
+    `adjust_stock` does.
+
+    Returns:
+        bool: False if the reservation has no committed lines (already returned)
+    """
+    client = _client()
+    table = StockReservation.__table__
+    stock = Stock.__table__
+    rows = db.session.execute(
+        select(table.c.id, table.c.product_id, table.c.quantity, table.c.applied)
+        .where(
+            table.c.reservation_id == reservation_id,
+            table.c.status == StockReservation.STATUS_COMMITTED,
+        )
+        .order_by(table.c.product_id)
+        .with_for_update()
+    ).all()
+    if not rows:
+        db.session.rollback()
+        return False
+    for row in rows:
+        if row.applied:
+            db.session.execute(
+                update(stock)
+                .where(stock.c.product_id == row.product_id)
+                .values(on_hand=stock.c.on_hand + row.quantity)
+            )
+    db.session.execute(
+        update(table)
+        .where(table.c.id.in_([row.id for row in rows]))
+        .values(status=StockReservation.STATUS_RELEASED, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+    for row in rows:
+        _script(client, ADJUST_STOCK_SCRIPT)(
+            keys=[stock_key(row.product_id)], args=[row.quantity]
+        )
+    return True
+
+
+def expire_holds(batch_size=None) -> int:
+    """Release holds past their expiry.
+
+    Holds are read from the redis expiry set; rows still held well after their
+    expiry (redis lost meanwhile) are marked expired in primary key chunks.
+
+    Args:
+        batch_size (int, optional): Defaults to STOCK_BATCH_SIZE.
+
+    Returns:
+        int: number of released holds
+    """
+    batch_size = batch_size or app.config["STOCK_BATCH_SIZE"]
+    client = _client()
+    table = StockReservation.__table__
+    expired = 0
+    while True:
+        reservation_ids = [
+            _decode(reservation_id)
+            for reservation_id in client.zrangebyscore(
+                STOCK_HOLDS_KEY, "-inf", time.time(), start=0, num=batch_size
+            )
+        ]
+        released = [
+            reservation_id
+            for reservation_id in reservation_ids
+            if _finish(client, reservation_id, RELEASE) == FINISHED
+        ]
+        if released:
+            db.session.execute(
+                update(table)
+                .where(
+                    table.c.reservation_id.in_(released),
+                    table.c.status == StockReservation.STATUS_HELD,
+                )
+                .values(status=StockReservation.STATUS_EXPIRED, updated_at=datetime.utcnow())
+            )
+            db.session.commit()
+        expired += len(released)
+        if len(reservation_ids) < batch_size:
+            break
+
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config["STOCK_HOLD_GRACE_SECONDS"])
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.reservation_id)
+            .where(
+                table.c.status == StockReservation.STATUS_HELD,
+                table.c.expires_at < cutoff,
+            )
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        # sold in redis by a commit whose status update failed
+        reservation_ids = sorted({row.reservation_id for row in rows})
+        pipe = client.pipeline(transaction=False)
+        for reservation_id in reservation_ids:
+            pipe.exists(committed_key(reservation_id))
+        committed = {
+            reservation_id
+            for reservation_id, exists in zip(reservation_ids, pipe.execute())
+            if exists
+        }
+        by_status = {StockReservation.STATUS_COMMITTED: [], StockReservation.STATUS_EXPIRED: []}
+        for row in rows:
+            if row.reservation_id in committed:
+                by_status[StockReservation.STATUS_COMMITTED].append(row.id)
+            else:
+                by_status[StockReservation.STATUS_EXPIRED].append(row.id)
+        for status, ids in by_status.items():
+            if ids:
+                db.session.execute(
+                    update(table)
+                    .where(table.c.id.in_(ids), table.c.status == StockReservation.STATUS_HELD)
+                    .values(status=status, updated_at=datetime.utcnow())
+                )
+        db.session.commit()
+        if len(rows) < batch_size:
+            break
+    logging.info("Expired %s stock holds", expired)
+    return expired
+
+
+def reconcile_stock(batch_size=None) -> int:
+    """Take committed lines off `stock.on_hand` and copy the `held` counters.
+
+    Committed lines are read in primary key chunks, each chunk is one
+    transaction with one update per product, so a product sold a thousand
+    times between two runs costs one row lock instead of a thousand.
+
+    Args:
+        batch_size (int, optional): Defaults to STOCK_BATCH_SIZE.
+
+    Returns:
+        int: number of applied lines
+    """
+    batch_size = batch_size or app.config["STOCK_BATCH_SIZE"]
+    table = StockReservation.__table__
+    stock = Stock.__table__
+    applied = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.product_id, table.c.quantity)
+            .where(
+                table.c.status == StockReservation.STATUS_COMMITTED,
+                table.c.applied == 0,
+                table.c.id > last_id,
+            )
+            .order_by(table.c.id)
+            .limit(batch_size)
+            # returned orders release rows under the same lock, see return_reservation
+            .with_for_update()
+        ).all()
+        if not rows:
+            break
+        sold = {}
+        for row in rows:
+            sold[row.product_id] = sold.get(row.product_id, 0) + row.quantity
+        # in product order, concurrent writers lock stock rows in the same order
+        for product_id in sorted(sold):
+            db.session.execute(
+                update(stock)
+                .where(stock.c.product_id == product_id)
+                .values(on_hand=stock.c.on_hand - sold[product_id])
+            )
+        db.session.execute(
+            update(table).where(table.c.id.in_([row.id for row in rows])).values(applied=1)
+        )
+        db.session.commit()
+        applied += len(rows)
+        last_id = rows[-1].id
+        if len(rows) < batch_size:
+            break
+
+    client = get_redis_client()
+    while client is not None:
+        product_ids = sorted(
+            int(product_id)
+            for product_id in map(_decode, client.spop(STOCK_DIRTY_KEY, batch_size) or ())
+            if product_id.isdigit()
+        )
+        pipe = client.pipeline(transaction=False)
+        for product_id in product_ids:
+            pipe.hget(stock_key(product_id), "held")
+        for product_id, held in zip(product_ids, pipe.execute()):
+            if held is not None:
+                db.session.execute(
+                    update(stock)
+                    .where(stock.c.product_id == product_id)
+                    .values(reserved=int(held))
+                )
+        db.session.commit()
+        if len(product_ids) < batch_size:
+            break
+    logging.info("Applied %s committed stock reservations", applied)
+    return applied
+
+
+def stock_levels(product_id):
+    """Units on hand, available and held of a product, None without a stock row."""
+    stock = db.session.get(Stock, product_id)
+    if stock is None:
+        return None
+    client = _client()
+    counters = client.hgetall(stock_key(product_id))
+    if not counters:
+        _load_stock(client, product_id)
+        counters = client.hgetall(stock_key(product_id))
+    counters = {_decode(field): int(value) for field, value in counters.items()}
+    return {
+        "product_id": product_id,
+        "on_hand": stock.on_hand,
+        "available": counters.get("available", 0),
+        "held": counters.get("held", 0),
+        "reserved": stock.reserved,
+        "updated_at": stock.updated_at,
+    }
+
+
+def adjust_stock(product_id, delta):
+    """Add received units (or remove written off ones) to a product.
+
+    Returns:
+        Stock: the stock row
+    """
+    client = _client()
+    stock = db.session.execute(
+        select(Stock).where(Stock.product_id == product_id).with_for_update()
+    ).scalar_one_or_none()
+    if stock is None:
+        stock = Stock(product_id=product_id, on_hand=0)
+        db.session.add(stock)
+    stock.on_hand = (stock.on_hand or 0) + delta
+    db.session.commit()
+    _script(client, ADJUST_STOCK_SCRIPT)(keys=[stock_key(product_id)], args=[delta])
+    return stock
+
+
+def stats() -> dict:
+    """Active holds and products with counters not yet copied to MySQL."""
+    client = get_redis_client()
+    if client is None:
+        return {}
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.zcard(STOCK_HOLDS_KEY)
+        pipe.scard(STOCK_DIRTY_KEY)
+        holds, dirty = pipe.execute()
+    except Exception as exc:
+        logging.error("Not able to read inventory stats. Exception : %s" % (exc))
+        return {}
+    return {"holds": holds, "dirty_products": dirty}
+
+
+def _locked(lock_key, interval, func):
+    client = get_redis_client()
+    if client is None:
+        return 0
+    if not client.set(lock_key, 1, nx=True, ex=max(interval, 60)):
+        logging.info("%s already running, skipped", func.__name__)
+        return 0
+    try:
+        return func()
+    finally:
+        client.delete(lock_key)
+
+
+@celery.task(name="ecom.inventory.reservations.expire_holds")
+def expire_holds_task():
+    """Beat task, skipped while a previous run still holds the lock."""
+    return _locked(
+        STOCK_EXPIRE_LOCK_KEY, app.config["STOCK_EXPIRE_INTERVAL"], expire_holds
+    )
+
+
+@celery.task(name="ecom.inventory.reservations.reconcile_stock")
+def reconcile_stock_task():
+    """Beat task, skipped while a previous run still holds the lock."""
+    return _locked(
+        STOCK_RECONCILE_LOCK_KEY, app.config["STOCK_RECONCILE_INTERVAL"], reconcile_stock
+    )
@@ -0,0 +1 @@
+from .routes import api as inventory_api_v1
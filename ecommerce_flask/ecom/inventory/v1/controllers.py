@@ -0,0 +1,43 @@
+import logging
+
+from sqlalchemy.exc import IntegrityError
+
+from ecom.catalog.models import Product
+from ecom.extensions import db
+from ecom.inventory import reservations
+from ecom.utils import Response
+
+
+def get_stock(product_id):
+    try:
+        levels = reservations.stock_levels(product_id)
+    except reservations.InventoryUnavailable as exc:
+        return Response.failure(503, str(exc))
+    if levels is None:
+        return Response.failure(404, "No stock for this product")
+    return Response.success(levels)
+
+
+def adjust_stock(product_id, delta):
+    """Change the units on hand of a product.
+
+    Args:
+        product_id (int): product
+        delta (int): units received, negative for units written off
+
+    Returns:
+        dict: stock levels after the change
+    """
+    if delta == 0:
+        return Response.failure(400, payload="delta must not be 0")
+    if db.session.get(Product, product_id) is None:
+        return Response.failure(404, "Product not found")
+    try:
+        reservations.adjust_stock(product_id, delta)
+        return Response.success(reservations.stock_levels(product_id))
+    except IntegrityError as exc:
+        db.session.rollback()
+        logging.error("Not able to adjust stock. Exception : %s" % (exc))
+        return Response.failure(409, "Stock changed concurrently, retry")
+    except reservations.InventoryUnavailable as exc:
+        return Response.failure(503, str(exc))
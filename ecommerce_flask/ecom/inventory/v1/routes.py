@@ -0,0 +1,25 @@
+from flask_restx import Namespace, Resource, reqparse
+
+from ecom.auth.models import Role
+from ecom.auth.v1.decorator import roles_accepted
+from . import controllers
+
+api = Namespace("Inventory", description="Stock routes")
+
+
+@api.route("/<int:product_id>")
+class ProductStock(Resource):
+    @roles_accepted([Role.ROLE_ADMIN])
+    def get(self, product_id):
+        """Units on hand, available and held of a product"""
+        return controllers.get_stock(product_id)
+
+
+@api.route("/<int:product_id>/adjust")
+class AdjustStock(Resource):
+    @roles_accepted([Role.ROLE_ADMIN])
+    def post(self, product_id):
+        """Add received units, negative to write units off"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("delta", type=int, location="json", required=True, nullable=False)
+        return controllers.adjust_stock(product_id, parser.parse_args()["delta"])
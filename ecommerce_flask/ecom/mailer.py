@@ -0,0 +1,275 @@
+"""Transactional mail delivery through celery.
+
+`queue_mail` never talks to SMTP on the request thread. Messages are pushed to
+a redis outbox and a single `flush_mail_outbox` task per batch window drains it
+in batches of `MAIL_BATCH_SIZE` over one SMTP connection that every worker
+process keeps open between tasks.
+
+A flush claims a batch by moving it into a processing set with a due time, and
+only removes it there once it is sent, so a worker dying mid batch loses
+nothing: the `flush-mail-outbox` beat task puts overdue messages back in the
+outbox. Errors are handled per message. A permanent refusal (5xx) moves the
+message to the dead letter list and the batch goes on; a temporary one or a
+connection error keeps the unsent messages for a retry with exponential
+backoff, up to MAIL_MAX_RETRIES.
+"""
+
+import json
+import logging
+import random
+import smtplib
+import time
+import uuid
+
+from flask import current_app as app
+from flask_mail import Message
+
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import celery, get_redis_client, mail
+
+MAIL_OUTBOX_KEY = "mail_outbox" + CACHE_CLEAR_SAFE_SUFFIX
+MAIL_FLUSH_SCHEDULED_KEY = "mail_flush_scheduled" + CACHE_CLEAR_SAFE_SUFFIX
+# claimed messages scored by the time they go back to the outbox if unsent
+MAIL_PROCESSING_KEY = "mail_processing" + CACHE_CLEAR_SAFE_SUFFIX
+MAIL_DEAD_LETTER_KEY = "mail_dead_letter" + CACHE_CLEAR_SAFE_SUFFIX
+
+# errors about one message, the SMTP session stays usable
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+)
+
+# requeues overdue claims, then claims up to ARGV[1] messages due at ARGV[3]
+CLAIM_SCRIPT = """
+local overdue = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+for _, raw in ipairs(overdue) do
+    redis.call('ZREM', KEYS[2], raw)
+    redis.call('RPUSH', KEYS[1], raw)
+end
+local claimed = redis.call('LPOP', KEYS[1], ARGV[1])
+if not claimed then
+    return {}
+end
+for _, raw in ipairs(claimed) do
+    redis.call('ZADD', KEYS[2], ARGV[3], raw)
+end
+return claimed
+"""
+
+_scripts = {}
+
+# SMTP connection of this worker process, reused across tasks
+_connection = None
+
+
+def queue_mail(subject, recipients, body=None, html=None, sender=None):
+    """Queue a mail for delivery by the celery workers.
+
+    Sends right away on the calling thread when `MAIL_ASYNC` is disabled.
+
+    Args:
+        subject (str): mail subject
+        recipients (list): recipient addresses
+        body (str, optional): plain text body. Defaults to None.
+        html (str, optional): html body. Defaults to None.
+        sender (str, optional): sender, MAIL_DEFAULT_SENDER if None. Defaults to None.
+    """
+    payload = {
+        # keeps identical messages apart in the processing set
+        "id": uuid.uuid4().hex,
+        "subject": subject,
+        "recipients": list(recipients),
+        "body": body,
+        "html": html,
+        "sender": sender,
+    }
+    if not app.config["MAIL_ASYNC"]:
+        mail.send(_message(payload))
+        return
+
+    client = get_redis_client()
+    if client is None:
+        send_mail_batch.delay([payload])
+        return
+
+    client.rpush(MAIL_OUTBOX_KEY, json.dumps(payload))
+    window = app.config["MAIL_BATCH_WINDOW_SECONDS"]
+    # one flush per window, messages queued meanwhile go out in the same batch
+    if client.set(MAIL_FLUSH_SCHEDULED_KEY, 1, nx=True, ex=max(window * 10, 60)):
+        flush_mail_outbox.apply_async(countdown=window)
+
+
+def _message(payload):
+    return Message(
+        subject=payload["subject"],
+        recipients=payload["recipients"],
+        body=payload["body"],
+        html=payload["html"],
+        sender=payload["sender"],
+    )
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        connection = mail.connect()
+        # opens the SMTP session, closed only on failure or worker exit
+        connection.__enter__()
+        _connection = connection
+    return _connection
+
+
+def _reset_connection():
+    global _connection
+    if _connection is not None:
+        try:
+            _connection.__exit__(None, None, None)
+        except Exception:
+            pass
+    _connection = None
+
+
+def _retry_countdown(retries):
+    backoff = app.config["MAIL_RETRY_BACKOFF"] * 2**retries
+    return backoff + random.uniform(0, backoff / 2)
+
+
+def _script(client, source):
+    key = (id(client), source)
+    script = _scripts.get(key)
+    if script is None:
+        script = _scripts[key] = client.register_script(source)
+    return script
+
+
+def _is_permanent(exc):
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    # 4xx replies are temporary
+    return getattr(exc, "smtp_code", 0) >= 500
+
+
+def _dead_letter(payload, exc):
+    logging.error(
+        "Not able to deliver mail %r to %s, dead lettered. Exception : %s"
+        % (payload["subject"], payload["recipients"], exc)
+    )
+    client = get_redis_client()
+    if client is not None:
+        client.rpush(
+            MAIL_DEAD_LETTER_KEY, json.dumps(dict(payload, error=str(exc)))
+        )
+
+
+def _send_one(message):
+    try:
+        _get_connection().send(message)
+    except smtplib.SMTPServerDisconnected:
+        # idle connection dropped by the server, reconnect once
+        _reset_connection()
+        _get_connection().send(message)
+
+
+def _send(payloads):
+    """Send over the persistent connection, handling errors per message.
+
+    Permanently refused messages are dead lettered, temporarily refused ones
+    are kept for a retry. A connection error stops the batch, every message
+    not sent yet is kept for a retry.
+
+    Returns:
+        tuple: number of sent messages, payloads to retry and the last exception or None
+    """
+    sent = 0
+    retry = []
+    error = None
+    for index, payload in enumerate(payloads):
+        try:
+            _send_one(_message(payload))
+            sent += 1
+        except MESSAGE_ERRORS as exc:
+            error = exc
+            if _is_permanent(exc):
+                _dead_letter(payload, exc)
+            else:
+                retry.append(payload)
+        except (smtplib.SMTPException, OSError) as exc:
+            _reset_connection()
+            logging.error(
+                "Mail delivery failed after %s of %s messages. Exception : %s"
+                % (index, len(payloads), exc)
+            )
+            return sent, retry + payloads[index:], exc
+    return sent, retry, error
+
+
+@celery.task(bind=True, name="ecom.mailer.send_mail_batch")
+def send_mail_batch(self, payloads):
+    """Send the messages, retrying only the unsent ones with exponential backoff."""
+    sent, retry, exc = _send(payloads)
+    if retry:
+        raise self.retry(
+            args=(retry,),
+            exc=exc,
+            countdown=_retry_countdown(self.request.retries),
+            max_retries=app.config["MAIL_MAX_RETRIES"],
+        )
+    return sent
+
+
+def _settle(client, claimed, retry, exc):
+    """Drop a sent batch from the processing set, rescheduling the retries."""
+    retried = {id(payload) for payload in retry}
+    pipe = client.pipeline(transaction=False)
+    for raw, payload in claimed:
+        pipe.zrem(MAIL_PROCESSING_KEY, raw)
+        if id(payload) not in retried:
+            continue
+        attempts = payload.get("attempts", 0) + 1
+        if attempts > app.config["MAIL_MAX_RETRIES"]:
+            _dead_letter(payload, exc)
+            continue
+        # overdue from then on, put back in the outbox by a later flush
+        pipe.zadd(
+            MAIL_PROCESSING_KEY,
+            {
+                json.dumps(dict(payload, attempts=attempts)): time.time()
+                + _retry_countdown(attempts - 1)
+            },
+        )
+    pipe.execute()
+
+
+@celery.task(name="ecom.mailer.flush_mail_outbox")
+def flush_mail_outbox():
+    """Drain the redis outbox in batches of MAIL_BATCH_SIZE.
+
+    Also the `flush-mail-outbox` beat task, which requeues the messages of
+    crashed flushes and retries that are due.
+    """
+    client = get_redis_client()
+    if client is None:
+        return 0
+    # cleared before draining, anything queued from now on schedules a new flush
+    client.delete(MAIL_FLUSH_SCHEDULED_KEY)
+    batch_size = app.config["MAIL_BATCH_SIZE"]
+    claim = _script(client, CLAIM_SCRIPT)
+    sent = 0
+    while True:
+        now = time.time()
+        raw = claim(
+            keys=[MAIL_OUTBOX_KEY, MAIL_PROCESSING_KEY],
+            args=[batch_size, now, now + app.config["MAIL_PROCESSING_TIMEOUT"]],
+        )
+        if not raw:
+            break
+        claimed = [(item, json.loads(item)) for item in raw]
+        batch_sent, retry, exc = _send([payload for _, payload in claimed])
+        sent += batch_sent
+        _settle(client, claimed, retry, exc)
+        if exc is not None and not isinstance(exc, MESSAGE_ERRORS):
+            # connection is down, the rest waits for the retries
+            break
+    logging.info("Mail outbox flushed, %s messages sent", sent)
+    return sent
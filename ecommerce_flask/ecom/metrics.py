@@ -0,0 +1,255 @@
+"""Always-on, lightweight request instrumentation.
+
+Per endpoint latency histograms, SQL query count/time, response size and cache
+hit/miss counters. Every thread records into its own buckets, so the request
+path takes no lock; buckets of all threads are only merged when
+`/api/metrics` is scraped. Buckets of finished threads / greenlets are folded
+into one retired store, so the number of stores follows the live threads.
+Numbers are per worker process, every series carries a `worker` label (the
+pid) so the scraper can sum the workers. The endpoint is only served to the
+METRICS_ALLOWED_IPS and, when METRICS_TOKEN is set, to its bearer.
+"""
+
+import hmac
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+from flask import Response, abort, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+UNMATCHED_ENDPOINT = "unmatched"
+
+_thread_local = threading.local()
+_stores = []
+_stores_lock = threading.Lock()
+_gauges = {}
+
+
+class _Store:
+    """Counters owned and written by a single thread."""
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 2))
+        self.sql = defaultdict(lambda: [0, 0.0])
+        self.response_bytes = defaultdict(int)
+        self.cache = defaultdict(int)
+
+    def add(self, other):
+        # dict() copies are atomic under the GIL, the owner thread keeps writing
+        for key, value in dict(other.requests).items():
+            self.requests[key] += value
+        for key, value in dict(other.latency).items():
+            self.latency[key] = [a + b for a, b in zip(self.latency[key], value)]
+        for key, value in dict(other.sql).items():
+            self.sql[key] = [a + b for a, b in zip(self.sql[key], value)]
+        for key, value in dict(other.response_bytes).items():
+            self.response_bytes[key] += value
+        for key, value in dict(other.cache).items():
+            self.cache[key] += value
+
+
+class _Owner:
+    """Thread-local handle of a store, collected when its thread ends."""
+
+    def __init__(self, store):
+        self.store = store
+
+
+_retired = _Store()
+
+
+def _retire(store):
+    with _stores_lock:
+        try:
+            _stores.remove(store)
+        except ValueError:
+            return
+        _retired.add(store)
+
+
+def _store() -> _Store:
+    owner = getattr(_thread_local, "owner", None)
+    if owner is None:
+        owner = _thread_local.owner = _Owner(_Store())
+        # the finalizer must not keep the owner alive, only its store
+        weakref.finalize(owner, _retire, owner.store)
+        # the only lock, taken once per thread
+        with _stores_lock:
+            _stores.append(owner.store)
+    return owner.store
+
+
+def register_gauges(name, collect):
+    """Export the numbers returned by `collect()` as gauges `ecom_<name>_<key>`.
+
+    Args:
+        name (str): metric name prefix
+        collect (callable): returns a dict of numbers, nested dicts are flattened
+    """
+    _gauges[name] = collect
+
+
+def record_cache_lookup(hit: bool):
+    _store().cache["hit" if hit else "miss"] += 1
+
+
+def _request_started():
+    _thread_local.request = {"start": time.perf_counter(), "sql": [0, 0.0]}
+
+
+def _request_finished(response):
+    current = getattr(_thread_local, "request", None)
+    if current is None:
+        return response
+    _thread_local.request = None
+    elapsed = time.perf_counter() - current["start"]
+    endpoint = request.endpoint or UNMATCHED_ENDPOINT
+
+    store = _store()
+    store.requests[(endpoint, request.method, response.status_code)] += 1
+    histogram = store.latency[endpoint]
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if elapsed <= bound:
+            histogram[index] += 1
+            break
+    else:
+        histogram[len(LATENCY_BUCKETS)] += 1
+    histogram[-1] += elapsed
+    sql = store.sql[endpoint]
+    sql[0] += current["sql"][0]
+    sql[1] += current["sql"][1]
+    if not response.direct_passthrough:
+        store.response_bytes[endpoint] += response.calculate_content_length() or 0
+    return response
+
+
+def _request_teardown(exc):
+    _thread_local.request = None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started_at")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    current = getattr(_thread_local, "request", None)
+    if current is not None:
+        current["sql"][0] += 1
+        current["sql"][1] += elapsed
+
+
+def _merge():
+    total = _Store()
+    with _stores_lock:
+        # retired under the lock, a store is counted either live or retired
+        total.add(_retired)
+        stores = list(_stores)
+    for store in stores:
+        total.add(store)
+    return total.requests, total.latency, total.sql, total.response_bytes, total.cache
+
+
+def _flatten(values, prefix=""):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}_")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", value
+
+
+def render() -> str:
+    """Render the metrics of this worker in the Prometheus text format."""
+    requests, latency, sql, response_bytes, cache = _merge()
+    worker = f'worker="{os.getpid()}"'
+    lines = []
+
+    lines.append("# TYPE ecom_http_requests_total counter")
+    for (endpoint, method, status), value in sorted(requests.items()):
+        lines.append(
+            f'ecom_http_requests_total{{{worker},endpoint="{endpoint}",method="{method}",status="{status}"}} {value}'
+        )
+
+    lines.append("# TYPE ecom_http_request_duration_seconds histogram")
+    for endpoint, histogram in sorted(latency.items()):
+        cumulative = 0
+        for bound, value in zip(LATENCY_BUCKETS, histogram):
+            cumulative += value
+            lines.append(
+                f'ecom_http_request_duration_seconds_bucket{{{worker},endpoint="{endpoint}",le="{bound}"}} {cumulative}'
+            )
+        count = cumulative + histogram[len(LATENCY_BUCKETS)]
+        lines.append(
+            f'ecom_http_request_duration_seconds_bucket{{{worker},endpoint="{endpoint}",le="+Inf"}} {count}'
+        )
+        lines.append(
+            f'ecom_http_request_duration_seconds_sum{{{worker},endpoint="{endpoint}"}} {histogram[-1]:.6f}'
+        )
+        lines.append(
+            f'ecom_http_request_duration_seconds_count{{{worker},endpoint="{endpoint}"}} {count}'
+        )
+
+    lines.append("# TYPE ecom_http_sql_queries_total counter")
+    for endpoint, (count, _) in sorted(sql.items()):
+        lines.append(f'ecom_http_sql_queries_total{{{worker},endpoint="{endpoint}"}} {count}')
+    lines.append("# TYPE ecom_http_sql_seconds_total counter")
+    for endpoint, (_, seconds) in sorted(sql.items()):
+        lines.append(
+            f'ecom_http_sql_seconds_total{{{worker},endpoint="{endpoint}"}} {seconds:.6f}'
+        )
+
+    lines.append("# TYPE ecom_http_response_bytes_total counter")
+    for endpoint, value in sorted(response_bytes.items()):
+        lines.append(
+            f'ecom_http_response_bytes_total{{{worker},endpoint="{endpoint}"}} {value}'
+        )
+
+    lines.append("# TYPE ecom_cache_lookups_total counter")
+    for result, value in sorted(cache.items()):
+        lines.append(f'ecom_cache_lookups_total{{{worker},result="{result}"}} {value}')
+
+    for name, collect in sorted(_gauges.items()):
+        for key, value in _flatten(collect()):
+            lines.append(f"# TYPE ecom_{name}_{key} gauge")
+            lines.append(f"ecom_{name}_{key}{{{worker}}} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _scrape_allowed() -> bool:
+    allowed_ips = current_app.config["METRICS_ALLOWED_IPS"]
+    if allowed_ips and request.remote_addr not in allowed_ips:
+        return False
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return hmac.compare_digest(supplied.encode(), token.encode())
+    return True
+
+
+def export_metrics():
+    if not _scrape_allowed():
+        abort(403)
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_metrics(app):
+    """Register the request hooks and the `/api/metrics` endpoint on the app."""
+    if not app.config["METRICS_ENABLED"]:
+        return
+    app.before_request(_request_started)
+    app.after_request(_request_finished)
+    app.teardown_request(_request_teardown)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.add_url_rule("/api/metrics", "metrics", export_metrics)
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    CHAR,
+    DECIMAL,
+    INTEGER,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    String,
+    UniqueConstraint,
+)
+from sqlalchemy.orm import relationship
+
+from ecom.extensions import db
+
+
+class Order(db.Model):
+    __tablename__ = "orders"
+
+    # placed -> allocated (stock committed) -> completed (paid), or failed,
+    # through refunding when the outcome of the payment is unknown
+    STATUS_PLACED = "placed"
+    STATUS_ALLOCATED = "allocated"
+    STATUS_COMPLETED = "completed"
+    STATUS_REFUNDING = "refunding"
+    STATUS_FAILED = "failed"
+
+    order_id = Column(INTEGER, primary_key=True)
+    user_id = Column(
+        INTEGER,
+        ForeignKey("users.user_id", name="orders_ibfk_1"),
+        nullable=False,
+    )
+    # Idempotency-Key of the request that placed the order
+    idempotency_key = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False, default=STATUS_PLACED)
+    # stock hold of ecom.inventory.reservations
+    reservation_id = Column(String(32), nullable=False)
+    total = Column(DECIMAL(12, 2), nullable=False)
+    currency = Column(CHAR(3), nullable=False)
+    payment_reference = Column(String(64), nullable=True)
+    failure_reason = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
+    items = relationship("OrderItem", backref="order", lazy="selectin")
+
+    __table_args__ = (
+        # retries of the same request hit this constraint if redis lost the key
+        UniqueConstraint("user_id", "idempotency_key", name="uq_orders_user_id_idempotency_key"),
+        # orders of a user, newest first
+        Index("ix_orders_user_id_order_id", "user_id", "order_id"),
+        # orders stuck in a step, see tasks.sweep_stuck_orders
+        Index("ix_orders_status_updated_at", "status", "updated_at"),
+    )
+
+
+class OrderItem(db.Model):
+    __tablename__ = "order_items"
+
+    id = Column(INTEGER, primary_key=True)
+    order_id = Column(
+        INTEGER,
+        ForeignKey(Order.order_id, name="order_items_ibfk_1", ondelete="CASCADE"),
+        nullable=False,
+    )
+    product_id = Column(
+        INTEGER,
+        ForeignKey("product.product_id", name="order_items_ibfk_2"),
+        nullable=False,
+    )
+    quantity = Column(INTEGER, nullable=False)
+    unit_price = Column(DECIMAL(12, 2), nullable=False)
+    currency = Column(CHAR(3), nullable=False)
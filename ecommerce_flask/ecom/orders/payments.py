@@ -0,0 +1,124 @@
+"""Payment capture and refund behind PAYMENT_BACKEND / PAYMENT_REFUND_BACKEND.
+
+PAYMENT_BACKEND is the import path of a function `capture(order, payment_token)`
+returning the payment reference, raising `PaymentDeclined` when the payment
+is refused. Any other exception is treated as transient and the capture is
+retried, so backends should hand the order id to the provider as its
+idempotency key.
+
+PAYMENT_REFUND_BACKEND is the import path of a function `refund(order)` giving
+back whatever was captured for the order. It is called when the outcome of a
+capture is unknown, so it must succeed (void) when nothing was captured and be
+idempotent on the order id as well.
+
+The payment token of a checkout never travels through the celery broker: it
+is kept in redis, encrypted with PAYMENT_TOKEN_KEY, under the reservation id
+of the order until the capture settles or PAYMENT_TOKEN_TTL passes.
+"""
+
+import base64
+import hashlib
+import logging
+
+from cryptography.fernet import Fernet, InvalidToken
+from flask import current_app as app
+from werkzeug.utils import import_string
+
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import get_redis_client
+
+PAYMENT_TOKEN_KEY = "payment_token_{}" + CACHE_CLEAR_SAFE_SUFFIX
+
+_backends = {}
+_fernets = {}
+
+
+class PaymentDeclined(Exception):
+    pass
+
+
+def offline_capture(order, payment_token=None) -> str:
+    """Backend for payments collected outside the application (invoice, cash on delivery)."""
+    return f"offline-{order.order_id}"
+
+
+def offline_refund(order) -> str:
+    """Refund backend matching `offline_capture`, nothing was collected online."""
+    return f"offline-refund-{order.order_id}"
+
+
+def _fernet():
+    secret = app.config["PAYMENT_TOKEN_KEY"]
+    fernet = _fernets.get(secret)
+    if fernet is None:
+        key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+        fernet = _fernets[secret] = Fernet(key)
+    return fernet
+
+
+def save_token(reservation_id, payment_token):
+    """Keep the encrypted token of an order for its capture task.
+
+    Raises:
+        RuntimeError: redis is not configured
+    """
+    client = get_redis_client()
+    if client is None:
+        raise RuntimeError("Payment tokens need redis")
+    client.set(
+        PAYMENT_TOKEN_KEY.format(reservation_id),
+        _fernet().encrypt(payment_token.encode()),
+        ex=app.config["PAYMENT_TOKEN_TTL"],
+    )
+
+
+def load_token(reservation_id):
+    """Returns the token saved for an order, None when there is none."""
+    client = get_redis_client()
+    encrypted = client.get(PAYMENT_TOKEN_KEY.format(reservation_id)) if client else None
+    if encrypted is None:
+        return None
+    try:
+        return _fernet().decrypt(encrypted).decode()
+    except InvalidToken:
+        logging.error("Not able to decrypt the payment token of reservation %s" % (reservation_id))
+        return None
+
+
+def forget_token(reservation_id):
+    """Drop a settled token, best effort, it expires after PAYMENT_TOKEN_TTL anyway."""
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.delete(PAYMENT_TOKEN_KEY.format(reservation_id))
+    except Exception as exc:
+        logging.error("Not able to delete the payment token of reservation %s. Exception : %s" % (reservation_id, exc))
+
+
+def _backend(path):
+    backend = _backends.get(path)
+    if backend is None:
+        backend = _backends[path] = import_string(path)
+    return backend
+
+
+def capture(order, payment_token=None) -> str:
+    """Capture the total of an order with the configured backend.
+
+    Raises:
+        PaymentDeclined: the payment was refused
+
+    Returns:
+        str: payment reference
+    """
+    return _backend(app.config["PAYMENT_BACKEND"])(order, payment_token)
+
+
+def refund(order) -> str:
+    """Give back the payment of an order with the configured refund backend.
+
+    Returns:
+        str: refund reference
+    """
+    return _backend(app.config["PAYMENT_REFUND_BACKEND"])(order)
@@ -0,0 +1,172 @@
+"""Order placement.
+
+The request only validates the lines, holds their stock in redis (see
+ecom.inventory.reservations) and inserts the order with its lines and
+reservation rows in one short transaction. Stock finalization, payment
+capture and the confirmation mail run afterwards as a celery chain (see
+ecom.orders.tasks), so a checkout costs one insert whatever the payment
+provider or mail server are doing.
+
+Retries are answered from redis by `ecom.idempotency`. The reservation id is
+derived from the idempotency key so a retry after a crash reuses its hold,
+and the unique `(user_id, idempotency_key)` of `orders` catches retries
+redis does not know about.
+"""
+
+import hashlib
+import logging
+from decimal import Decimal
+
+from celery import chain
+from flask import current_app as app
+from sqlalchemy.exc import IntegrityError
+
+from ecom.cart import persist, store
+from ecom.catalog import listings
+from ecom.extensions import db
+from ecom.inventory import reservations
+from ecom.orders import payments, tasks
+from ecom.orders.models import Order, OrderItem
+
+
+def reservation_id_of(user_id, idempotency_key) -> str:
+    return hashlib.md5(f"{user_id}:{idempotency_key}".encode()).hexdigest()
+
+
+def order_lines(user_id, items=None):
+    """Lines of a new order.
+
+    Args:
+        user_id (int): buyer
+        items (list, optional): dicts of product_id / quantity bought at the
+            current price. Defaults to None, the cart of the user at the prices
+            the products were added at.
+
+    Raises:
+        ValueError: no lines, unknown / inactive products, several currencies
+
+    Returns:
+        tuple: lines, version of the cart they come from or None
+    """
+    version = None
+    if items is None:
+        cart = store.get_cart(store.user_cart_key(user_id))
+        lines, version = cart["items"], cart["version"]
+        for line in lines:
+            if listings.get_product(line["product_id"]) is None:
+                raise ValueError(f"Product {line['product_id']} is not available anymore")
+    else:
+        quantities = {}
+        for item in items:
+            product_id, quantity = item.get("product_id"), item.get("quantity", 1)
+            if not isinstance(product_id, int) or not isinstance(quantity, int) or quantity <= 0:
+                raise ValueError("Items need an integer product_id and a positive quantity")
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        if len(quantities) > app.config["CART_MAX_LINES"]:
+            raise ValueError(f"At most {app.config['CART_MAX_LINES']} products per order")
+        lines = []
+        for product_id, quantity in sorted(quantities.items()):
+            product = listings.get_product(product_id)
+            if product is None:
+                raise ValueError(f"Product {product_id} is not available")
+            lines.append(
+                {
+                    "product_id": product_id,
+                    "quantity": quantity,
+                    "unit_price": Decimal(str(product["price"])),
+                    "currency": product["currency"],
+                }
+            )
+    if not lines:
+        raise ValueError("Order has no items")
+    if len({line["currency"] for line in lines}) > 1:
+        raise ValueError("Items are priced in more than one currency")
+    return lines, version
+
+
+def _fulfill(order):
+    # stock first, buyers are only charged for units that are theirs
+    chain(
+        tasks.finalize_stock.s(order.order_id),
+        tasks.capture_payment.s(),
+        tasks.send_confirmation.s(),
+    ).apply_async()
+
+
+def place_order(user_id, idempotency_key, items=None, payment_token=None):
+    """Validate, reserve and persist an order, then start its fulfillment chain.
+
+    Args:
+        user_id (int): buyer
+        idempotency_key (str): Idempotency-Key of the request
+        items (list, optional): see `order_lines`. Defaults to None (the cart).
+        payment_token (str, optional): passed to the payment backend, kept
+            server side until the capture. Defaults to None.
+
+    Raises:
+        ValueError: invalid lines
+        reservations.OutOfStock: not enough stock of a product
+        reservations.InventoryUnavailable / store.CartUnavailable: redis is down
+
+    Returns:
+        tuple: the order, False when it was placed by an earlier try of the request
+    """
+    lines, cart_version = order_lines(user_id, items)
+    reservation_id, held = reservations.reserve(
+        {line["product_id"]: line["quantity"] for line in lines},
+        owner=store.user_cart_key(user_id),
+        reservation_id=reservation_id_of(user_id, idempotency_key),
+        commit=False,
+    )
+    order = Order(
+        user_id=user_id,
+        idempotency_key=idempotency_key,
+        reservation_id=reservation_id,
+        total=sum(line["unit_price"] * line["quantity"] for line in lines),
+        currency=lines[0]["currency"],
+        items=[
+            OrderItem(
+                product_id=line["product_id"],
+                quantity=line["quantity"],
+                unit_price=line["unit_price"],
+                currency=line["currency"],
+            )
+            for line in lines
+        ],
+    )
+    db.session.add(order)
+    try:
+        if payment_token is not None:
+            # keyed by the reservation id, known before the insert and reused by retries
+            payments.save_token(reservation_id, payment_token)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existing = Order.query.filter_by(
+            user_id=user_id, idempotency_key=idempotency_key
+        ).first()
+        if held:
+            reservations.release_reservation(reservation_id)
+        if existing is None:
+            raise
+        if existing.status == Order.STATUS_PLACED:
+            # the first try may have died before starting the chain, the
+            # tasks skip orders already past their step
+            _fulfill(existing)
+        return existing, False
+    except Exception:
+        db.session.rollback()
+        if held:
+            reservations.release_reservation(reservation_id)
+        raise
+
+    _fulfill(order)
+    if cart_version is not None:
+        cart_key = store.user_cart_key(user_id)
+        if store.check_out(cart_key, cart_version, order.order_id):
+            persist.check_out_cart_task.delay(cart_key, order.order_id)
+        else:
+            logging.info(
+                "Cart %s changed while order %s was placed, left as is", cart_key, order.order_id
+            )
+    return order, True
@@ -0,0 +1,20 @@
+from marshmallow import fields
+
+from ecom.extensions import mm
+from ecom.orders.models import Order, OrderItem
+
+
+class OrderItemSchema(mm.SQLAlchemyAutoSchema):
+    class Meta:
+        model = OrderItem
+        include_fk = True
+        exclude = ("id",)
+
+
+class OrderSchema(mm.SQLAlchemyAutoSchema):
+    class Meta:
+        model = Order
+        include_fk = True
+        exclude = ("idempotency_key", "reservation_id")
+
+    items = fields.Nested(OrderItemSchema, many=True)
@@ -0,0 +1,254 @@
+"""Fulfillment of a placed order, chained by `placement.place_order`:
+
+    finalize_stock -> capture_payment -> send_confirmation
+
+Only the order id goes through the broker, the payment token is read from
+redis by `capture_payment` (see ecom.orders.payments).
+
+The stock is committed before the buyer is charged, so a paid order always
+has its units. Each task receives the order id and moves the order from the
+status it expects with a conditional update, so redelivered or retried tasks
+and the `sweep-stuck-orders` beat task never both act on an order; the loser
+of such a race undoes its own step.
+
+Transient errors are retried with exponential backoff. A declined payment
+fails the order and `compensate` puts its stock back on sale. A capture whose
+outcome stays unknown after its retries moves the order to refunding, and
+`compensate` refunds it as well.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app as app
+from sqlalchemy import select, update
+
+from ecom.auth.models import User
+from ecom.constants import CACHE_CLEAR_SAFE_SUFFIX
+from ecom.extensions import celery, db, get_redis_client
+from ecom.inventory import reservations
+from ecom.mailer import queue_mail
+from ecom.orders import payments
+from ecom.orders.models import Order
+
+ORDER_SWEEP_LOCK_KEY = "order_sweep_lock" + CACHE_CLEAR_SAFE_SUFFIX
+
+
+def _transition(order_id, from_status, to_status, **values) -> bool:
+    """Move an order out of `from_status`, False when something else moved it first."""
+    table = Order.__table__
+    moved = db.session.execute(
+        update(table)
+        .where(table.c.order_id == order_id, table.c.status == from_status)
+        .values(status=to_status, updated_at=datetime.utcnow(), **values)
+    ).rowcount
+    db.session.commit()
+    return moved == 1
+
+
+def _fail(order_id, from_status, reason) -> bool:
+    if not _transition(order_id, from_status, Order.STATUS_FAILED, failure_reason=reason[:255]):
+        return False
+    logging.info("Order %s failed: %s", order_id, reason)
+    compensate.delay(order_id)
+    return True
+
+
+def _retry(task, exc):
+    logging.error("Not able to run %s. Exception : %s" % (task.name, exc))
+    db.session.rollback()
+    return task.retry(exc=exc, countdown=2 ** task.request.retries)
+
+
+def _retries_left(task) -> bool:
+    return task.request.retries < task.max_retries
+
+
+@celery.task(bind=True, name="ecom.orders.tasks.finalize_stock", max_retries=5)
+def finalize_stock(self, order_id):
+    """Turn the stock hold of a placed order into a sale."""
+    order = db.session.get(Order, order_id)
+    if order is None or order.status != Order.STATUS_PLACED:
+        return order_id
+    try:
+        committed = reservations.commit_reservation(order.reservation_id)
+    except Exception as exc:
+        if _retries_left(self):
+            raise _retry(self, exc)
+        db.session.rollback()
+        _fail(order_id, Order.STATUS_PLACED, "Stock could not be reserved")
+        return order_id
+    if not committed:
+        _fail(order_id, Order.STATUS_PLACED, "Stock hold expired before the order was processed")
+    elif not _transition(order_id, Order.STATUS_PLACED, Order.STATUS_ALLOCATED):
+        # given up by the sweep meanwhile, its compensation may have run already
+        compensate.delay(order_id)
+    return order_id
+
+
+@celery.task(bind=True, name="ecom.orders.tasks.capture_payment", max_retries=5)
+def capture_payment(self, order_id, payment_token=None):
+    """Charge an allocated order with the token saved at placement.
+
+    `payment_token` is only passed by chains started before tokens were kept
+    server side.
+    """
+    order = db.session.get(Order, order_id)
+    if order is None or order.status != Order.STATUS_ALLOCATED:
+        return order_id
+    try:
+        if payment_token is None:
+            payment_token = payments.load_token(order.reservation_id)
+        reference = payments.capture(order, payment_token)
+    except payments.PaymentDeclined as exc:
+        payments.forget_token(order.reservation_id)
+        _fail(order_id, Order.STATUS_ALLOCATED, f"Payment declined: {exc}")
+        return order_id
+    except Exception as exc:
+        if _retries_left(self):
+            raise _retry(self, exc)
+        # the provider may have charged the buyer, refunded by compensate
+        db.session.rollback()
+        payments.forget_token(order.reservation_id)
+        logging.error("Payment of order %s could not be captured, refunding" % (order_id))
+        if _transition(
+            order_id,
+            Order.STATUS_ALLOCATED,
+            Order.STATUS_REFUNDING,
+            failure_reason="Payment could not be captured",
+        ):
+            compensate.delay(order_id, refund=True)
+        return order_id
+    payments.forget_token(order.reservation_id)
+    if not _transition(
+        order_id, Order.STATUS_ALLOCATED, Order.STATUS_COMPLETED, payment_reference=reference
+    ):
+        # charged after the sweep gave the order up
+        logging.error("Order %s was paid after it was given up, refunding" % (order_id))
+        compensate.delay(order_id, refund=True)
+    return order_id
+
+
+@celery.task(bind=True, name="ecom.orders.tasks.compensate", max_retries=10)
+def compensate(self, order_id, refund=False):
+    """Undo the steps a failed order went through, every step is idempotent.
+
+    Args:
+        order_id (int): failed or refunding order
+        refund (bool, optional): refund the payment as well. Defaults to False.
+    """
+    order = db.session.get(Order, order_id)
+    if order is None or order.status not in (Order.STATUS_FAILED, Order.STATUS_REFUNDING):
+        return order_id
+    try:
+        if refund or order.status == Order.STATUS_REFUNDING:
+            payments.refund(order)
+        # a hold not committed yet, then committed lines
+        reservations.release_reservation(order.reservation_id)
+        reservations.return_reservation(order.reservation_id)
+    except Exception as exc:
+        if _retries_left(self):
+            raise _retry(self, exc)
+        logging.error("Not able to compensate order %s, needs a manual refund / stock check" % (order_id))
+        return order_id
+    if _transition(order_id, Order.STATUS_REFUNDING, Order.STATUS_FAILED):
+        send_confirmation.delay(order_id)
+    return order_id
+
+
+@celery.task(name="ecom.orders.tasks.send_confirmation")
+def send_confirmation(order_id):
+    order = db.session.get(Order, order_id)
+    if order is None or order.status not in (Order.STATUS_COMPLETED, Order.STATUS_FAILED):
+        return order_id
+    user = db.session.get(User, order.user_id)
+    if order.status == Order.STATUS_COMPLETED:
+        subject = f"Order #{order.order_id} confirmed"
+        lines = [
+            f"{item.quantity} x product {item.product_id} at {item.unit_price} {item.currency}"
+            for item in order.items
+        ]
+        body = "\n".join(lines + [f"Total: {order.total} {order.currency}"])
+    else:
+        subject = f"Order #{order.order_id} could not be completed"
+        body = order.failure_reason
+    queue_mail(subject, [user.email], body=body)
+    return order_id
+
+
+def sweep_stuck_orders(stuck_seconds=None, batch_size=None) -> int:
+    """Give up orders left in a fulfillment step for `stuck_seconds`.
+
+    Placed orders (chain lost before the stock step) are failed, nothing was
+    charged. Allocated orders (capture lost or never finished) and refunding
+    ones (compensation out of retries) are refunded by `compensate`.
+
+    Args:
+        stuck_seconds (int, optional): Defaults to ORDER_STUCK_SECONDS.
+        batch_size (int, optional): Defaults to ORDER_SWEEP_BATCH_SIZE.
+
+    Returns:
+        int: number of handled orders
+    """
+    stuck_seconds = stuck_seconds or app.config["ORDER_STUCK_SECONDS"]
+    batch_size = batch_size or app.config["ORDER_SWEEP_BATCH_SIZE"]
+    table = Order.__table__
+    handled = 0
+    last_id = 0
+    while True:
+        cutoff = datetime.utcnow() - timedelta(seconds=stuck_seconds)
+        rows = db.session.execute(
+            select(table.c.order_id, table.c.status)
+            .where(
+                table.c.status.in_(
+                    [Order.STATUS_PLACED, Order.STATUS_ALLOCATED, Order.STATUS_REFUNDING]
+                ),
+                table.c.updated_at < cutoff,
+                table.c.order_id > last_id,
+            )
+            .order_by(table.c.order_id)
+            .limit(batch_size)
+        ).all()
+        db.session.commit()
+        for order_id, status in rows:
+            if status == Order.STATUS_PLACED:
+                if _fail(order_id, status, "Order was not processed in time"):
+                    send_confirmation.delay(order_id)
+                    handled += 1
+            # refunding orders keep their reason, only updated_at moves
+            elif _transition(
+                order_id,
+                status,
+                Order.STATUS_REFUNDING,
+                **(
+                    {"failure_reason": "Order was not processed in time"}
+                    if status == Order.STATUS_ALLOCATED
+                    else {}
+                ),
+            ):
+                # a refund still stuck comes back ORDER_STUCK_SECONDS later
+                compensate.delay(order_id, refund=True)
+                handled += 1
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1].order_id
+    db.session.remove()
+    logging.info("Swept %s stuck orders", handled)
+    return handled
+
+
+@celery.task(name="ecom.orders.tasks.sweep_stuck_orders")
+def sweep_stuck_orders_task():
+    """Beat task, skipped while a previous run still holds the lock."""
+    client = get_redis_client()
+    lock_timeout = max(app.config["ORDER_SWEEP_INTERVAL"], 60)
+    if client is not None and not client.set(
+        ORDER_SWEEP_LOCK_KEY, 1, nx=True, ex=lock_timeout
+    ):
+        logging.info("Order sweep already running, skipped")
+        return 0
+    try:
+        return sweep_stuck_orders()
+    finally:
+        if client is not None:
+            client.delete(ORDER_SWEEP_LOCK_KEY)
@@ -0,0 +1 @@
+from .routes import api as orders_api_v1
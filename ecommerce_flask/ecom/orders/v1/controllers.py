@@ -0,0 +1,56 @@
+import flask_praetorian
+
+from ecom.cart import store
+from ecom.inventory import reservations
+from ecom.orders import placement
+from ecom.orders.models import Order
+from ecom.orders.schemas import OrderSchema
+from ecom.utils import Response, pagination
+from ecom.utils.serialization import dump, dump_many
+
+
+def place_order(idempotency_key, items=None, payment_token=None):
+    """Place an order from the given items, or from the cart of the user.
+
+    Args:
+        idempotency_key (str): Idempotency-Key of the request
+        items (list, optional): dicts of product_id / quantity. Defaults to None (the cart).
+        payment_token (str, optional): for the payment backend. Defaults to None.
+
+    Returns:
+        dict: the order, status "placed" until its fulfillment chain has run
+    """
+    try:
+        order, created = placement.place_order(
+            flask_praetorian.current_user_id(), idempotency_key, items, payment_token
+        )
+    except ValueError as exc:
+        return Response.failure(400, payload=str(exc))
+    except reservations.OutOfStock as exc:
+        return Response.failure(409, str(exc), payload={"product_id": exc.product_id})
+    except (reservations.InventoryUnavailable, store.CartUnavailable) as exc:
+        return Response.failure(503, str(exc))
+    if not created:
+        return Response.success(dump(OrderSchema, order), "Order already placed")
+    return Response.success(dump(OrderSchema, order), "Order placed"), 201
+
+
+def list_orders(limit=None, cursor=None):
+    """Orders of the user, newest first, keyset paginated on order_id."""
+    query = Order.query.filter_by(user_id=flask_praetorian.current_user_id())
+    try:
+        orders, page, links = pagination.paginate(
+            query, "order_id", [Order.order_id], limit=limit, cursor=cursor, descending=True
+        )
+    except ValueError as exc:
+        return Response.failure(400, payload=str(exc))
+    return Response.success(dump_many(OrderSchema, orders), pagination=page, links=links)
+
+
+def get_order(order_id):
+    order = Order.query.filter_by(
+        order_id=order_id, user_id=flask_praetorian.current_user_id()
+    ).first()
+    if order is None:
+        return Response.failure(404, "Order not found")
+    return Response.success(dump(OrderSchema, order))
@@ -0,0 +1,41 @@
+import flask_praetorian
+from flask_restx import Namespace, Resource, reqparse
+
+from ecom.idempotency import IDEMPOTENCY_HEADER, idempotency_key, idempotent
+from . import controllers
+
+api = Namespace("Orders", description="Order routes")
+
+
+@api.route("/")
+class Orders(Resource):
+    @api.doc(params={"limit": "page size", "cursor": "next_cursor / prev_cursor of the previous page"})
+    @flask_praetorian.auth_required
+    def get(self):
+        """List the orders of the user, newest first"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("limit", type=int, location="args")
+        parser.add_argument("cursor", type=str, location="args")
+        args = parser.parse_args()
+        return controllers.list_orders(args["limit"], args["cursor"])
+
+    @api.doc(headers={IDEMPOTENCY_HEADER: "unique per order, retries with the same key get the same response"})
+    @flask_praetorian.auth_required
+    @idempotent("orders")
+    def post(self):
+        """Place an order from `items`, or from the cart when no items are given"""
+        parser = reqparse.RequestParser()
+        parser.add_argument("items", type=dict, location="json", action="append")
+        parser.add_argument("payment_token", type=str, location="json")
+        args = parser.parse_args()
+        return controllers.place_order(
+            idempotency_key(), args["items"], args["payment_token"]
+        )
+
+
+@api.route("/<int:order_id>")
+class OrderDetail(Resource):
+    @flask_praetorian.auth_required
+    def get(self, order_id):
+        """Get an order of the user"""
+        return controllers.get_order(order_id)
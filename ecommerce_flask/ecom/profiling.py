@@ -0,0 +1,166 @@
+"""Sampling profiler middleware, safe to leave on for a production node.
+
+Instead of running cProfile on every request:
+
+* every `sample_rate`-th request is profiled with cProfile and dumped to
+  `profile_dir` (open with snakeviz, same as the werkzeug dumps)
+* a background thread snapshots the stacks of requests running longer than
+  `slow_threshold` every `sample_interval` and aggregates them into collapsed
+  stack files (`stacks-<timestamp>.folded`, flamegraph.pl / speedscope format)
+
+The directory is bounded to `max_files`, oldest files are removed first.
+"""
+
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from itertools import count
+
+
+class SamplingProfilerMiddleware:
+    """WSGI middleware profiling 1-in-N requests and sampling slow ones.
+
+    Args:
+        app: wsgi application
+        profile_dir (str): directory for the .prof and .folded files
+        sample_rate (int, optional): profile every Nth request, 0 to disable. Defaults to 100.
+        slow_threshold (float, optional): seconds after which a request is stack sampled. Defaults to 1.
+        sample_interval (float, optional): seconds between stack samples. Defaults to 0.01.
+        max_files (int, optional): files kept in `profile_dir`. Defaults to 200.
+        flush_interval (float, optional): seconds between .folded files. Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        app,
+        profile_dir,
+        sample_rate=100,
+        slow_threshold=1.0,
+        sample_interval=0.01,
+        max_files=200,
+        flush_interval=60,
+    ):
+        self._app = app
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.sample_interval = sample_interval
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self._counter = count(1)
+        self._active = {}
+        self._stacks = Counter()
+        self._sampler_pid = None
+        self._sampler_lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        self._ensure_sampler()
+        ident = threading.get_ident()
+        self._active[ident] = time.monotonic()
+        try:
+            if self.sample_rate and next(self._counter) % self.sample_rate == 0:
+                return self._profiled(environ, start_response)
+            return self._app(environ, start_response)
+        finally:
+            self._active.pop(ident, None)
+
+    def _profiled(self, environ, start_response):
+        response_body = []
+
+        def run_app():
+            app_iter = self._app(environ, start_response)
+            response_body.extend(app_iter)
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+        profile = cProfile.Profile()
+        started_at = time.time()
+        profile.runcall(run_app)
+        elapsed_ms = (time.time() - started_at) * 1000
+        path = environ.get("PATH_INFO", "").strip("/").replace("/", ".") or "root"
+        filename = (
+            f"{environ['REQUEST_METHOD']}.{path}.{elapsed_ms:.0f}ms.{started_at:.0f}.prof"
+        )
+        profile.dump_stats(os.path.join(self.profile_dir, filename))
+        self._rotate()
+        return [b"".join(response_body)]
+
+    def _ensure_sampler(self):
+        """Start the stack sampler once per process (workers are forked)."""
+        if self._sampler_pid == os.getpid() or not self.slow_threshold:
+            return
+        with self._sampler_lock:
+            if self._sampler_pid == os.getpid():
+                return
+            self._sampler_pid = os.getpid()
+            self._active.clear()
+            self._stacks.clear()
+            threading.Thread(
+                target=self._sample_loop, name="stack-sampler", daemon=True
+            ).start()
+
+    def _sample_loop(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            time.sleep(self.sample_interval)
+            now = time.monotonic()
+            slow = [
+                ident
+                for ident, started_at in list(self._active.items())
+                if now - started_at >= self.slow_threshold
+            ]
+            if slow:
+                frames = sys._current_frames()
+                for ident in slow:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._stacks[_collapse(frame)] += 1
+            if now >= next_flush:
+                try:
+                    self.flush()
+                except Exception as exc:
+                    logging.error("Not able to write stack samples. Exception : %s" % (exc))
+                next_flush = now + self.flush_interval
+
+    def flush(self):
+        """Write the aggregated stacks since the last flush to a .folded file."""
+        if not self._stacks:
+            return
+        stacks, self._stacks = self._stacks, Counter()
+        filename = os.path.join(
+            self.profile_dir, f"stacks-{os.getpid()}-{time.time():.0f}.folded"
+        )
+        with open(filename, "w") as folded:
+            for stack, samples in stacks.most_common():
+                folded.write(f"{stack} {samples}\n")
+        self._rotate()
+
+    def _rotate(self):
+        files = [
+            os.path.join(self.profile_dir, name)
+            for name in os.listdir(self.profile_dir)
+            if name.endswith((".prof", ".folded"))
+        ]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[: len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _collapse(frame):
+    """Collapse a stack into `root;...;leaf` with `file:function` frames."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
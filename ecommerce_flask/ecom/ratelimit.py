@@ -0,0 +1,164 @@
+"""Distributed rate limiting for the auth endpoints.
+
+Limits are sliding windows approximated with two fixed windows in redis (the
+previous window weighted by how much of it still overlaps). Workers lease a
+few tokens at a time from redis and spend them locally, so traffic far below
+the limit does not pay a redis round trip on every request. Denials are also
+remembered locally for a moment so a client hammering a closed limit does not
+hammer redis as well. Without redis the same limits are enforced per worker.
+
+Limits are configured per scope in `RATE_LIMITS`, e.g.
+`{"login": {"ip": "30/minute", "username": "10/minute"}}`.
+"""
+
+import functools
+import logging
+import math
+import threading
+import time
+
+from flask import current_app as app
+from flask import request
+from redis.exceptions import RedisError
+
+from ecom.extensions import get_redis_client
+from ecom.utils import Response
+from ecom.utils.local_cache import LocalTTLCache
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# KEYS[1] current window, KEYS[2] previous window
+# ARGV[1] limit, ARGV[2] period, ARGV[3] elapsed part of current window, ARGV[4] tokens
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local used = previous * (1 - tonumber(ARGV[3])) + current
+local available = math.floor(tonumber(ARGV[1]) - used)
+if available <= 0 then
+    return 0
+end
+local granted = math.min(available, tonumber(ARGV[4]))
+redis.call('INCRBY', KEYS[1], granted)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]) * 2)
+return granted
+"""
+
+_lock = threading.Lock()
+# key -> [tokens, window] leased from redis, or counted locally without redis
+_leases = LocalTTLCache(maxsize=100000)
+# key -> monotonic time until which requests are denied without asking redis
+_denied = LocalTTLCache(maxsize=100000)
+_scripts = {}
+
+
+def parse_limit(limit: str):
+    """Parse `"<count>/<period>"` like `"10/minute"` into (count, seconds)."""
+    count, period = limit.split("/")
+    return int(count), PERIODS[period.strip().rstrip("s")]
+
+
+def _script(client):
+    script = _scripts.get(id(client))
+    if script is None:
+        script = _scripts[id(client)] = client.register_script(SLIDING_WINDOW_SCRIPT)
+    return script
+
+
+def _lease_size(count):
+    # small limits are not leased, tokens parked on one worker would starve others
+    return max(1, min(app.config["RATE_LIMIT_LOCAL_LEASE"], count // 10))
+
+
+def hit(key, count, period) -> bool:
+    """Take one token for `key` from a `count` per `period` seconds limit.
+
+    Returns:
+        bool: True if the request is allowed
+    """
+    now = time.time()
+    window = int(now // period)
+    with _lock:
+        if (_denied.get(key) or 0) > time.monotonic():
+            return False
+        lease = _leases.get(key)
+        if lease is not None and lease[1] == window and lease[0] > 0:
+            lease[0] -= 1
+            return True
+
+    client = get_redis_client()
+    if client is None:
+        return _hit_local(key, count, window, period)
+    try:
+        granted = int(
+            _script(client)(
+                keys=[f"rl_{key}_{window}", f"rl_{key}_{window - 1}"],
+                args=[count, period, (now % period) / period, _lease_size(count)],
+            )
+        )
+    except RedisError as exc:
+        logging.error("Rate limiter could not reach redis. Exception : %s" % (exc))
+        return _hit_local(key, count, window, period)
+
+    with _lock:
+        if granted <= 0:
+            # roughly the time until one request slides out of the window
+            _denied.set(key, time.monotonic() + period / count, ttl=period)
+            return False
+        _leases.set(key, [granted - 1, window], ttl=period)
+    return True
+
+
+def _hit_local(key, count, window, period):
+    with _lock:
+        counter = _leases.get(key)
+        if counter is None or counter[1] != window:
+            counter = [count, window]
+            _leases.set(key, counter, ttl=period)
+        if counter[0] <= 0:
+            return False
+        counter[0] -= 1
+        return True
+
+
+def _client_ip():
+    # resolved by ProxyFix from the trusted hops only, see PROXY_FIX_X_FOR
+    return request.remote_addr
+
+
+def _username():
+    body = request.get_json(silent=True) or request.form
+    username = body.get("username") or body.get("email")
+    return username.strip().lower() if isinstance(username, str) else None
+
+
+def rate_limited(scope: str):
+    """Apply the per-IP and per-username limits of `RATE_LIMITS[scope]`.
+
+    Args:
+        scope (str): key of RATE_LIMITS, also part of the redis keys
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if app.config["RATE_LIMIT_ENABLED"]:
+                limits = app.config["RATE_LIMITS"].get(scope, {})
+                identities = {"ip": _client_ip(), "username": _username()}
+                for kind, limit in limits.items():
+                    identity = identities.get(kind)
+                    if identity is None:
+                        continue
+                    count, period = parse_limit(limit)
+                    if not hit(f"{scope}_{kind}_{identity}", count, period):
+                        return Response.failure(
+                            429,
+                            payload={
+                                "limit": limit,
+                                "retry_after": math.ceil(period / count),
+                            },
+                        )
+            return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -9,14 +9,14 @@ from werkzeug.exceptions import (
     Unauthorized,
     Forbidden,
     InternalServerError,
+    ServiceUnavailable,
+    TooManyRequests,
 )
 from werkzeug.utils import secure_filename
-from flask_restx import abort
 from flask import current_app as app
 from sqlalchemy import func
-from email_validator import validate_email
-from numerize import numerize
-from wtforms import validators
+
+from ecom.utils.password_policy import get_password_policy
 
 
 class Response:
@@ -91,6 +91,9 @@ class Response:
             }
         ```
         """
+        # imported here, loading restx is only paid by processes serving the API
+        from flask_restx import abort
+
         if msg is None:
             msg = Response.get_default_message(error_code)
         data = {"message": msg, "payload": payload}
@@ -110,6 +113,8 @@ class Response:
             "401": Unauthorized.description,
             "500": InternalServerError.description,
             "403": Forbidden.description,
+            "429": TooManyRequests.description,
+            "503": ServiceUnavailable.description,
         }
         return error_msg.get(str(error_code)) or "Error"
 
@@ -123,33 +128,8 @@ def check_for_string(data):
 def check_for_password(password_text):
     # Must be a string
     check_for_string(password_text)
-
-    # Check if password has atleast 12 characters
-    char_regex = re.compile(r"([\w\W]{12,})")
-    # Check if at least one lowercase letter
-    lower_regex = re.compile(r"[a-z]+")
-
-    # Check if atleast one upper case letter
-    upper_regex = re.compile(r"[A-Z]+")
-
-    # Check if at least one digit.
-    digit_regex = re.compile(r"[0-9]+")
-
-    # Check for non-alphanumeric
-    non_alpha_regex = re.compile(r"\W+")
-
-    if char_regex.findall(password_text) == []:
-        raise ValueError("Password must contain atleast 12 characters")
-    elif lower_regex.findall(password_text) == []:
-        raise ValueError("Password must contain atleast one lowercase character")
-    elif upper_regex.findall(password_text) == []:
-        raise ValueError("Password must contain atleast one uppercase character")
-    elif digit_regex.findall(password_text) == []:
-        raise ValueError("Password must contain atleast one digit character")
-    elif non_alpha_regex.findall(password_text) == []:
-        raise ValueError("Password must contain atleast one non alphanumeric character")
-
-    return password_text
+    # rules come from `PASSWORD_POLICY`, 12+ chars with lower, upper, digit and special
+    return get_password_policy().validate(password_text)
 
 
 class UserAlreadyExists(Exception):
@@ -163,29 +143,7 @@ class UserDoesNotExist(Exception):
 
 def generate_password():
     try:
-        password = ""
-        special_chars = "!@#$&~"
-        while True:
-            password += random.choice(string.ascii_uppercase)
-            password += random.choice(string.ascii_lowercase)
-            password += random.choice(string.digits)
-            password += random.choice(special_chars)
-            i = random.randint(12, 15)
-
-            for i in range(0, i):
-                password += random.choice(
-                    string.ascii_uppercase
-                    + string.ascii_lowercase
-                    + string.digits
-                    + special_chars
-                )
-            password = "".join(random.sample(password, len(password)))
-            try:
-                check_for_password(password)
-                break
-            except Exception:
-                pass
-        return password
+        return get_password_policy().generate()
     except Exception:
         return None
 
@@ -0,0 +1,93 @@
+"""JSON representation of the `rest_api` responses.
+
+`JSON_BACKEND` selects the encoder:
+
+* `orjson` - serializes in C straight to bytes, used by `auto` when installed
+* `stdlib` - `json.dumps` with compact separators, used by `auto` otherwise
+* `restx` - the flask-restx default (`json.dumps` with `RESTX_JSON`)
+
+`orjson` without the package installed falls back to `stdlib` with a warning.
+
+Both `orjson` and `stdlib` write datetime / date / time as ISO 8601, Decimal
+and UUID as strings and SQLAlchemy rows as objects; anything else falls back
+to `str()` like `RESTX_JSON = {"default": str}` did.
+"""
+
+import datetime
+import json
+import logging
+import uuid
+from decimal import Decimal
+
+from flask import current_app as app
+from flask import make_response
+from flask_restx.representations import output_json as restx_output_json
+from sqlalchemy.engine import Row, RowMapping
+
+try:
+    import orjson
+except ImportError:  # optional, `pip install orjson` to enable
+    orjson = None
+
+
+def default(obj):
+    """Convert the values json can't serialize natively."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (Decimal, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, Row):
+        return obj._asdict()
+    if isinstance(obj, RowMapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def dumps_orjson(data, indent=False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    # datetime, UUID and dataclasses are native, `default` sees the rest
+    return orjson.dumps(data, default=default, option=option)
+
+
+def dumps_stdlib(data, indent=False) -> bytes:
+    if indent:
+        dumped = json.dumps(data, default=default, ensure_ascii=False, indent=4)
+    else:
+        dumped = json.dumps(
+            data, default=default, ensure_ascii=False, separators=(",", ":")
+        )
+    return (dumped + "\n").encode("utf-8")
+
+
+BACKENDS = {"stdlib": dumps_stdlib}
+if orjson is not None:
+    BACKENDS["orjson"] = dumps_orjson
+
+
+_warned = set()
+
+
+def get_dumps(backend="auto"):
+    """Returns the `dumps(data, indent=False) -> bytes` function of the backend."""
+    if backend == "auto":
+        backend = "orjson" if orjson is not None else "stdlib"
+    elif backend == "orjson" and orjson is None:
+        if backend not in _warned:
+            _warned.add(backend)
+            logging.warning("JSON_BACKEND is orjson but orjson is not installed, using stdlib")
+        backend = "stdlib"
+    return BACKENDS[backend]
+
+
+def output_json(data, code, headers=None):
+    """flask-restx representation for `application/json`."""
+    backend = app.config["JSON_BACKEND"]
+    if backend == "restx":
+        return restx_output_json(data, code, headers)
+    resp = make_response(get_dumps(backend)(data, indent=app.debug), code)
+    resp.headers.extend(headers or {})
+    return resp
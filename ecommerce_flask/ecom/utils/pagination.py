@@ -0,0 +1,182 @@
+"""Keyset (seek) pagination for SQLAlchemy queries.
+
+Pages are selected with `WHERE (sort key) > (last key of the previous page)
+ORDER BY sort key LIMIT n` instead of OFFSET, so with an index on the sort key
+page 10000 costs the same as page one. Clients get opaque cursors in
+`pagination` / `links` and pass them back as `cursor`.
+
+The sort columns must be non null and end with a unique column (the primary
+key) so the order is total.
+"""
+
+import base64
+import datetime
+import json
+from urllib.parse import urlencode
+
+from flask import current_app as app
+from flask import request
+from sqlalchemy import and_, or_
+
+NEXT = "next"
+PREV = "prev"
+
+
+def encode_cursor(sort, values, direction=NEXT) -> str:
+    """Encode the sort key values of a row into an opaque cursor."""
+    payload = {
+        "s": sort,
+        "d": direction,
+        "v": [
+            {"dt": value.isoformat()} if isinstance(value, datetime.datetime) else value
+            for value in values
+        ],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor built by `encode_cursor`.
+
+    Returns:
+        tuple: sort name, direction and sort key values
+
+    Raises:
+        ValueError: the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = [
+            datetime.datetime.fromisoformat(value["dt"])
+            if isinstance(value, dict)
+            else value
+            for value in payload["v"]
+        ]
+        if payload["d"] not in (NEXT, PREV):
+            raise ValueError(payload["d"])
+        return payload["s"], payload["d"], values
+    except (ValueError, KeyError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def _seek(columns, values, forward):
+    """`(c1, c2, ...) > (v1, v2, ...)` expanded, row values don't use indexes everywhere."""
+    clauses = []
+    for index, column in enumerate(columns):
+        prefix = [columns[i] == values[i] for i in range(index)]
+        compare = column > values[index] if forward else column < values[index]
+        clauses.append(and_(*prefix, compare))
+    return or_(*clauses)
+
+
+def get_limit(limit) -> int:
+    """Clamp the requested page size to `PAGINATION_MAX_LIMIT`."""
+    if limit is None:
+        return app.config["PAGINATION_DEFAULT_LIMIT"]
+    return max(1, min(int(limit), app.config["PAGINATION_MAX_LIMIT"]))
+
+
+def _url(cursor, limit):
+    args = request.args.to_dict()
+    args["limit"] = limit
+    if cursor is None:
+        args.pop("cursor", None)
+    else:
+        args["cursor"] = cursor
+    return f"{request.base_url}?{urlencode(args)}"
+
+
+def page_metadata(sort, limit, count, next_cursor, prev_cursor):
+    """Build the `pagination` and `links` dicts of a keyset page.
+
+    Returns:
+        tuple: `pagination` dict and `links` dict
+    """
+    pagination = {
+        "limit": limit,
+        "count": count,
+        "sort": sort,
+        "has_next": bool(next_cursor),
+        "has_prev": bool(prev_cursor),
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+    }
+    links = {
+        "self": request.url,
+        "first": _url(None, limit),
+        "next": _url(next_cursor, limit) if next_cursor else None,
+        "prev": _url(prev_cursor, limit) if prev_cursor else None,
+    }
+    return pagination, links
+
+
+def paginate(
+    query,
+    sort,
+    sort_columns,
+    limit=None,
+    cursor=None,
+    descending=False,
+    to_cursor=None,
+    from_cursor=None,
+):
+    """Fetch one page of `query` ordered by `sort_columns`.
+
+    Args:
+        query (Query): filtered query, without order_by / limit
+        sort (str): name of the sort, stored in the cursor
+        sort_columns (list): mapped columns of the sort key, unique column last
+        limit (int, optional): page size. Defaults to PAGINATION_DEFAULT_LIMIT.
+        cursor (str, optional): cursor from a previous page. Defaults to None.
+        descending (bool, optional): sort direction. Defaults to False.
+        to_cursor (callable, optional): item -> cursor values, when they are not
+            the plain column values (e.g. not json serializable). Defaults to None.
+        from_cursor (callable, optional): inverse of `to_cursor`. Defaults to None.
+
+    Raises:
+        ValueError: the cursor is malformed or belongs to another sort
+
+    Returns:
+        tuple: items of the page, `pagination` dict and `links` dict
+    """
+    limit = get_limit(limit)
+    direction, values = NEXT, None
+    if cursor:
+        cursor_sort, direction, values = decode_cursor(cursor)
+        if cursor_sort != sort or len(values) != len(sort_columns):
+            raise ValueError("Cursor does not belong to this sort")
+        if from_cursor is not None:
+            values = from_cursor(values)
+
+    # walking back pages reverses the order, results are flipped below
+    forward = (direction == NEXT) != descending
+    if values is not None:
+        query = query.filter(_seek(sort_columns, values, forward))
+    order = [column.asc() if forward else column.desc() for column in sort_columns]
+    items = query.order_by(*order).limit(limit + 1).all()
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    if direction == PREV:
+        items.reverse()
+        has_next, has_prev = values is not None, has_more
+    else:
+        has_next, has_prev = has_more, values is not None
+
+    def key_of(item):
+        if to_cursor is not None:
+            return to_cursor(item)
+        return [getattr(item, column.key) for column in sort_columns]
+
+    next_cursor = (
+        encode_cursor(sort, key_of(items[-1]), NEXT) if has_next and items else None
+    )
+    prev_cursor = (
+        encode_cursor(sort, key_of(items[0]), PREV) if has_prev and items else None
+    )
+    pagination, links = page_metadata(
+        sort, limit, len(items), next_cursor, prev_cursor
+    )
+    return items, pagination, links
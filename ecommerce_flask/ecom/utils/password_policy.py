@@ -0,0 +1,129 @@
+import re
+import secrets
+import string
+
+from flask import current_app as app
+from flask import has_app_context
+
+# compiled once, `search` stops at the first matching character
+_LOWER = re.compile(r"[a-z]")
+_UPPER = re.compile(r"[A-Z]")
+_DIGIT = re.compile(r"[0-9]")
+_NON_ALPHA = re.compile(r"\W")
+
+DEFAULT_SPECIAL_CHARS = "!@#$&~"
+
+
+class PasswordPolicy:
+    """Password rules used for validation and generation.
+
+    Args:
+        min_length (int, optional): minimum number of characters. Defaults to 12.
+        require_lower (bool, optional): at least one of a-z. Defaults to True.
+        require_upper (bool, optional): at least one of A-Z. Defaults to True.
+        require_digit (bool, optional): at least one of 0-9. Defaults to True.
+        require_special (bool, optional): at least one non alphanumeric. Defaults to True.
+        special_chars (str, optional): special characters used by `generate`.
+    """
+
+    def __init__(
+        self,
+        min_length=12,
+        require_lower=True,
+        require_upper=True,
+        require_digit=True,
+        require_special=True,
+        special_chars=DEFAULT_SPECIAL_CHARS,
+    ):
+        self.min_length = min_length
+        self.special_chars = special_chars
+        # (pattern, error, alphabet used by the generator) in the order of checks
+        self._rules = []
+        if require_lower:
+            self._rules.append(
+                (
+                    _LOWER,
+                    "Password must contain atleast one lowercase character",
+                    string.ascii_lowercase,
+                )
+            )
+        if require_upper:
+            self._rules.append(
+                (
+                    _UPPER,
+                    "Password must contain atleast one uppercase character",
+                    string.ascii_uppercase,
+                )
+            )
+        if require_digit:
+            self._rules.append(
+                (
+                    _DIGIT,
+                    "Password must contain atleast one digit character",
+                    string.digits,
+                )
+            )
+        if require_special:
+            self._rules.append(
+                (
+                    _NON_ALPHA,
+                    "Password must contain atleast one non alphanumeric character",
+                    special_chars,
+                )
+            )
+        self._alphabet = (
+            string.ascii_uppercase + string.ascii_lowercase + string.digits + special_chars
+        )
+
+    def validate(self, password_text):
+        """Raise ValueError with the first rule the password breaks.
+
+        Returns:
+            str: the password when it is compliant
+        """
+        if len(password_text) < self.min_length:
+            raise ValueError(
+                f"Password must contain atleast {self.min_length} characters"
+            )
+        for pattern, error, _ in self._rules:
+            if pattern.search(password_text) is None:
+                raise ValueError(error)
+        return password_text
+
+    def generate(self, length=None):
+        """Build a compliant password directly, without generate-and-retry.
+
+        One character of every required class is placed first, the rest is drawn
+        from the full alphabet, then everything is shuffled.
+
+        Args:
+            length (int, optional): password length. Defaults to 16-19 characters.
+
+        Returns:
+            str: random password satisfying the policy
+        """
+        if length is None:
+            length = max(self.min_length, 16) + secrets.randbelow(4)
+        length = max(length, self.min_length, len(self._rules))
+        chars = [secrets.choice(alphabet) for _, _, alphabet in self._rules]
+        chars += [secrets.choice(self._alphabet) for _ in range(length - len(chars))]
+        secrets.SystemRandom().shuffle(chars)
+        return "".join(chars)
+
+
+_default_policy = PasswordPolicy()
+_policies = {}
+
+
+def get_password_policy() -> PasswordPolicy:
+    """Returns the policy configured in `PASSWORD_POLICY` of the current app."""
+    if not has_app_context():
+        return _default_policy
+    rules = app.config.get("PASSWORD_POLICY")
+    if not rules:
+        return _default_policy
+    key = tuple(sorted(rules.items()))
+    policy = _policies.get(key)
+    if policy is None:
+        policy = _policies[key] = PasswordPolicy(**rules)
+    return policy
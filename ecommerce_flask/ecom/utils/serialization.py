@@ -0,0 +1,140 @@
+"""Compiled dumpers for marshmallow schemas.
+
+`Schema.dump` walks every field of every object through the marshmallow
+machinery (accessor, `get_value`, `_serialize`). For list endpoints that is
+most of the request time, so `get_dumper` builds one plain function per schema
+and field projection instead, kept in a per process LRU of `MAX_DUMPERS`:
+
+* plain column fields (string, number, datetime, UUID, ...) are read with
+  direct attribute access in a generated dict literal, their values are left
+  for the JSON encoder (`ecom.utils.json_encoder`) to convert
+* any other field (nested, method, dotted attribute, custom format) still
+  goes through `field.serialize`, so its output is unchanged
+"""
+
+import threading
+from collections import OrderedDict
+
+from marshmallow import fields as ma_fields
+from marshmallow import missing
+
+# fields whose `_serialize` returns the attribute value as is, or a value the
+# JSON encoder writes identically
+_PASSTHROUGH = {
+    ma_fields.Raw,
+    ma_fields.String,
+    ma_fields.Integer,
+    ma_fields.Float,
+    ma_fields.Decimal,
+    ma_fields.UUID,
+    ma_fields.DateTime,
+    ma_fields.Date,
+    ma_fields.Time,
+}
+
+# projections come from the `fields=` query parameter, any subset is possible
+MAX_DUMPERS = 256
+
+_dumpers = OrderedDict()
+_lock = threading.Lock()
+
+
+def parse_fields(value):
+    """Parse a `fields=a,b,c` query parameter.
+
+    Returns:
+        tuple: field names, None when not given
+    """
+    if not value:
+        return None
+    names = tuple(name.strip() for name in value.split(",") if name.strip())
+    return names or None
+
+
+def _is_passthrough(name, field):
+    attribute = field.attribute or name
+    return (
+        type(field) in _PASSTHROUGH
+        and attribute.isidentifier()
+        and getattr(field, "format", None) is None
+        and not getattr(field, "as_string", False)
+    )
+
+
+class Dumper:
+    """Precompiled `dump` of a schema, see `get_dumper`."""
+
+    def __init__(self, schema):
+        self.schema = schema
+        direct = []
+        serializers = []
+        for name, field in schema.dump_fields.items():
+            key = field.data_key or name
+            if _is_passthrough(name, field):
+                direct.append(f"{key!r}: obj.{field.attribute or name}")
+            else:
+                serializers.append((key, name, field))
+
+        namespace = {"_missing": missing}
+        lines = ["def dump(obj):", f"    out = {{{', '.join(direct)}}}"]
+        for index, (key, name, field) in enumerate(serializers):
+            namespace[f"_serialize{index}"] = field.serialize
+            namespace[f"_name{index}"] = name
+            lines.append(
+                f"    value = _serialize{index}(_name{index}, obj, _accessor)"
+            )
+            lines.append("    if value is not _missing:")
+            lines.append(f"        out[{key!r}] = value")
+        lines.append("    return out")
+        namespace["_accessor"] = schema.get_attribute
+        exec("\n".join(lines), namespace)
+        self.dump = namespace["dump"]
+
+    def dump_many(self, objs):
+        dump = self.dump
+        return [dump(obj) for obj in objs]
+
+
+def get_dumper(schema_cls, only=None) -> Dumper:
+    """Returns the cached dumper of `schema_cls` restricted to `only` fields.
+
+    Args:
+        schema_cls (type): marshmallow schema class
+        only (tuple, optional): field names to keep. Defaults to None (all).
+
+    Raises:
+        ValueError: `only` contains fields the schema does not have
+    """
+    if only:
+        declared = schema_cls._declared_fields
+        # "nested.field" projections are checked on their first part
+        unknown = sorted(
+            name for name in set(only) if name.split(".", 1)[0] not in declared
+        )
+        if unknown:
+            raise ValueError(f"Invalid fields for {schema_cls.__name__}: {unknown}.")
+        # the same projection in any order or with repeats shares one dumper
+        only = tuple(sorted(set(only)))
+    key = (schema_cls, only or None)
+    with _lock:
+        dumper = _dumpers.get(key)
+        if dumper is not None:
+            _dumpers.move_to_end(key)
+            return dumper
+    # compiled outside the lock, a concurrent miss only builds it twice
+    dumper = Dumper(schema_cls(only=only))
+    with _lock:
+        _dumpers[key] = dumper
+        if len(_dumpers) > MAX_DUMPERS:
+            _dumpers.popitem(last=False)
+    return dumper
+
+
+def dump(schema_cls, obj, only=None):
+    """Serialize one object, encodes to the same JSON as `schema_cls(only=only).dump(obj)`."""
+    return get_dumper(schema_cls, only).dump(obj)
+
+
+def dump_many(schema_cls, objs, only=None):
+    """Serialize a list of objects with the `many=True` fast path."""
+    return get_dumper(schema_cls, only).dump_many(objs)